@@ -24,10 +24,31 @@ DEFAULT_kwargs = {
     'loggingconf': os.path.join(DEFAULT_DATA_PATH, 'logging.json'),
     'mtime_store_path': os.path.join(DEFAULT_DATA_PATH, 'mtimes.json'),
     'heartbeat_file': os.path.join(DEFAULT_DATA_PATH, '.heartbeat'),
+    'source_index_path': os.path.join(DEFAULT_DATA_PATH, 'source_index.json'),
+    'source_walk_workers': 8,
+    'status_file': os.path.join(DEFAULT_DATA_PATH, 'encode_status.json'),
+    'encode_ledger_path': os.path.join(DEFAULT_DATA_PATH, 'encode_ledger.jsonl'),
+    'failure_ledger_path': os.path.join(DEFAULT_DATA_PATH, 'encode_failures.json'),
+    'intermediate_cache_path': os.path.join(DEFAULT_DATA_PATH, 'intermediate_cache'),
+    'intermediate_cache_max_mb': 2048,
     'cmd_ffmpeg': 'nice ffmpeg',
 }
 
 
+def acquire_lock(lockfile_path, blocking=False):
+    """
+    Exclusive lock shared by all processmedia tasks.
+    Returns the open lockfile (close it to release) or None if another process holds the lock
+    """
+    lockfile = open(lockfile_path, 'w')
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except IOError:
+        lockfile.close()
+        return None
+    return lockfile
+
+
 def main(
         name,
         main_function,
@@ -37,7 +58,7 @@ def main(
         description='',
         epilog='',
         folder_type_to_derive_mtime=None,
-        lock=True,  # True = Exclusive execution. No other processmedia task can run while exclusive lock is on.
+        lock=True,  # True = Exclusive execution. No other processmedia task can run while exclusive lock is on. (or a function of kwargs)
 ):
 
     parser = argparse.ArgumentParser(
@@ -51,6 +72,12 @@ def main(
     parser.add_argument('--path_processed', action='store', help='')
     parser.add_argument('--path_meta', action='store', help='')
 
+    parser.add_argument('--meta_store', action='store', choices=('json', 'sqlite'), help='meta storage backend - a json file per track in path_meta, or a single sqlite database in path_meta (see migrate_meta.py) default:json')
+
+    parser.add_argument('--num_images', action='store', type=int, help='number of thumbnail images extracted for each track (must be the same for encode, import and cleanup)')
+    parser.add_argument('--preview_clip_seconds', action='store', type=int, help='previews are an excerpt of this many seconds from the first lyric (default: full length preview) (must be the same for encode, import and cleanup)')
+    parser.add_argument('--hls', action='store_true', default=None, help='also create adaptive bitrate HLS renditions of each video (must be the same for encode, import and cleanup)')
+
     parser.add_argument('--force', action='store_true', help='ignore mtime optimisation check')
 
     parser.add_argument('--loggingconf', action='store', help=f" default:{DEFAULT_kwargs['loggingconf']}")
@@ -87,11 +114,11 @@ def main(
     # Process str values into other data types
     additional_arguments_processing_function(kwargs)
 
+    if callable(lock):
+        lock = lock(kwargs)
     if lock:
-        try:
-            lockfile = open(kwargs['lockfile'], 'w')
-            fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
+        lockfile = acquire_lock(kwargs['lockfile'])
+        if not lockfile:
             log.warn('Existing process already active. Aborting.')
             sys.exit(0)
 
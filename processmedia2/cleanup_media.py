@@ -14,12 +14,12 @@ VERSION = '0.0.0'
 
 def cleanup_media(**kwargs):
     meta_manager = MetaManagerExtended(**kwargs)
-    meta_manager.load_all()
 
+    # Processed files are derived from the source hashs in the meta summaries - no meta needs to be fully loaded
     all_known_file_hashs = {
         processed_file.hash
-        for m in meta_manager.meta_items
-        for processed_file in m.processed_files.values()
+        for summary in meta_manager.summaries().values()
+        for processed_file in meta_manager.processed_files_manager.get_processed_files(summary['source_hashs']).values()
     }
     unlinked_files = (f for f in meta_manager.processed_files_manager.scan if f.file_no_ext and f.file_no_ext not in all_known_file_hashs)
 
@@ -2,8 +2,10 @@
 
 import os.path
 import tempfile
-import random
+import time
 from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 from clint.textui.progress import bar as progress_bar
 
@@ -14,8 +16,17 @@ from calaldees.files.exts import file_ext
 from processmedia_libs import EXTS, PENDING_ACTION
 from processmedia_libs.external_tools import ProcessMediaFilesWithExternalTools
 from processmedia_libs import subtitle_processor_with_codecs as subtitle_processor
+from processmedia_libs.subtitle_processor import preview_clip_window
 from processmedia_libs.meta_overlay import MetaManagerExtended
+from processmedia_libs.meta_summary import SummaryMeta
 from processmedia_libs.fileset_change_monitor import FilesetChangeMonitor
+from processmedia_libs.step_graph import Step, StepFailure, run_step_graph
+from processmedia_libs.encode_scheduler import PROCESS_ORDER_FUNCS, DEFAULT_ORDER_FUNC, estimate_costs, seconds_per_pixel_second
+from processmedia_libs.encode_status import EncodeStatus
+from processmedia_libs.encode_ledger import EncodeLedger
+from processmedia_libs.failure_ledger import FailureLedger, DEFAULT_BACKOFF_SECONDS, DEFAULT_QUARANTINE_FAILURES
+from processmedia_libs.intermediate_cache import IntermediateCache, cache_key
+from processmedia_libs.hls import HLS_SEGMENT_SECONDS, HLS_CRF, hls_output_filenames, rewrite_playlist, relative_uri
 
 import logging
 log = logging.getLogger(__name__)
@@ -23,29 +34,36 @@ log = logging.getLogger(__name__)
 
 VERSION = '0.0.0'
 
-def shuffle(iterable):
-    rendered_list = list(iterable)
-    random.shuffle(rendered_list)
-    return rendered_list
-DEFAULT_ORDER_FUNC = 'sorted'
-PROCESS_ORDER_FUNCS = {
-    'sorted': sorted,
-    'random': shuffle,
-    'none': lambda x: x,
-}
-
-def encode_media(process_order_function=PROCESS_ORDER_FUNCS[DEFAULT_ORDER_FUNC], **kwargs):
-    meta_manager = MetaManagerExtended(**kwargs)  #path_meta=kwargs['path_meta'], path_source=kwargs['path_source']
-    meta_manager.load_all()
 
-    encoder = Encoder(meta_manager, **kwargs)
+def encode_media(process_order_function=PROCESS_ORDER_FUNCS[DEFAULT_ORDER_FUNC], workers=1, **kwargs):
+    meta_manager = MetaManagerExtended(**kwargs)  #path_meta=kwargs['path_meta'], path_source=kwargs['path_source']
+    # Only the summaries are needed to select/schedule - the full meta is loaded per track when encoded
+    summary_metas = tuple(map(SummaryMeta, meta_manager.summaries().values()))
 
     # In the full system, encode will probably be driven from a rabitmq endpoint.
     # For testing locally we are monitoring the 'pendings_actions' list
-    for name in progress_bar(
-        process_order_function(
-            m.name for m in meta_manager.meta.values()
-            if PENDING_ACTION['encode'] in m.pending_actions or not m.source_hashs
+    # The encode rate is derived from the history of all tracks (not just the ones pending)
+    encode_rate = seconds_per_pixel_second(summary_metas)
+    failures = _failure_ledger(**kwargs)
+    def is_blocked(m):
+        # The summary holds the source_hash of the last encode - only tracks with a recorded failure need their full meta loaded
+        if kwargs.get('retry_failed') or not failures.blocked(m.source_hash):
+            return False
+        meta_manager.load(m.name)
+        m = meta_manager.get(m.name)
+        m.update_source_hashs()  # The sources may have changed (been fixed) since the last encode
+        blocked = failures.blocked(m.source_hash)
+        if blocked:
+            log.info('Encode: %s skipped - %s', m.name, blocked)
+        return blocked
+    metas = tuple(process_order_function(
+        (
+            m for m in summary_metas
+            if (PENDING_ACTION['encode'] in m.pending_actions or not m.source_hashs) and not is_blocked(m)
+        ),
+        workers=workers,
+        encode_rate=encode_rate,
+        **kwargs
         #(
             #'AKB0048 Next Stage - ED1 - Kono Namida wo Kimi ni Sasagu',
             #'Cuticle Tantei Inaba - OP - Haruka Nichijou no Naka de',
@@ -66,28 +84,88 @@ def encode_media(process_order_function=PROCESS_ORDER_FUNCS[DEFAULT_ORDER_FUNC],
             # 'Fullmetal Alchemist - OP1 - Melissa',  # Exhibits high bitrate pausing at end
             # 'Samurai Champloo - OP - Battlecry',  # Missing title sub with newline
             # 'KAT-TUN Your side [Instrumental]',
-        )
-    ):
+    ))
+    names = tuple(m.name for m in metas)
+    EncodeStatus(kwargs.get('status_file')).set_backlog(estimate_costs(metas, rate=encode_rate), workers=workers)
+
+    if workers > 1:
+        # Each worker process has it's own MetaManager + Encoder.
+        # Encoder.encode takes a per-name lock so workers never process the same name.
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_encode_worker, initargs=(kwargs, )) as executor:
+            for _ in progress_bar(executor.map(_encode_worker, names), expected_size=len(names)):
+                pass
+        return
+
+    encoder = Encoder(meta_manager, **kwargs)
+    for name in progress_bar(names):
         encoder.encode(name)
 
 
+def _failure_ledger(failure_ledger_path=None, failure_backoff_seconds=None, failure_quarantine_count=None, **kwargs):
+    return FailureLedger(
+        failure_ledger_path,
+        backoff_seconds=int(failure_backoff_seconds or DEFAULT_BACKOFF_SECONDS),
+        quarantine_failures=int(failure_quarantine_count or DEFAULT_QUARANTINE_FAILURES),
+    )
+
+
+_worker_encoder = None
+def _init_encode_worker(kwargs):
+    global _worker_encoder
+    _worker_encoder = Encoder(MetaManagerExtended(**kwargs), **kwargs)
+def _encode_worker(name):
+    return _worker_encoder.encode(name)
+
+
 class Encoder(object):
     """
     """
 
-    def __init__(self, meta_manager=None, postmortem=False, heartbeat_file=None, **kwargs):  #  ,path_meta=None, path_processed=None, path_source=None, **kwargs
+    def __init__(self, meta_manager=None, postmortem=False, heartbeat_file=None, encode_step_workers=4, status_file=None, encode_ledger_path=None, intermediate_cache_path=None, intermediate_cache_max_mb=None, encode_chunk_seconds=None, encode_chunk_workers=None, **kwargs):  #  ,path_meta=None, path_processed=None, path_source=None, **kwargs
         self.meta_manager = meta_manager  # or MetaManagerExtended(path_meta=path_meta, path_source=path_source, path_processed=path_processed)  # This 'or' needs to go
         self.pdb = postmortem
         self.external_tools = ProcessMediaFilesWithExternalTools(
             **{k: v for k, v in kwargs.items() if k in ('cmd_ffpmeg', 'cmd_ffprobe', 'cmd_sox', 'cmd_jpegoptim') and v}
         )
         self._heartbeat_file = Path(heartbeat_file) if heartbeat_file else None
+        self.encode_step_workers = encode_step_workers
+        self.status = EncodeStatus(status_file)
+        self.ledger = EncodeLedger(encode_ledger_path)
+        self.failures = _failure_ledger(**kwargs)
+        self.encode_chunk_seconds = int(encode_chunk_seconds) if encode_chunk_seconds else None
+        self.encode_chunk_workers = int(encode_chunk_workers) if encode_chunk_workers else None
+        self.intermediate_cache = IntermediateCache(
+            intermediate_cache_path,
+            max_size_bytes=int(intermediate_cache_max_mb) * 1024 * 1024 if intermediate_cache_max_mb else None,
+        )
+
+    @property
+    def preview_clip_seconds(self):
+        return self.meta_manager.processed_files_manager.preview_clip_seconds
 
     def heartbeat(self):
         if self._heartbeat_file:
             self._heartbeat_file.touch()
 
+    def _progress(self, m, step, progress, duration=None):
+        """
+        Called for each progress update parsed from a long running ffmpeg encode
+        duration: length of the output being encoded (default the whole source)
+        """
+        self.heartbeat()
+        self.status.track_progress(m.name, step, duration or m.source_details.get('duration'), progress)
+
     def encode(self, name):
+        with self.meta_manager.lock(name) as locked:
+            if not locked:
+                log.info('Encode: %s is locked by another process - skipping', name)
+                return False
+            self.status.track_started(name)
+            success = self._encode(name)
+            self.status.track_finished(name, success)
+            return success
+
+    def _encode(self, name):
         """
         Todo: save the meta on return ... maybe use a context manager
         """
@@ -95,50 +173,130 @@ class Encoder(object):
         self.meta_manager.load(name)
         m = self.meta_manager.get(name)
 
-        def encode_steps(m):
-            yield m.update_source_hashs()
-            self.heartbeat()
-            yield self._encode_primary_video_from_meta(m)
-            self.heartbeat()
-            yield self._extract_source_details_safeguard(m)
-            yield self._encode_srt_from_meta(m)
-            yield self._encode_preview_video_from_meta(m)
-            self.heartbeat()
-            yield self._encode_images_from_meta(m)
-            yield self._process_tags_from_meta(m)
         try:
-            if all(encode_steps(m)):
+            encode_steps = self._encode_steps(m)
+            results = run_step_graph(encode_steps, max_workers=self.encode_step_workers)
+            if len(results) == len(encode_steps) and all(results.values()):
                 try:
                     m.pending_actions.remove(PENDING_ACTION['encode'])
                 except ValueError:
                     pass
                 self.meta_manager.save(name)
+                self.failures.record_success(m.source_hash)
+                return True
+            reason = 'failed: {} not run: {}'.format(
+                ', '.join(
+                    f'{step_name} ({result.reason})' if isinstance(result, StepFailure) else step_name
+                    for step_name, result in results.items() if not result
+                ) or '-',
+                ', '.join(step.name for step in encode_steps if step.name not in results) or '-',
+            )
+            # Only a structurally broken source is quarantined straight away - anything else is retried with backoff
+            quarantine = any(isinstance(result, StepFailure) and result.quarantine for result in results.values())
         except Exception as ex:
             log.exception('Failed to encode {}'.format(name))
+            reason = '{}: {}'.format(type(ex).__name__, ex)
+            quarantine = False
+        # The summary must hold the source_hash the failure is recorded against (see `is_blocked` in `encode_media`)
+        self.meta_manager.save(name)
+        self.failures.record_failure(m.source_hash, name, reason, quarantine=quarantine)
+        return False
+
+    def _encode_steps(self, m):
+        """
+        The encode steps for a single meta item, described as a dependency graph.
+        Steps that do not depend on each other (e.g. the primary video and the srt)
+        are run concurrently.
+        """
+        def step(name, method, depends_on=(), output_types=()):
+            def _step():
+                self.external_tools.reset_usage()
+                start = time.time()
+                result = method(m)
+                self._record_step(m, name, result, time.time() - start, output_types)
+                self.heartbeat()
+                return result
+            return Step(name, _step, depends_on)
+        return (
+            step('source_hashs', lambda m: m.update_source_hashs()),
+            step('source_details', self._probe_source_details_from_meta, ('source_hashs', )),
+            step('preflight', self._preflight_from_meta, ('source_details', )),
+            step('primary_video', self._encode_primary_video_from_meta, ('preflight', ), output_types=('video', 'preview')),
+            step('srt', self._encode_srt_from_meta, ('source_hashs', ), output_types=('srt', )),
+            step('preview_video', self._encode_preview_video_from_meta, ('primary_video', 'srt'), output_types=('preview', )),
+            step('images', self._encode_images_from_meta, ('primary_video', ), output_types=('image', )),
+            step('tags', self._process_tags_from_meta, ('source_hashs', ), output_types=('tags', )),
+            step('hls', self._encode_hls_from_meta, ('primary_video', ), output_types=('hls', 'hls_rendition')),
+        )
+
+    def _record_step(self, m, name, result, wall_seconds, output_types):
+        """
+        Steps that ran external processes are recorded in the encode ledger.
+        Steps that had nothing to do (their outputs already existed) are not recorded as they would skew the throughput report.
+        """
+        usage = self.external_tools.usage
+        if not usage['runs']:
+            return
+        def total_size(files):
+            return sum(os.path.getsize(f) for f in files if f and os.path.isfile(f))
+        self.ledger.record(
+            name=m.name,
+            source_hash=m.source_hash,
+            step=name,
+            success=bool(result),
+            wall_seconds=round(wall_seconds, 3),
+            cpu_seconds=round(usage['cpu_seconds'], 3),
+            speed=usage['speed'],
+            input_bytes=total_size(f.get('absolute') for f in m.source_files.values() if f),
+            output_bytes=total_size(f.absolute for f in m.processed_files.values() if f.attachment_type in output_types),
+            duration=m.source_details.get('duration'),
+            width=m.source_details.get('width'),
+            height=m.source_details.get('height'),
+            video_codec=m.source_details.get('video', {}).get('format'),
+        )
+
+    def _probe_source_details_from_meta(self, m):
+        """
+        If the primary video is to be (re)encoded the source may have changed since
+        it was last probed, so the source details are always refreshed in that case.
+        """
+        return self._extract_source_details_safeguard(m, force=not m.processed_files['video'].exists)
+
+    def _probe_source_file(self, m, file_type):
+        """
+        Probe results are cached in the meta against the hash of the source file.
+        An unchanged source file is never probed twice.
+        """
+        source_file = m.source_files[file_type]
+        if not source_file.get('absolute'):
+            return {}
+        cache_key = source_file.get('hash')
+        cached_probe = m.probe_cache.get(cache_key) if cache_key else None
+        # Probes cached before the video stream index was recorded are refreshed
+        if cached_probe and not ('video' in cached_probe and 'stream' not in cached_probe['video']):
+            return dict(cached_probe)
+        probe = self.external_tools.probe_media(source_file['absolute'])
+        if cache_key and probe:
+            m.probe_cache[cache_key] = probe
+        return dict(probe)
 
     def _update_source_details(self, m):
         source_details = {}
 
         # Probe Image
-        source_image = m.source_files['image'].get('absolute')
-        if source_image:
-            source_details.update({
-                k: v for k, v in self.external_tools.probe_media(source_image).items()
-                if k in ('width', 'height')
-            })
+        source_details.update({
+            k: v for k, v in self._probe_source_file(m, 'image').items()
+            if k in ('width', 'height')
+        })
 
         # Probe Audio
-        source_audio = m.source_files['audio'].get('absolute')
-        if source_audio:
-            source_details.update({
-                k: v for k, v in self.external_tools.probe_media(source_audio).items()
-                if k in ('duration',)
-            })
+        source_details.update({
+            k: v for k, v in self._probe_source_file(m, 'audio').items()
+            if k in ('duration',)
+        })
 
         # Probe Video
-        source_video = m.source_files['video'].get('absolute')
-        if source_video:
-            source_details.update(self.external_tools.probe_media(source_video))
+        source_details.update(self._probe_source_file(m, 'video'))
 
         m.source_details.update(source_details)
 
@@ -156,13 +314,54 @@ class Encoder(object):
             return False
         return True
 
+    def _preflight_from_meta(self, m):
+        """
+        Cheap checks that the sources are intact before committing to a long encode.
+        Only run if the video/preview/images need (re)encoding.
+
+        Structural problems (no video stream, unparsable subtitles) quarantine the source.
+        A failed decode test may be transient (slow mount, timeout) so it is an ordinary
+        failure - retried with backoff and only quarantined if it keeps failing.
+        """
+        if all(
+            processed_file.exists
+            for processed_file in m.processed_files.values()
+            if processed_file.attachment_type in ('video', 'preview', 'image')
+        ):
+            return True
+
+        problems = []
+        if m.source_files['video'] and not (m.source_details.get('width') and m.source_details.get('height')):
+            problems.append('no video stream')
+        source_sub_absolute = m.source_files['sub'].get('absolute')
+        if source_sub_absolute and os.path.exists(source_sub_absolute) and not subtitle_processor.parse_subtitles(filename=source_sub_absolute):
+            problems.append('unable to parse any subtitles from {}'.format(source_sub_absolute))
+        if problems:
+            log.error('Preflight failed for %s: %s', m.name, '; '.join(problems))
+            return StepFailure('; '.join(problems), quarantine=True)
+
+        for file_type in ('video', 'audio'):
+            source_file_absolute = m.source_files[file_type].get('absolute')
+            if source_file_absolute and os.path.exists(source_file_absolute):
+                decode_success, decode_result = self.external_tools.decode_test(source_file_absolute, duration=m.source_details.get('duration'))
+                if not decode_success:
+                    problems.append(decode_result)
+        if problems:
+            log.error('Preflight decode test failed for %s: %s', m.name, '; '.join(problems))
+            return StepFailure('; '.join(problems))
+        return True
+
     def _encode_primary_video_from_meta(self, m):
+        """
+        If the preview video is also required, it is rendered from the same decode as the primary video
+        """
         target_file = m.processed_files['video']
+        preview_target_file = m.processed_files['preview']
         if target_file.exists:
             log.debug('Processed Destination was created with the same input sources - no encoding required')
             return True
 
-        extract_source_details_status = self._extract_source_details_safeguard(m, force=True)
+        extract_source_details_status = self._extract_source_details_safeguard(m)
         if not extract_source_details_status:
             return False
 
@@ -172,12 +371,22 @@ class Encoder(object):
             absolute_video_to_encode = m.source_files['video'].get('absolute')
 
             # 2.a) Convert Image to Video
+            # Intermediates are keyed by source hash + the parameters that affect them, so they can be reused by retries
             if m.source_files['image'] and not absolute_video_to_encode:
-                absolute_video_to_encode = os.path.join(tempdir, 'image.mp4')
-                self.external_tools.encode_image_to_video(
-                    source=m.source_files['image']['absolute'],
-                    destination=absolute_video_to_encode,
-                    **m.source_details
+                absolute_video_to_encode = self.intermediate_cache.get_or_create(
+                    cache_key(
+                        'image_to_video',
+                        m.source_files['image'].get('hash'),
+                        self.external_tools.config['encode_image_to_video'],
+                        *(m.source_details.get(k) for k in ('duration', 'width', 'height')),
+                    ),
+                    'image.mp4',
+                    lambda destination: self.external_tools.encode_image_to_video(
+                        source=m.source_files['image']['absolute'],
+                        destination=destination,
+                        **m.source_details
+                    ).success,
+                    tempdir,
                 )
 
             if not absolute_video_to_encode:
@@ -195,49 +404,95 @@ class Encoder(object):
                 if not os.path.exists(absolute_subtitle):
                     log.error('Subtitles to encode does not exist {}'.format(absolute_subtitle))
                     return False
-                subtitles = subtitle_processor.parse_subtitles(filename=absolute_subtitle)
-                if not subtitles:
-                    log.error(
-                        'Subtitle file explicity given, but was unable to parse any subtitles from it. '
-                        'There may be an issue with parsing. '
-                        'A Common cause is SSA files that have subtitles aligned at top are ignored. '
-                        '{}'.format(m.source_files['sub']['absolute'])
-                    )
-                    return False
 
-                # Output styled subtiles as SSA
-                absolute_ssa_to_encode = os.path.join(tempdir, 'subs.ssa')
-                with open(absolute_ssa_to_encode, 'w', encoding='utf-8') as subfile:
-                    subfile.write(
-                        subtitle_processor.create_ssa(subtitles, width=m.source_details['width'], height=m.source_details['height'])
-                    )
+                def create_ssa(destination):
+                    subtitles = subtitle_processor.parse_subtitles(filename=absolute_subtitle)
+                    if not subtitles:
+                        log.error(
+                            'Subtitle file explicity given, but was unable to parse any subtitles from it. '
+                            'There may be an issue with parsing. '
+                            'A Common cause is SSA files that have subtitles aligned at top are ignored. '
+                            '{}'.format(m.source_files['sub']['absolute'])
+                        )
+                        return False
+                    # Output styled subtiles as SSA
+                    with open(destination, 'w', encoding='utf-8') as subfile:
+                        subfile.write(
+                            subtitle_processor.create_ssa(subtitles, width=m.source_details['width'], height=m.source_details['height'])
+                        )
+                    return True
+
+                absolute_ssa_to_encode = self.intermediate_cache.get_or_create(
+                    cache_key('ssa', m.source_files['sub'].get('hash'), m.source_details['width'], m.source_details['height']),
+                    'subs.ssa',
+                    create_ssa,
+                    tempdir,
+                )
+                if not absolute_ssa_to_encode:
+                    return False
 
             # 3.) Encode
-            encode_steps = (
-                # 3.a) Render audio and normalize
-                lambda: self.external_tools.encode_audio(
-                    source=m.source_files['audio'].get('absolute') or m.source_files['video'].get('absolute'),
-                    destination=os.path.join(tempdir, 'audio.wav'),
-                ),
-
-                # 3.b) Render video with subtitles and mux new audio.
-                lambda: self.external_tools.encode_video(
+            encode_start = time.time()
+            absolute_audio_to_encode = m.source_files['audio'].get('absolute') or m.source_files['video'].get('absolute')
+
+            # 3.a) Measure audio peak. The audio is normalized while encoding the video - no intermediate audio files
+            encode_success, audio_peak = self.external_tools.probe_audio_peak(absolute_audio_to_encode)
+            if not encode_success:
+                if self.pdb:
+                    import pdb ; pdb.set_trace()
+                log.error(audio_peak)
+                return False
+
+            # The probed video stream (a video may contain cover art streams before it)
+            video_stream = m.source_details.get('video', {}).get('stream') if m.source_files['video'].get('absolute') == absolute_video_to_encode else None
+
+            # 3.b) Fast path - a clean source with no subtitles to burn in is stream copied (the preview is rendered by the preview step)
+            remux = (
+                not absolute_ssa_to_encode and
+                m.source_files['video'].get('absolute') and
+                self.external_tools.can_remux_video(m.source_details)
+            )
+            if remux:
+                log.info('Remux: %s already meets the target spec - copying video stream', m.name)
+                encode_success, cmd_result = self.external_tools.remux_video(
+                    video_source=absolute_video_to_encode,
+                    audio_source=absolute_audio_to_encode,
+                    destination=os.path.join(tempdir, 'video.mp4'),
+                    audio_gain=-audio_peak,
+                    audio_duration=m.source_details.get('duration'),
+                    progress=partial(self._progress, m, 'primary_video'),
+                    video_stream=video_stream,
+                )
+            # 3.c) Render video with subtitles and mux faded + normalized audio.
+            else:
+                encode_success, cmd_result = self.external_tools.encode_video(
                     video_source=absolute_video_to_encode,
-                    audio_source=os.path.join(tempdir, 'audio.wav'),
+                    audio_source=absolute_audio_to_encode,
                     subtitle_source=absolute_ssa_to_encode,
                     destination=os.path.join(tempdir, 'video.mp4'),
-                ),
-            )
-            for encode_step in encode_steps:
-                encode_success, cmd_result = encode_step()
-                if not encode_success:
-                    if self.pdb:
-                        import pdb ; pdb.set_trace()
-                    log.error(cmd_result)
-                    return False
+                    preview_destination=os.path.join(tempdir, 'preview.mp4') if not preview_target_file.exists and not self.preview_clip_seconds else None,
+                    audio_gain=-audio_peak,
+                    audio_duration=m.source_details.get('duration'),
+                    progress=partial(self._progress, m, 'primary_video'),
+                    chunk_seconds=self.encode_chunk_seconds,
+                    chunk_workers=self.encode_chunk_workers,
+                    video_stream=video_stream,
+                )
+            if not encode_success:
+                if self.pdb:
+                    import pdb ; pdb.set_trace()
+                log.error(cmd_result)
+                return False
 
-            # 4.) Move the newly encoded file to the target path
+            # Record encode time - history used by the encode scheduler to estimate the cost of future encodes
+            # (a remux is not representative of the cost of an encode)
+            if not remux:
+                m.source_details['encode_seconds'] = round(time.time() - encode_start, 1)
+
+            # 4.) Move the newly encoded file(s) to the target path
             target_file.move(os.path.join(tempdir, 'video.mp4'))
+            if os.path.exists(os.path.join(tempdir, 'preview.mp4')):
+                preview_target_file.move(os.path.join(tempdir, 'preview.mp4'))
 
         return True
 
@@ -283,11 +538,21 @@ class Encoder(object):
             log.error('No source video to encode preview from')
             return False
 
+        # Short excerpt from the first lyric line - phones in the search UI only play the first few seconds
+        start, duration = None, None
+        if self.preview_clip_seconds:
+            srt_file = m.processed_files['srt']
+            subtitles = subtitle_processor.parse_subtitles(filename=srt_file.absolute) if srt_file.exists else ()
+            start, duration = preview_clip_window(subtitles or (), m.source_details.get('duration'), self.preview_clip_seconds)
+
         with tempfile.TemporaryDirectory() as tempdir:
             preview_file = os.path.join(tempdir, 'preview.mp4')
             encode_success, cmd_result = self.external_tools.encode_preview_video(
                 source=source_file.absolute,
                 destination=preview_file,
+                progress=partial(self._progress, m, 'preview_video', duration=duration),
+                start=start,
+                duration=duration,
             )
             if not encode_success:
                 if self.pdb:
@@ -298,11 +563,69 @@ class Encoder(object):
 
         return True
 
-    def _encode_images_from_meta(self, m, num_images=4):
+    def _encode_hls_from_meta(self, m):
+        """
+        Optional (--hls) adaptive bitrate renditions of the processed video.
+        ffmpeg names the files it creates; the playlists are rewritten to reference the hashed processed files.
+        """
+        target_files = {
+            dict_key: processed_file
+            for dict_key, processed_file in m.processed_files.items()
+            if processed_file.attachment_type in ('hls', 'hls_rendition')
+        }
+        if all(target_file.exists for target_file in target_files.values()):
+            return True
+
+        source_file = m.processed_files['video']
+        if not source_file.exists:
+            log.error('No source video to encode hls from')
+            return False
+
+        renditions = self.meta_manager.processed_files_manager.hls_renditions
+        filenames = hls_output_filenames(renditions)
+        with tempfile.TemporaryDirectory() as tempdir:
+            encode_success, cmd_result = self.external_tools.encode_hls(
+                source=source_file.absolute,
+                destination_folder=tempdir,
+                renditions=renditions,
+                segment_seconds=HLS_SEGMENT_SECONDS,
+                crf=HLS_CRF,
+                progress=partial(self._progress, m, 'hls'),
+            )
+            if not encode_success:
+                if self.pdb:
+                    import pdb ; pdb.set_trace()
+                log.error(cmd_result)
+                return False
+
+            def rewrite(playlist_key, uri_keys):
+                absolute = os.path.join(tempdir, filenames[playlist_key])
+                with open(absolute, 'rt', encoding='utf-8') as filehandle:
+                    playlist = filehandle.read()
+                playlist = rewrite_playlist(playlist, {
+                    filenames[uri_key]: relative_uri(target_files[uri_key].absolute, target_files[playlist_key].absolute)
+                    for uri_key in uri_keys
+                })
+                with open(absolute, 'wt', encoding='utf-8') as filehandle:
+                    filehandle.write(playlist)
+
+            for rendition in renditions:
+                rewrite(f'hls_{rendition.name}_playlist', (f'hls_{rendition.name}_media', ))
+            rewrite('hls', tuple(f'hls_{rendition.name}_playlist' for rendition in renditions))
+
+            # The master playlist is moved last - if it exists the renditions are complete
+            for dict_key in sorted(target_files.keys(), key=lambda dict_key: dict_key == 'hls'):
+                target_files[dict_key].move(os.path.join(tempdir, filenames[dict_key]))
+
+        return True
+
+    def _encode_images_from_meta(self, m):
         target_files = tuple(
-            m.processed_files['image{}'.format(index+1)]
-            for index in range(num_images)
+            processed_file
+            for processed_file in m.processed_files.values()
+            if processed_file.attachment_type == 'image'
         )
+        num_images = len(target_files)
         if all(target_file.exists for target_file in target_files):
             log.debug('Processed Destination was created with the same input sources - no thumbnail gen required')
             return True
@@ -319,8 +642,8 @@ class Encoder(object):
 
         if file_ext(source_file_absolute).ext in EXTS['image']:
             # If input is a single image, we use it as an imput video and take
-            # a frame 4 times from frame zero.
-            # This feels inefficent, but we need 4 images for the import check.
+            # a frame num_images times from frame zero.
+            # This feels inefficent, but we need all the images for the import check.
             # Variable numbers of images would need more data in the meta
             times = (0, ) * num_images
         else:
@@ -328,18 +651,18 @@ class Encoder(object):
             if not video_duration:
                 log.warning('Unable to assertain video duration; unable to extact images')
                 return False
-            times = (float("%.3f" % (video_duration * offset)) for offset in (x/(num_images+1) for x in range(1, num_images+1)))
+            times = tuple(float("%.3f" % (video_duration * offset)) for offset in (x/(num_images+1) for x in range(1, num_images+1)))
 
         with tempfile.TemporaryDirectory() as tempdir:
-            for index, time in enumerate(times):
-                image_file = os.path.join(tempdir, '{}.jpg'.format(index))
-                encode_succes, cmd_result = self.external_tools.extract_image(source=source_file_absolute, destination=image_file, time=time)
-                if not encode_succes:
-                    if self.pdb:
-                        import pdb ; pdb.set_trace()
-                    log.error(cmd_result)
-                    return False
-                target_files[index].move(image_file)
+            image_files = tuple(os.path.join(tempdir, '{}.jpg'.format(index)) for index in range(num_images))
+            encode_succes, cmd_result = self.external_tools.extract_images(source=source_file_absolute, destinations=image_files, times=times)
+            if not encode_succes:
+                if self.pdb:
+                    import pdb ; pdb.set_trace()
+                log.error(cmd_result)
+                return False
+            for target_file, image_file in zip(target_files, image_files):
+                target_file.move(image_file)
 
         return True
 
@@ -366,11 +689,26 @@ class Encoder(object):
 # Main -------------------------------------------------------------------------
 
 def additional_arguments(parser):
-    parser.add_argument('--process_order_function', choices=PROCESS_ORDER_FUNCS.keys(), help='', default=DEFAULT_ORDER_FUNC)
+    parser.add_argument('--process_order_function', choices=PROCESS_ORDER_FUNCS.keys(), help='shortest/deadline estimate cost from probed duration x pixels x past encode times', default=DEFAULT_ORDER_FUNC)
+    parser.add_argument('--deadline', action='store', help='for --process_order_function deadline. ISO datetime e.g. 2019-08-23T18:00')
+    parser.add_argument('--workers', type=int, help='number of encode processes to run in parallel', default=1)
+    parser.add_argument('--status_file', action='store', help='machine readable json file of encode progress and ETA for the backlog')
+    parser.add_argument('--encode_ledger_path', action='store', help='json-lines file recording the wall/cpu time of every encode step (see encode_report.py)')
+    parser.add_argument('--intermediate_cache_path', action='store', help='folder to keep intermediate encode files (subtitles, image videos) between runs. Retries reuse them')
+    parser.add_argument('--intermediate_cache_max_mb', type=int, help='size budget of the intermediate cache. Least recently used files are evicted')
+    parser.add_argument('--encode_chunk_seconds', type=int, help='sources longer than twice this are split at keyframes into segments of about this length and encoded in parallel (default: off)')
+    parser.add_argument('--encode_chunk_workers', type=int, help='max number of segments of a chunked encode to encode concurrently (default: cores / threads)')
+    parser.add_argument('--failure_ledger_path', action='store', help='json file of failed sources. Failed sources are retried with exponential backoff and quarantined after repeated failures')
+    parser.add_argument('--failure_backoff_seconds', type=int, help=f'delay before retrying a failed source (doubles with each failure) default:{DEFAULT_BACKOFF_SECONDS}')
+    parser.add_argument('--failure_quarantine_count', type=int, help=f'failures before a source is no longer retried (until the source files change) default:{DEFAULT_QUARANTINE_FAILURES}')
+    parser.add_argument('--retry_failed', action='store_true', help='ignore the backoff and quarantine of failed sources')
+    parser.add_argument('--encode_step_workers', type=int, help='max number of independent encode steps for a single track to run concurrently', default=4)
 
 
 def process_arguments(kwargs):
     kwargs['process_order_function'] = PROCESS_ORDER_FUNCS[kwargs['process_order_function']]
+    kwargs['workers'] = int(kwargs['workers'])
+    kwargs['encode_step_workers'] = int(kwargs['encode_step_workers'])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+#!_env/bin/python3
+
+import re
+
+from processmedia_libs.encode_ledger import EncodeLedger, summarise
+from processmedia_libs.failure_ledger import FailureLedger
+
+
+import logging
+log = logging.getLogger(__name__)
+
+
+VERSION = '0.0.0'
+
+COLUMNS = ('step', 'resolution', 'video_codec', 'count', 'failed', 'wall_seconds', 'cpu_seconds', 'cpu_ratio', 'speed', 'realtime', 'input_mb', 'output_mb')
+FAILURE_COLUMNS = ('name', 'failures', 'status', 'reason')
+
+
+# Printed Output ---------------------------------------------------------------
+
+def print_table(rows, columns=COLUMNS):
+    rows = tuple(tuple('' if row.get(column) is None else str(row.get(column)) for column in columns) for row in rows)
+    widths = tuple(max(map(len, values)) for values in zip(columns, *rows))
+    for values in (columns, ) + rows:
+        print('  '.join(value.ljust(width) for value, width in zip(values, widths)))
+
+
+# Main -------------------------------------------------------------------------
+
+def additional_arguments(parser):
+    parser.add_argument('--encode_ledger_path', action='store', help='json-lines ledger written by encode_media.py')
+    parser.add_argument('--name_regex', default='', help='only report on tracks matching this regex')
+    parser.add_argument('--failures', action='store_true', help='report the failed/quarantined sources from the failure ledger instead')
+    parser.add_argument('--failure_ledger_path', action='store', help='json file of failed sources written by encode_media.py')
+
+
+def _encode_report(*args, encode_ledger_path=None, failure_ledger_path=None, name_regex='', failures=False, **kwargs):
+    def name_filter(rows):
+        return (row for row in rows if re.search(name_regex, row.get('name', ''), flags=re.IGNORECASE))
+    if failures:
+        print_table(name_filter(FailureLedger(failure_ledger_path).report()), columns=FAILURE_COLUMNS)
+        return
+    print_table(summarise(name_filter(EncodeLedger(encode_ledger_path).entries)))
+
+
+if __name__ == "__main__":
+    from _main import main
+    main(
+        'encode_report', _encode_report, version=VERSION,
+        additional_arguments_function=additional_arguments,
+        lock=False,
+    )
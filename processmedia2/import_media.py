@@ -13,6 +13,7 @@ from calaldees.date_tools import epoc
 
 from processmedia_libs import PENDING_ACTION
 from processmedia_libs.meta_overlay import MetaManagerExtended
+from processmedia_libs.meta_summary import SummaryMeta
 from processmedia_libs import subtitle_processor_with_codecs as subtitle_processor
 from processmedia_libs.fileset_change_monitor import FilesetChangeMonitor
 
@@ -49,6 +50,16 @@ def _track_api(host, data={}, method='GET'):
         sys.exit(1)
 
 
+def _already_imported(summary_meta, processed_files_manager, processed_files_lookup, existing_track_ids):
+    """
+    The track exists in the db and all it's processed files exist - no need to load the meta
+    """
+    return summary_meta.source_hash in existing_track_ids and all(
+        processed_file.relative in processed_files_lookup
+        for processed_file in processed_files_manager.get_processed_files(summary_meta.source_hashs).values()
+    )
+
+
 def _generate_track_dict(name, meta_manager=None, processed_files_lookup=None, existing_track_ids=None):
     """
     """
@@ -123,8 +134,9 @@ def import_media(**kwargs):
     track_api = partial(_track_api, kwargs['api_host'])
 
     meta_manager = MetaManagerExtended(**kwargs)
-    meta_manager.load_all()  # mtime=epoc(last_update())
-    processed_track_ids = set(meta_manager.source_hashs)
+    # Only the summaries are read up front - meta is fully loaded only for tracks that need importing/marking
+    summary_metas = {name: SummaryMeta(summary) for name, summary in meta_manager.summaries().items()}
+    processed_track_ids = {m.source_hash for m in summary_metas.values()} - {None}
     processed_files_lookup = set(f.relative for f in fast_scan(meta_manager.processed_files_manager.path))
     existing_tracks = track_api()['data']['tracks']
     existing_track_ids = existing_tracks.keys()
@@ -132,14 +144,17 @@ def import_media(**kwargs):
     generate_track_dict = partial(_generate_track_dict, meta_manager=meta_manager, existing_track_ids=existing_track_ids, processed_files_lookup=processed_files_lookup)
 
     stats['db_start'] = set(existing_tracks.values())
-    stats['meta_set'] = set(m.name for m in meta_manager.meta_items if m.source_hash)
+    stats['meta_set'] = {name for name, m in summary_metas.items() if m.source_hash}
 
     tracks_to_add = []
     track_ids_to_delete = []
 
     log.info('Importing tracks - Existing:{} Processed:{}'.format(len(existing_track_ids), len(processed_track_ids)))  # TODO: replace with formatstring
-    for name in progress_bar(meta_manager.meta.keys()):
+    for name, summary_meta in progress_bar(summary_metas.items()):
         try:
+            if _already_imported(summary_meta, meta_manager.processed_files_manager, processed_files_lookup, existing_track_ids):
+                stats['meta_hash_matched_db_hash'].add(name)
+                continue
             track = generate_track_dict(name)
             if track:
                 stats['meta_imported'].add(name)
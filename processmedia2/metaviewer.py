@@ -23,8 +23,8 @@ FileItem = namedtuple('FileItem', ('type', 'relative', 'absolute', 'exists'))
 
 class MetaViewer(object):
 
-    def __init__(self, path_meta=None, path_processed=None, path_source=None, **kwargs):
-        self.meta_manager = MetaManagerExtended(path_meta=path_meta, path_source=path_source, path_processed=path_processed)
+    def __init__(self, path_meta=None, path_processed=None, path_source=None, meta_store=None, **kwargs):
+        self.meta_manager = MetaManagerExtended(path_meta=path_meta, path_source=path_source, path_processed=path_processed, meta_store=meta_store)
 
     def get_meta_details(self, name_regex):
         if (not name_regex):
@@ -32,9 +32,9 @@ class MetaViewer(object):
             meta_items = self.meta_manager.meta_items
         else:
             meta_items = (
-                self.meta_manager.load(f.file_no_ext) or self.meta_manager.get(f.file_no_ext)
-                for f in self.meta_manager.files
-                if re.search(name_regex, f.file_no_ext, flags=re.IGNORECASE)
+                self.meta_manager.load(name) or self.meta_manager.get(name)
+                for name in self.meta_manager.names
+                if re.search(name_regex, name, flags=re.IGNORECASE)
             )
 
         def lazy_exists(path):
@@ -0,0 +1,32 @@
+#!_env/bin/python3
+
+from processmedia_libs.meta_store import META_STORES, copy_meta
+
+
+import logging
+log = logging.getLogger(__name__)
+
+
+VERSION = '0.0.0'
+
+
+# Main -------------------------------------------------------------------------
+
+def additional_arguments(parser):
+    parser.add_argument('--to_store', action='store', choices=tuple(META_STORES.keys()), default='sqlite', help='store to copy all meta into (default: sqlite)')
+    parser.add_argument('--from_store', action='store', choices=tuple(META_STORES.keys()), default='json', help='store to copy all meta from (default: json). Use `--from_store sqlite --to_store json` to export back to json files')
+
+
+def migrate_meta(*args, path_meta=None, from_store='json', to_store='sqlite', **kwargs):
+    assert from_store != to_store, 'from_store and to_store must be different'
+    count = copy_meta(META_STORES[from_store](path_meta), META_STORES[to_store](path_meta))
+    log.info('Copied %s meta from %s to %s', count, from_store, to_store)
+    print(f'Copied {count} meta from {from_store} to {to_store} - set `"meta_store": "{to_store}"` in config.json to use it')
+
+
+if __name__ == "__main__":
+    from _main import main
+    main(
+        'migrate_meta', migrate_meta, version=VERSION,
+        additional_arguments_function=additional_arguments,
+    )
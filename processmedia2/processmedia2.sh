@@ -4,11 +4,7 @@ set -e
 
 KARAKARA_PROCESSMEDIA2_CONFIG=${KARAKARA_PROCESSMEDIA2_CONFIG:-config.docker.json}
 
-function run() {
-    echo "processmedia2 - $(date)"
-    # scan will terminate with `exit 1` if no files have changed
-    # Attempt to make function exit on failed command - https://stackoverflow.com/a/51913013/3356840
-    python3 scan_media.py    --config ${KARAKARA_PROCESSMEDIA2_CONFIG} && \
+function process() {
     python3 encode_media.py  --config ${KARAKARA_PROCESSMEDIA2_CONFIG} && \
     python3 import_media.py  --config ${KARAKARA_PROCESSMEDIA2_CONFIG} --force  && \
     if [ "${KARAKARA_PROCESSMEDIA2_CLEANUP:-false}" == "true" ]; then
@@ -16,6 +12,25 @@ function run() {
     fi
 }
 
+function run() {
+    echo "processmedia2 - $(date)"
+    # scan will terminate with `exit 1` if no files have changed
+    # Attempt to make function exit on failed command - https://stackoverflow.com/a/51913013/3356840
+    python3 scan_media.py    --config ${KARAKARA_PROCESSMEDIA2_CONFIG} && \
+    process
+}
+
+# Called by the watch daemon after each scan that found changes
+if [ "$1" == "process" ]; then
+    process
+    exit $?
+fi
+
+# Scan as soon as source files change, rather than every KARAKARA_RESCAN_INTERVAL_SECONDS
+if [ "${KARAKARA_PROCESSMEDIA2_ENABLED:-true}" == "true" ] && [ "${KARAKARA_PROCESSMEDIA2_WATCH:-false}" == "true" ]; then
+    exec python3 scan_media.py --config ${KARAKARA_PROCESSMEDIA2_CONFIG} --watch --watch_then "$0 process"
+fi
+
 while [ "${KARAKARA_PROCESSMEDIA2_ENABLED:-true}" == "true" ]; do
     touch ${KARAKARA_PROCESSMEDIA2_HEARTBEAT_FILE} || true
     run || true
@@ -0,0 +1,79 @@
+import os
+import stat
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+UMASK = _umask()  # Read once - os.umask can only be read by setting it (not thread safe)
+
+
+def _file_mode(path):
+    """
+    The permissions of the file being replaced (or the default for a new file)
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+
+def _temp_path(path):
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), prefix='.', suffix='.tmp', delete=False) as temp_file:
+        return temp_file.name
+
+
+def _replace(temp_path, path):
+    # tempfiles are created 0600 - the website/import run as other users and must still be able to read the file
+    os.chmod(temp_path, _file_mode(path))
+    os.replace(temp_path, path)
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Write to a tempfile in the same folder and atomically replace `path`, so another
+    process (e.g. a parallel encode worker) never reads a partially written file.
+
+    >>> with tempfile.TemporaryDirectory() as tempdir:
+    ...     path = os.path.join(tempdir, 'test.json')
+    ...     with atomic_write(path) as filehandle:
+    ...         _ = filehandle.write('{}')
+    ...     os.chmod(path, 0o644)
+    ...     with atomic_write(path) as filehandle:
+    ...         _ = filehandle.write('[]')
+    ...     open(path).read(), oct(stat.S_IMODE(os.stat(path).st_mode)), os.listdir(tempdir)
+    ('[]', '0o644', ['test.json'])
+    """
+    temp_path = _temp_path(path)
+    try:
+        with open(temp_path, mode) as filehandle:
+            yield filehandle
+        _replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def atomic_move(source, path):
+    """
+    Move `source` (possibly on another filesystem) to `path` atomically
+    """
+    temp_path = _temp_path(path)
+    try:
+        shutil.move(source, temp_path)
+        _replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,99 @@
+import json
+import time
+from collections import defaultdict
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class EncodeLedger(object):
+    """
+    Append only json-lines record of every encode step that ran an external process.
+    Each line is a small single write, so multiple encode worker processes can append to the same ledger.
+
+    If no path is given `record` is a no-op.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def record(self, **entry):
+        if not self.path:
+            return
+        entry.setdefault('timestamp', time.time())
+        with open(self.path, 'at') as filehandle:
+            filehandle.write(json.dumps(entry) + '\n')
+
+    @property
+    def entries(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'rt') as filehandle:
+                for line in filehandle:
+                    try:
+                        yield json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        log.warning('Ignoring corrupt ledger line %s', line)
+        except FileNotFoundError:
+            return
+
+
+def resolution_bucket(height):
+    """
+    >>> tuple(map(resolution_bucket, (None, 240, 360, 480, 576, 720, 1080, 2160)))
+    ('unknown', '<=360p', '<=360p', '<=576p', '<=576p', '<=720p', '<=1080p', '>1080p')
+    """
+    if not height:
+        return 'unknown'
+    for limit in (360, 576, 720, 1080):
+        if height <= limit:
+            return f'<={limit}p'
+    return '>1080p'
+
+
+def summarise(entries, group_by=('step', 'resolution', 'video_codec')):
+    """
+    Throughput of encode steps grouped by step, source resolution and source codec
+
+    realtime: seconds of source media processed per wall clock second
+    cpu_ratio: cpu seconds per wall second (how well the step uses the cores)
+
+    >>> entries = (
+    ...     {'step': 'primary_video', 'height': 720, 'video_codec': 'h264', 'duration': 100, 'wall_seconds': 50, 'cpu_seconds': 100, 'speed': 2.0, 'input_bytes': 100, 'output_bytes': 50},
+    ...     {'step': 'primary_video', 'height': 720, 'video_codec': 'h264', 'duration': 100, 'wall_seconds': 150, 'cpu_seconds': 300, 'speed': 0.5, 'input_bytes': 100, 'output_bytes': 50},
+    ...     {'step': 'images', 'height': 1080, 'video_codec': 'hevc', 'duration': 100, 'wall_seconds': 1, 'cpu_seconds': 1, 'success': False},
+    ... )
+    >>> for row in summarise(entries):
+    ...     print(sorted(row.items()))
+    [('count', 1), ('cpu_ratio', 1.0), ('cpu_seconds', 1.0), ('failed', 1), ('input_mb', 0.0), ('output_mb', 0.0), ('realtime', 100.0), ('resolution', '<=1080p'), ('speed', None), ('step', 'images'), ('video_codec', 'hevc'), ('wall_seconds', 1.0)]
+    [('count', 2), ('cpu_ratio', 2.0), ('cpu_seconds', 200.0), ('failed', 0), ('input_mb', 0.0), ('output_mb', 0.0), ('realtime', 1.0), ('resolution', '<=720p'), ('speed', 1.25), ('step', 'primary_video'), ('video_codec', 'h264'), ('wall_seconds', 100.0)]
+    """
+    groups = defaultdict(list)
+    for entry in entries:
+        entry = dict(entry, resolution=resolution_bucket(entry.get('height')))
+        groups[tuple(entry.get(key) or 'unknown' for key in group_by)].append(entry)
+
+    def mean(values):
+        values = tuple(v for v in values if v is not None)
+        return round(sum(values) / len(values), 2) if values else None
+
+    def total(group, key):
+        return sum(entry.get(key) or 0 for entry in group)
+
+    rows = []
+    for key, group in sorted(groups.items()):
+        wall_seconds = total(group, 'wall_seconds')
+        rows.append({
+            **dict(zip(group_by, key)),
+            'count': len(group),
+            'failed': sum(1 for entry in group if entry.get('success') is False),
+            'wall_seconds': mean(entry.get('wall_seconds') for entry in group),
+            'cpu_seconds': mean(entry.get('cpu_seconds') for entry in group),
+            'speed': mean(entry.get('speed') for entry in group),
+            'realtime': round(total(group, 'duration') / wall_seconds, 2) if wall_seconds else None,
+            'cpu_ratio': round(total(group, 'cpu_seconds') / wall_seconds, 2) if wall_seconds else None,
+            'input_mb': round(total(group, 'input_bytes') / len(group) / 1024 / 1024, 1),
+            'output_mb': round(total(group, 'output_bytes') / len(group) / 1024 / 1024, 1),
+        })
+    return rows
@@ -0,0 +1,101 @@
+import random
+import statistics
+import datetime
+from operator import attrgetter
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# Rough starting point before any encode history has been recorded. (720p encodes at ~2x realtime)
+DEFAULT_SECONDS_PER_PIXEL_SECOND = 0.5 / (1280 * 720)
+
+
+# Cost estimation --------------------------------------------------------------
+
+def _pixel_seconds(m):
+    details = m.source_details
+    if details.get('duration') and details.get('width') and details.get('height'):
+        return details['duration'] * details['width'] * details['height']
+
+
+def seconds_per_pixel_second(metas):
+    """
+    Derive the encode rate from the history of previous encodes (median - a few odd encodes should not skew it)
+    """
+    rates = tuple(
+        m.source_details['encode_seconds'] / _pixel_seconds(m)
+        for m in metas
+        if m.source_details.get('encode_seconds') and _pixel_seconds(m)
+    )
+    return statistics.median(rates) if rates else DEFAULT_SECONDS_PER_PIXEL_SECOND
+
+
+def estimate_costs(metas, rate=None):
+    """
+    Estimated encode seconds for each meta.
+    Sources that have never been probed are given the median cost of the known items.
+    """
+    rate = rate or seconds_per_pixel_second(metas)
+    costs = {m.name: _pixel_seconds(m) and _pixel_seconds(m) * rate for m in metas}
+    known_costs = tuple(filter(None, costs.values()))
+    default_cost = statistics.median(known_costs) if known_costs else 0
+    return {name: cost or default_cost for name, cost in costs.items()}
+
+
+# Order policies ---------------------------------------------------------------
+# Each policy takes an iterable of meta items and returns them in the order they should be encoded
+
+def shuffle(metas, **kwargs):
+    rendered_list = list(metas)
+    random.shuffle(rendered_list)
+    return rendered_list
+
+
+def shortest_job_first(metas, **kwargs):
+    """
+    Get the most tracks processed as quickly as possible
+    """
+    metas = tuple(metas)
+    costs = estimate_costs(metas, rate=kwargs.get('encode_rate'))
+    return sorted(metas, key=lambda m: (costs[m.name], m.name))
+
+
+def newest_upload_first(metas, **kwargs):
+    return sorted(metas, key=lambda m: (-m.uploaded, m.name))
+
+
+def deadline(metas, deadline=None, workers=1, now=None, **kwargs):
+    """
+    Select the largest set of tracks that can be completed before the deadline (shortest job first).
+    These are processed newest upload first. Tracks that will not make the deadline are processed after.
+    """
+    metas = tuple(metas)
+    if not deadline:
+        log.warning('No deadline given - falling back to shortest job first')
+        return shortest_job_first(metas, **kwargs)
+    if isinstance(deadline, str):
+        deadline = datetime.datetime.fromisoformat(deadline)
+    capacity = (deadline - (now or datetime.datetime.now())).total_seconds() * workers
+
+    costs = estimate_costs(metas, rate=kwargs.get('encode_rate'))
+    selected = []
+    for m in shortest_job_first(metas, **kwargs):
+        if costs[m.name] > capacity:
+            break
+        capacity -= costs[m.name]
+        selected.append(m)
+    remaining = [m for m in metas if m not in selected]
+    log.info('%s of %s tracks estimated to complete before %s', len(selected), len(metas), deadline)
+    return newest_upload_first(selected) + shortest_job_first(remaining, **kwargs)
+
+
+DEFAULT_ORDER_FUNC = 'sorted'
+PROCESS_ORDER_FUNCS = {
+    'sorted': lambda metas, **kwargs: sorted(metas, key=attrgetter('name')),
+    'random': shuffle,
+    'none': lambda metas, **kwargs: metas,
+    'shortest': shortest_job_first,
+    'newest': newest_upload_first,
+    'deadline': deadline,
+}
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+
+from .atomic_file import atomic_write
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class EncodeStatus(object):
+    """
+    Machine readable status file of the encode backlog and the tracks currently being encoded.
+
+    Multiple encode worker processes update the same file. Each update is a
+    read-modify-write under an exclusive lock and the file is replaced atomically,
+    so readers (operators, the comunity pages) always see a complete json document.
+
+    If no path is given all methods are a no-op.
+    """
+
+    def __init__(self, path=None, min_update_interval_seconds=1.0):
+        self.path = path
+        self.min_update_interval_seconds = min_update_interval_seconds
+        self._last_progress_update = {}
+
+    @contextmanager
+    def _update(self):
+        with open(f'{self.path}.lock', 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                status = self.status
+                yield status
+                status['updated'] = time.time()
+                status['eta_seconds'] = _backlog_eta(status)
+                with atomic_write(self.path) as destination:
+                    json.dump(status, destination)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    @property
+    def status(self):
+        try:
+            with open(self.path, 'rt') as filehandle:
+                return json.load(filehandle)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def set_backlog(self, estimated_costs, workers=1):
+        """
+        estimated_costs: {name: estimated_encode_seconds} for every track to be encoded this run
+        """
+        if not self.path:
+            return
+        with self._update() as status:
+            status.update({
+                'workers': workers,
+                'backlog': {
+                    'total': len(estimated_costs),
+                    'pending': dict(estimated_costs),
+                    'completed': 0,
+                    'failed': 0,
+                },
+                'tracks': {},
+            })
+
+    def track_started(self, name):
+        if not self.path:
+            return
+        with self._update() as status:
+            status.setdefault('backlog', {}).setdefault('pending', {}).pop(name, None)
+            status.setdefault('tracks', {})[name] = {
+                'pid': os.getpid(),
+                'started': time.time(),
+            }
+
+    def track_progress(self, name, step, duration, progress):
+        """
+        progress: a parsed ffmpeg `-progress` block (see external_tools.parse_ffmpeg_progress)
+        Updates are throttled to `min_update_interval_seconds` per track
+        """
+        if not self.path:
+            return
+        now = time.monotonic()
+        if progress.get('progress') != 'end' and now - self._last_progress_update.get(name, 0) < self.min_update_interval_seconds:
+            return
+        self._last_progress_update[name] = now
+        with self._update() as status:
+            track = status.setdefault('tracks', {}).setdefault(name, {'pid': os.getpid(), 'started': time.time()})
+            track.update({
+                'step': step,
+                'duration': duration,
+                **{k: progress.get(k) for k in ('frame', 'out_time', 'speed')},
+                'eta_seconds': _track_eta(duration, progress),
+            })
+
+    def track_finished(self, name, success):
+        if not self.path:
+            return
+        self._last_progress_update.pop(name, None)
+        with self._update() as status:
+            status.setdefault('tracks', {}).pop(name, None)
+            backlog = status.setdefault('backlog', {})
+            backlog['completed' if success else 'failed'] = backlog.get('completed' if success else 'failed', 0) + 1
+
+
+def _track_eta(duration, progress):
+    """
+    >>> _track_eta(100, {'out_time': 40.0, 'speed': 2.0})
+    30.0
+    >>> _track_eta(100, {'out_time': 40.0})
+    >>> _track_eta(None, {'out_time': 40.0, 'speed': 2.0})
+    """
+    if not duration or not progress.get('speed') or progress.get('out_time') is None:
+        return None
+    return round(max(duration - progress['out_time'], 0) / progress['speed'], 1)
+
+
+def _backlog_eta(status):
+    """
+    Remaining estimated encode time of tracks not yet started + the tracks in progress, shared between the workers
+
+    >>> _backlog_eta({'workers': 2, 'backlog': {'pending': {'a': 10, 'b': 20}}, 'tracks': {'c': {'eta_seconds': 30}, 'd': {}}})
+    30.0
+    >>> _backlog_eta({})
+    0.0
+    """
+    pending = sum(status.get('backlog', {}).get('pending', {}).values())
+    in_progress = sum(track.get('eta_seconds') or 0 for track in status.get('tracks', {}).values())
+    return round((pending + in_progress) / (status.get('workers') or 1), 1)
@@ -7,7 +7,11 @@ import os.path
 import json
 from collections import namedtuple
 import subprocess
+import threading
+import tempfile
+import time
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from calaldees.shell import cmd_args
 cmd_args = partial(cmd_args, FLAG_PREFIX='-')
@@ -37,6 +41,168 @@ def parser_cmd_to_tuple(cmd):
     return tuple(filter(None, cmd.split(' ')))
 
 
+def _kbits(bit_rate):
+    return str(int(bit_rate) // 1000) if bit_rate else None
+
+
+def parse_probe_json(probe):
+    """
+    Reduce `ffprobe -print_format json -show_streams -show_format` output to the source details we use
+
+    >>> probe = {
+    ...     'format': {'duration': '30.020000', 'bit_rate': '38531'},
+    ...     'streams': [
+    ...         {'index': 0, 'codec_type': 'video', 'codec_name': 'png', 'width': 600, 'height': 600, 'disposition': {'attached_pic': 1}},
+    ...         {'index': 1, 'codec_type': 'video', 'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'width': 64, 'height': 10000, 'bit_rate': '35218', 'disposition': {'attached_pic': 0}},
+    ...         {'index': 2, 'codec_type': 'audio', 'codec_name': 'aac', 'sample_rate': '44100', 'bit_rate': '2000'},
+    ...     ],
+    ... }
+    >>> json.dumps(parse_probe_json(probe), sort_keys=True)
+    '{"audio": {"bitrate": "2", "format": "aac", "sample_rate": "44100"}, "duration": 30.02, "height": 10000, "video": {"bitrate": "35", "format": "h264", "pix_fmt": "yuv420p", "stream": 1}, "width": 64}'
+    >>> parse_probe_json({'format': {'duration': 'N/A'}, 'streams': [{'codec_type': 'video', 'codec_name': 'png', 'width': 320, 'height': 240}]})
+    {'width': 320, 'height': 240, 'video': {'format': 'png'}}
+    >>> parse_probe_json({})
+    {}
+    """
+    data = {}
+    try:
+        data['duration'] = float(probe.get('format', {}).get('duration'))
+    except (TypeError, ValueError):
+        pass
+
+    streams = probe.get('streams', ())
+    video = next((
+        stream for stream in streams
+        if stream.get('codec_type') == 'video' and not stream.get('disposition', {}).get('attached_pic')
+    ), None)
+    if video and video.get('width') and video.get('height'):
+        data['width'] = int(video['width'])
+        data['height'] = int(video['height'])
+        data['video'] = {k: v for k, v in dict(
+            format=video.get('codec_name'),
+            pix_fmt=video.get('pix_fmt'),
+            bitrate=_kbits(video.get('bit_rate')),
+        ).items() if v}
+        if video.get('index') is not None:
+            # The stream the details describe (the first video stream may be cover art) - see `video_stream_map`
+            data['video']['stream'] = int(video['index'])
+
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+    if audio:
+        data['audio'] = {k: v for k, v in dict(
+            format=audio.get('codec_name'),
+            sample_rate=audio.get('sample_rate'),
+            bitrate=_kbits(audio.get('bit_rate')),
+        ).items() if v}
+
+    return data
+
+
+def video_stream_map(video_stream=None, input_index=0):
+    """
+    >>> video_stream_map()
+    '0:v:0'
+    >>> video_stream_map(2)
+    '0:2'
+    """
+    return f'{input_index}:v:0' if video_stream is None else f'{input_index}:{video_stream}'
+
+
+def _parse_ffmpeg_time(value):
+    """
+    >>> _parse_ffmpeg_time('01:01:05.500000')
+    3665.5
+    >>> _parse_ffmpeg_time('-577014:32:22.775808')
+    >>> _parse_ffmpeg_time('N/A')
+    """
+    match = re.match(r'(\d+):(\d+):([\d.]+)$', value)
+    if not match:
+        return None
+    return int(match.group(1)) * 60 * 60 + int(match.group(2)) * 60 + float(match.group(3))
+
+
+def parse_ffmpeg_progress(lines):
+    """
+    Parse the `key=value` lines from `ffmpeg -progress` into a dict per progress block
+
+    >>> tuple(parse_ffmpeg_progress((
+    ...     'frame=10', 'fps=0.00', 'out_time=00:00:05.000000', 'speed=2.5x', 'progress=continue',
+    ...     'frame=20', 'out_time=N/A', 'speed=N/A', 'progress=end',
+    ... )))
+    ({'frame': 10, 'out_time': 5.0, 'speed': 2.5, 'progress': 'continue'}, {'frame': 20, 'progress': 'end'})
+    """
+    block = {}
+    for line in lines:
+        key, separator, value = line.strip().partition('=')
+        value = value.strip()
+        if not separator:
+            continue
+        if key == 'frame' and value.isdigit():
+            block['frame'] = int(value)
+        elif key == 'out_time':
+            out_time = _parse_ffmpeg_time(value)
+            if out_time is not None:
+                block['out_time'] = out_time
+        elif key == 'speed':
+            try:
+                block['speed'] = float(value.rstrip('x'))
+            except ValueError:
+                pass
+        elif key == 'progress':
+            block['progress'] = value
+            yield block
+            block = {}
+
+
+def parse_keyframes(lines):
+    """
+    Keyframe times from `ffprobe -show_entries packet=pts_time,flags:format=start_time -of csv` output.
+
+    Packet pts_times are absolute, but `-ss` seeks relative to the start_time of the input
+    (MPEG-TS and some mkv sources do not start at 0), so the times are made relative to the start_time.
+
+    >>> parse_keyframes(('packet,1.400000,K_', 'packet,1.440000,__', 'packet,7.400000,K_', 'packet,N/A,K_', 'format,1.400000'))
+    (0.0, 6.0)
+    >>> parse_keyframes(('packet,2.000000,K_', 'packet,0.000000,K_', 'format,N/A'))
+    (0.0, 2.0)
+    """
+    keyframes = []
+    start_time = 0.0
+    for line in lines:
+        section, _, values = line.strip().partition(',')
+        try:
+            if section == 'packet':
+                pts_time, _, flags = values.partition(',')
+                if 'K' in flags:
+                    keyframes.append(float(pts_time))
+            elif section == 'format':
+                start_time = float(values)
+        except ValueError:
+            pass
+    return tuple(sorted(round(keyframe - start_time, 6) for keyframe in keyframes))
+
+
+def chunk_boundaries(keyframes, duration, chunk_seconds):
+    """
+    Split a source into (start, end) time segments of roughly `chunk_seconds`.
+    Segments start on keyframes so each chunk encode can seek directly to its start
+    without decoding frames that are thrown away.
+    A short trailing segment is merged into the previous segment.
+
+    >>> chunk_boundaries((0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0), 14.0, 5)
+    ((0.0, 6.0), (6.0, 14.0))
+    >>> chunk_boundaries((0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0), 20.0, 5)
+    ((0.0, 6.0), (6.0, 12.0), (12.0, 20.0))
+    >>> chunk_boundaries((0.0, ), 20.0, 5)
+    ((0.0, 20.0),)
+    """
+    starts = [0.0]
+    for keyframe in sorted(keyframes):
+        if keyframe >= starts[-1] + chunk_seconds and keyframe <= duration - chunk_seconds / 2:
+            starts.append(keyframe)
+    return tuple(zip(starts, starts[1:] + [duration]))
+
+
 class ProcessMediaFilesWithExternalTools():
     def __init__(self, **config):
         """
@@ -48,6 +214,7 @@ class ProcessMediaFilesWithExternalTools():
         'a' is the aspect ratio. floor() rounds down to nearest integer
         If we divide by 2 and ensure that an integer, multiplying by 2 must be divisible by 2
         """
+        self._usage = threading.local()
         self.config = {
             **{
                 'threads': 2,
@@ -84,80 +251,171 @@ class ProcessMediaFilesWithExternalTools():
                 vf=self.config['scale_even'],  # .format(width=width, height=height),  # ,pad={TODO}:{TODO}:(ow-iw)/2:(oh-ih)/2,setsar=1:1
                 threads=self.config['threads'],
             ),
-            'extract_audio': cmd_args(
-                vcodec='none',
-                ac=2,
-                ar=44100,
-            ),
-            'encode_video': cmd_args(
+            'encode_video_video_stream': cmd_args(
                 # preset='slow',
                 vcodec=self.config['h264_codec'],
                 crf=21,
                 maxrate='1500k',
                 bufsize='2500k',
-
+                threads=self.config['threads'],
+            ),
+            'encode_video_audio_stream': cmd_args(
                 acodec='aac',
                 strict='experimental',
                 ab='196k',
-                threads=self.config['threads'],
             ),
-            'encode_preview': cmd_args(
+            'encode_preview_video_stream': cmd_args(
                 vcodec=self.config['h264_codec'],
                 crf=34,
-                vf=self.config['vf_for_preview'],
+                threads=self.config['threads'],
+            ),
+            'encode_preview_audio_stream': cmd_args(
                 acodec='aac',  # libfdk_aac
                 strict='experimental',
                 ab='48k',
-                threads=self.config['threads'],
                 #'profile:a': 'aac_he_v1',
                 #ac=1,
             ),
         })
+        self.config.update({
+            'encode_video': self.config['encode_video_video_stream'] + self.config['encode_video_audio_stream'],
+            'encode_preview_streams': self.config['encode_preview_video_stream'] + self.config['encode_preview_audio_stream'],
+        })
+        self.config.update({
+            # Sources that already meet these are stream copied rather than re-encoded (see `can_remux_video`)
+            'remux_video_formats': ('h264', ),
+            'remux_pix_fmts': ('yuv420p', ),
+            'remux_max_video_bitrate_kbits': 1500,  # maxrate of encode_video
+            'remux_max_height': 1080,
+        })
+        self.config.update({
+            'audio_format': 'aformat=sample_rates=44100:channel_layouts=stereo',
+            'audio_fade_seconds': 0.15,
+        })
+        self.config.update({
+            'encode_preview': cmd_args(
+                vf=self.config['vf_for_preview'],
+            ) + self.config['encode_preview_streams'],
+        })
 
     CommandResult = namedtuple('CommandResult', ('success', 'result'))
-    def _run_tool(self, *args, **kwargs):
+    def _run_tool(self, *args, progress=None, **kwargs):
         cmd = cmd_args(*args, **kwargs)
         log.debug(cmd)
         #import pdb ; pdb.set_trace()
-        cmd_result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=self.config['process_timeout_seconds'])
+        cmd_result = self._run_process(cmd, progress=progress)
         if cmd_result.returncode != 0:
             log.error(cmd_result)
         return self.CommandResult(cmd_result.returncode == 0, cmd_result)
 
+    @staticmethod
+    def _progress_args(progress):
+        return ('-progress', 'pipe:1', '-nostats') if progress else ()
+
+    def _run_process(self, cmd, progress=None):
+        """
+        Run cmd to completion (killed after `process_timeout_seconds`)
+
+        If `progress` is given, stdout is stream parsed as the output of `ffmpeg -progress pipe:1`
+        and `progress` is called with each parsed progress block (frame, out_time, speed).
+
+        The process is reaped with `wait4` so the cpu time it used can be accumulated in `usage`
+        """
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        output = {'stdout': [], 'stderr': []}
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            process.kill()
+        timeout = threading.Timer(self.config['process_timeout_seconds'], kill)
+
+        speed = None
+        status = None
+        try:
+            readers = [threading.Thread(target=lambda: output['stderr'].append(process.stderr.read()))]
+            if not progress:
+                readers.append(threading.Thread(target=lambda: output['stdout'].append(process.stdout.read())))
+            for reader in readers:
+                reader.start()
+            timeout.start()
+
+            if progress:
+                for block in parse_ffmpeg_progress(line.decode('utf-8', 'ignore') for line in process.stdout):
+                    speed = block.get('speed', speed)
+                    try:
+                        progress(block)
+                    except Exception:
+                        log.exception('Unable to report progress')
+            for reader in readers:
+                reader.join()
+            _, status, rusage = os.wait4(process.pid, 0)
+        finally:
+            timeout.cancel()
+            if status is None:
+                # Interrupted before the process was reaped - never leave it running (or a zombie)
+                process.kill()
+                try:
+                    os.wait4(process.pid, 0)
+                except ChildProcessError:
+                    pass
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+        self._add_usage(runs=1, cpu_seconds=rusage.ru_utime + rusage.ru_stime, speed=speed)
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, self.config['process_timeout_seconds'], stderr=b''.join(output['stderr']))
+        return subprocess.CompletedProcess(cmd, process.returncode, b''.join(output['stdout']), b''.join(output['stderr']))
+
+    def _add_usage(self, runs=0, cpu_seconds=0.0, speed=None):
+        self._usage.runs = getattr(self._usage, 'runs', 0) + runs
+        self._usage.cpu_seconds = getattr(self._usage, 'cpu_seconds', 0.0) + cpu_seconds
+        if speed:
+            self._usage.speed = speed
+
+    def reset_usage(self):
+        """
+        Start measuring the external processes run from the current thread
+        """
+        self._usage.runs = 0
+        self._usage.cpu_seconds = 0.0
+        self._usage.speed = None
+
+    @property
+    def usage(self):
+        """
+        Number of processes run, their total cpu time and the last reported ffmpeg speed factor
+        since `reset_usage` was called on the current thread
+        """
+        return {
+            'runs': getattr(self._usage, 'runs', 0),
+            'cpu_seconds': round(getattr(self._usage, 'cpu_seconds', 0.0), 2),
+            'speed': getattr(self._usage, 'speed', None),
+        }
+
     def probe_media(self, source):
         """
-        TODO: update for audio and images
+        Probe media with ffprobe's structured json output
         """
         if not source:
             return {}
         cmd_success, cmd_result = self._run_tool(
             *self.config['cmd_ffprobe'],
+            *cmd_args(
+                v='quiet',
+                print_format='json',
+                show_streams=None,
+                show_format=None,
+            ),
             source
         )
-        result = (cmd_result.stdout + cmd_result.stderr).decode('utf-8', 'ignore')
-        data = {}
-        try:
-            raw_duration = re.search(r'Duration: (\d+):(\d+):(\d+)\.(\d+)', result)
-            hours = float(raw_duration.group(1)) * 60.0 * 60.0
-            minutes = float(raw_duration.group(2)) * 60.0
-            seconds = float(raw_duration.group(3))
-            fraction = raw_duration.group(4)
-            fraction = float(fraction) / (10**(len(fraction)))
-            data['duration'] = hours + minutes + seconds + fraction
-        except:
-            pass
-        try:
-            raw_res = re.search(r'Video:.*?(\d{3,4})x(\d{3,4}).*?', result)
-            data['width'] = int(raw_res.group(1))
-            data['height'] = int(raw_res.group(2))
-        except:
-            pass
+        if not cmd_success:
+            return {}
         try:
-            raw_audio = re.search(r'Audio:\s*(?P<format>\w+?)[\s,].*, (?P<sample_rate>\d+) Hz,.*, (?P<bitrate>\d+) kb', result)
-            data['audio'] = raw_audio.groupdict()
-        except:
-            pass
-        return data
+            return parse_probe_json(json.loads(cmd_result.stdout.decode('utf-8', 'ignore')))
+        except json.decoder.JSONDecodeError as ex:
+            log.error('Unable to parse ffprobe output for %s %s', source, ex)
+            return {}
 
 
     def encode_image_to_video(self, source, destination, duration=10, width=320, height=240, **kwargs):
@@ -165,7 +423,7 @@ class ProcessMediaFilesWithExternalTools():
         TODO: use same codec as encode_video
         """
         log.debug('encode_image_to_video - %s', os.path.basename(source))
-        self._run_tool(
+        return self._run_tool(
             *self.config['ffmpeg_base_args'],
             '-loop', '1',
             '-i', source,
@@ -177,62 +435,344 @@ class ProcessMediaFilesWithExternalTools():
         )
 
 
-    def encode_video(self, video_source, audio_source, subtitle_source, destination):
+    def _audio_filters(self, audio_gain=0, audio_duration=None):
+        """
+        Normalize + fade audio within the ffmpeg filter graph (no intermediate audio files)
+        Equivalent to the previous `sox audio_raw.wav audio.wav fade l 0.15 0 0.15 norm`
+
+        >>> ProcessMediaFilesWithExternalTools()._audio_filters(audio_gain=3.5, audio_duration=10)
+        ['aformat=sample_rates=44100:channel_layouts=stereo', 'afade=t=in:d=0.15:curve=log', 'afade=t=out:st=9.85:d=0.15:curve=log', 'volume=3.5dB']
+        >>> ProcessMediaFilesWithExternalTools()._audio_filters()
+        ['aformat=sample_rates=44100:channel_layouts=stereo', 'afade=t=in:d=0.15:curve=log', 'volume=0dB']
+        """
+        fade = self.config['audio_fade_seconds']
+        filters = [
+            self.config['audio_format'],
+            f'afade=t=in:d={fade}:curve=log',
+        ]
+        if audio_duration:
+            filters.append(f'afade=t=out:st={round(max(audio_duration - fade, 0), 3)}:d={fade}:curve=log')
+        filters.append(f'volume={audio_gain}dB')
+        return filters
+
+    def encode_video(self, video_source, audio_source, subtitle_source, destination, preview_destination=None, audio_gain=0, audio_duration=None, progress=None, chunk_seconds=None, chunk_workers=None, video_stream=None):
+        """
+        The audio is faded and normalized (see `probe_audio_peak`) as part of the same ffmpeg process.
+
+        If a `preview_destination` is given, the source is decoded (and subtitles burnt in) once
+        and the frames are split to produce both the primary video and the scaled down preview
+        video from a single filter graph. This avoids a second full decode of the primary video.
+
+        Sources longer than two `chunk_seconds` are encoded in parallel segments (see `encode_video_chunked`)
+
+        video_stream: index of the source stream to encode (`source_details['video']['stream']`), default the first video stream
+        """
+        if chunk_seconds and audio_duration and audio_duration >= chunk_seconds * 2:
+            return self.encode_video_chunked(
+                video_source, audio_source, subtitle_source, destination, preview_destination=preview_destination,
+                audio_gain=audio_gain, audio_duration=audio_duration, progress=progress,
+                chunk_seconds=chunk_seconds, chunk_workers=chunk_workers, video_stream=video_stream,
+            )
         log.debug('encode_video - %s', os.path.basename(video_source))
 
-        filters = [self.config['scale_even']]
+        video_filters = [self.config['scale_even']]
         if subtitle_source:
-            filters.append(f'subtitles={subtitle_source}')
+            video_filters.append(f'subtitles={subtitle_source}')
+        audio_filters = self._audio_filters(audio_gain=audio_gain, audio_duration=audio_duration)
+
+        outputs = (('video', destination, self.config['encode_video']), )
+        if preview_destination:
+            outputs += (('preview', preview_destination, self.config['encode_preview_streams']), )
+
+        filter_complex = [
+            '[{stream}]{filters}, split={count}{labels}'.format(
+                stream=video_stream_map(video_stream),
+                filters=', '.join(video_filters),
+                count=len(outputs),
+                labels=''.join(f'[{name}_v_unscaled]' if name == 'preview' else f'[{name}_v]' for name, _, _ in outputs),
+            ),
+            '[1:a:0]{filters}, asplit={count}{labels}'.format(
+                filters=', '.join(audio_filters),
+                count=len(outputs),
+                labels=''.join(f'[{name}_a]' for name, _, _ in outputs),
+            ),
+        ]
+        if preview_destination:
+            filter_complex.append('[preview_v_unscaled]{}[preview_v]'.format(self.config['vf_for_preview']))
+
+        def output_args():
+            for name, output_destination, output_args in outputs:
+                yield from ('-map', f'[{name}_v]', '-map', f'[{name}_a]')
+                yield from output_args
+                yield output_destination
 
         return self._run_tool(
             *self.config['ffmpeg_base_args'],
+            *self._progress_args(progress),
             '-i', video_source,
             '-i', audio_source,
+            '-filter_complex', '; '.join(filter_complex),
+            *output_args(),
+            progress=progress,
+        )
+
+    def probe_keyframes(self, source, video_stream=None):
+        """
+        Times (relative to the start of the source, see `parse_keyframes`) of the keyframes
+        in the video stream (default the first video stream).
+        Only the packet flags are read, the video is not decoded.
+        """
+        cmd_success, cmd_result = self._run_tool(
+            *self.config['cmd_ffprobe'],
+            *cmd_args(
+                v='error',
+                select_streams='v:0' if video_stream is None else str(video_stream),
+                show_entries='packet=pts_time,flags:format=start_time',
+                of='csv',
+            ),
+            source,
+        )
+        if not cmd_success:
+            return ()
+        return parse_keyframes(cmd_result.stdout.decode('utf-8', 'ignore').splitlines())
+
+    def can_remux_video(self, source_details):
+        """
+        Can the source video stream be copied as is (no subtitles to burn in is a precondition for the caller)
+
+        >>> tools = ProcessMediaFilesWithExternalTools()
+        >>> details = {'width': 1280, 'height': 720, 'video': {'format': 'h264', 'pix_fmt': 'yuv420p', 'bitrate': '1200'}}
+        >>> tools.can_remux_video(details)
+        True
+        >>> tools.can_remux_video({**details, 'video': {**details['video'], 'format': 'mpeg4'}})
+        False
+        >>> tools.can_remux_video({**details, 'video': {**details['video'], 'bitrate': '5000'}})
+        False
+        >>> tools.can_remux_video({**details, 'width': 1279})
+        False
+        >>> tools.can_remux_video({'width': 1280, 'height': 720, 'video': {'format': 'h264'}})
+        False
+        """
+        video = source_details.get('video') or {}
+        width, height = source_details.get('width'), source_details.get('height')
+        try:
+            bitrate = int(video.get('bitrate'))
+        except (TypeError, ValueError):
+            return False  # unknown bitrate - we cant know it is suitable for streaming
+        return bool(
+            video.get('format') in self.config['remux_video_formats'] and
+            video.get('pix_fmt') in self.config['remux_pix_fmts'] and
+            bitrate <= self.config['remux_max_video_bitrate_kbits'] and
+            width and height and width % 2 == 0 and height % 2 == 0 and
+            height <= self.config['remux_max_height']
+        )
+
+    def remux_video(self, video_source, audio_source, destination, audio_gain=0, audio_duration=None, progress=None, video_stream=None):
+        """
+        Stream copy the source video. Only the audio is normalised/faded + encoded.
+        The moov atom is moved to the start of the file for progressive playback.
+        """
+        log.debug('remux_video - %s', os.path.basename(video_source))
+        return self._run_tool(
+            *self.config['ffmpeg_base_args'],
+            *self._progress_args(progress),
+            '-i', video_source,
+            '-i', audio_source,
+            '-map', video_stream_map(video_stream),
+            '-map', '1:a:0',
             *cmd_args(
-                vf=', '.join(filters),
+                **{'c:v': 'copy'},
+                af=', '.join(self._audio_filters(audio_gain=audio_gain, audio_duration=audio_duration)),
             ),
-            *self.config['encode_video'],
+            *self.config['encode_video_audio_stream'],
+            *cmd_args(movflags='+faststart'),
             destination,
+            progress=progress,
         )
 
-    def encode_audio(self, source, destination, **kwargs):
+    def encode_video_chunked(self, video_source, audio_source, subtitle_source, destination, preview_destination=None, audio_gain=0, audio_duration=None, progress=None, chunk_seconds=300, chunk_workers=None, video_stream=None):
         """
-            Decompress audio
-            Normalize audio volume
-            Offset audio
+        Encode very long sources as time segments in parallel (one ffmpeg process per segment)
+
+        * The audio is normalised/faded and encoded once for the whole duration.
+        * The source is split at keyframes (see `chunk_boundaries`) and each segment is encoded
+          concurrently. Frames are shifted back to source time before the subtitles are burnt in,
+          so the subtitles are timed correctly in every segment.
+        * The encoded segments are joined (+ audio muxed) losslessly with the concat demuxer.
+
+        Each ffmpeg process is individually subject to `process_timeout_seconds`.
+        Produces the same outputs as `encode_video`.
         """
-        log.debug('encode_audio - %s', os.path.basename(source))
+        log.debug('encode_video_chunked - %s', os.path.basename(video_source))
+        chunk_workers = chunk_workers or max(1, (os.cpu_count() or 1) // max(1, int(self.config['threads'])))
+        chunks = chunk_boundaries(self.probe_keyframes(video_source, video_stream=video_stream) or (0.0, ), audio_duration, chunk_seconds)
 
-        path = os.path.dirname(destination)
+        outputs = (('video', destination, 'encode_video'), )
+        if preview_destination:
+            outputs += (('preview', preview_destination, 'encode_preview'), )
 
-        cmds = (
-            lambda: self._run_tool(
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(destination))) as tempdir:
+            def temp_file(name, index=None, ext='mp4'):
+                return os.path.join(tempdir, f'{name}.{ext}' if index is None else f'{name}_{index:04d}.{ext}')
+
+            # Audio - once for the whole duration
+            audio_result = self._run_tool(
                 *self.config['ffmpeg_base_args'],
-                '-i', source,
-                *self.config['extract_audio'],
-                os.path.join(path, 'audio_raw.wav'),
-            ),
-            lambda: self._run_tool(
-                *self.config['cmd_sox'],
-                os.path.join(path, 'audio_raw.wav'),
-                #os.path.join(path, 'audio_norm.wav'),
-                destination,
-                'fade', 'l', '0.15', '0', '0.15',
-                'norm',
-            ),
-            # TODO: Cut and offset
-        )
+                '-i', audio_source,
+                '-filter_complex', '[0:a:0]{filters}, asplit={count}{labels}'.format(
+                    filters=', '.join(self._audio_filters(audio_gain=audio_gain, audio_duration=audio_duration)),
+                    count=len(outputs),
+                    labels=''.join(f'[{name}_a]' for name, _, _ in outputs),
+                ),
+                *(
+                    arg
+                    for name, _, config_prefix in outputs
+                    for arg in ('-map', f'[{name}_a]', *self.config[f'{config_prefix}_audio_stream'], temp_file(name, ext='m4a'))
+                ),
+            )
+            if not audio_result.success:
+                return audio_result
+
+            # Video segments - concurrently
+            chunk_progress = {}
+            def report_chunk_progress(index, block):
+                chunk_progress[index] = block
+                progress({
+                    'frame': sum(b.get('frame') or 0 for b in chunk_progress.values()),
+                    'out_time': sum(b.get('out_time') or 0 for b in chunk_progress.values()),
+                    'speed': sum(b.get('speed') or 0 for b in chunk_progress.values() if b.get('progress') != 'end') or None,
+                    'progress': 'continue',
+                })
+
+            def encode_chunk(index, start, end):
+                self.reset_usage()
+                video_filters = [f'setpts=PTS+{start}/TB', self.config['scale_even']]
+                if subtitle_source:
+                    video_filters.append(f'subtitles={subtitle_source}')
+                video_filters.append('setpts=PTS-STARTPTS')
+                filter_complex = [
+                    '[{stream}]{filters}, split={count}{labels}'.format(
+                        stream=video_stream_map(video_stream),
+                        filters=', '.join(video_filters),
+                        count=len(outputs),
+                        labels=''.join(f'[{name}_v_unscaled]' if name == 'preview' else f'[{name}_v]' for name, _, _ in outputs),
+                    ),
+                ]
+                if preview_destination:
+                    filter_complex.append('[preview_v_unscaled]{}[preview_v]'.format(self.config['vf_for_preview']))
+                chunk_progress_callback = partial(report_chunk_progress, index) if progress else None
+                result = self._run_tool(
+                    *self.config['ffmpeg_base_args'],
+                    *self._progress_args(chunk_progress_callback),
+                    '-ss', str(start),
+                    '-t', str(round(end - start, 3)),  # Input option - limits every output of this chunk
+                    '-i', video_source,
+                    '-filter_complex', '; '.join(filter_complex),
+                    *(
+                        arg
+                        for name, _, config_prefix in outputs
+                        for arg in ('-map', f'[{name}_v]', '-an', *self.config[f'{config_prefix}_video_stream'], temp_file(name, index))
+                    ),
+                    progress=chunk_progress_callback,
+                )
+                return result, self.usage
+
+            start_time = time.time()
+            with ThreadPoolExecutor(max_workers=chunk_workers) as executor:
+                chunk_results = tuple(executor.map(lambda chunk: encode_chunk(*chunk), ((index, start, end) for index, (start, end) in enumerate(chunks))))
+            for _, usage in chunk_results:
+                self._add_usage(runs=usage['runs'], cpu_seconds=usage['cpu_seconds'])
+            if audio_duration:
+                self._add_usage(speed=round(audio_duration / max(time.time() - start_time, 0.001), 2))
+            for chunk_result, _ in chunk_results:
+                if not chunk_result.success:
+                    return chunk_result
+
+            # Join segments + mux audio
+            for name, output_destination, _ in outputs:
+                concat_list = temp_file(name, ext='txt')
+                with open(concat_list, 'w', encoding='utf-8') as filehandle:
+                    for index in range(len(chunks)):
+                        filehandle.write("file '{}'\n".format(temp_file(name, index)))
+                join_result = self._run_tool(
+                    *self.config['ffmpeg_base_args'],
+                    *cmd_args(f='concat', safe=0),
+                    '-i', concat_list,
+                    '-i', temp_file(name, ext='m4a'),
+                    '-map', '0:v:0',
+                    '-map', '1:a:0',
+                    *cmd_args(c='copy', movflags='+faststart'),
+                    output_destination,
+                )
+                if not join_result.success:
+                    return join_result
+
+        return join_result
+
+    def decode_test(self, source, duration=None, sample_seconds=2):
+        """
+        Cheap integrity check - decode a few seconds of the video/audio streams at the start and end of the source.
+        Truncated or corrupt files fail here in seconds rather than after a long encode.
 
-        for cmd in cmds:
-            cmd_success, cmd_result = cmd()
-            if not cmd_success:
-                return False, cmd_result
+        Only video/audio are mapped (the null muxer cannot take subtitle/data/attachment streams e.g. mkv fonts).
+        Pass/fail is the exit code (`-xerror` stops on the first decode error) - recoverable
+        warnings logged at `-v error` do not fail the test.
+        """
+        log.debug('decode_test - %s', os.path.basename(source))
+        times = (0, )
+        if duration and duration > sample_seconds * 2:
+            times += (round(duration - sample_seconds * 2, 3), )
+
+        def inputs():
+            for time in times:
+                yield from ('-ss', str(time), '-t', str(sample_seconds), '-i', source)
+
+        cmd_success, cmd_result = self._run_tool(
+            *self.config['cmd_ffmpeg'],
+            '-hide_banner',
+            '-nostats',
+            *cmd_args(v='error', xerror=None),
+            *inputs(),
+            *(arg for index, _ in enumerate(times) for arg in ('-map', f'{index}:v?', '-map', f'{index}:a?')),
+            *cmd_args(f='null'),
+            '-',
+        )
+        if not cmd_success:
+            return False, 'decode test failed {0} {1}'.format(source, cmd_result.stderr.decode('utf-8', 'ignore').strip())
         return True, None
 
+    def probe_audio_peak(self, source):
+        """
+        Decode the audio (to nowhere) and measure the peak volume.
+        The returned peak (dB, <= 0) is used to normalize the audio while encoding (like `sox norm`)
+        """
+        log.debug('probe_audio_peak - %s', os.path.basename(source))
 
-    def encode_preview_video(self, source, destination):
+        cmd_success, cmd_result = self._run_tool(
+            *self.config['cmd_ffmpeg'],
+            '-hide_banner',
+            '-nostats',
+            '-i', source,
+            *cmd_args(
+                vn=None,
+                af='volumedetect',
+                f='null',
+            ),
+            '-',
+        )
+        if not cmd_success:
+            return False, cmd_result
+        max_volume = re.search(r'max_volume: (-?[\d.]+) dB', cmd_result.stderr.decode('utf-8', 'ignore'))
+        if not max_volume:
+            return False, 'unable to detect audio peak volume (source may have no audio) {0}'.format(source)
+        return True, float(max_volume.group(1))
+
+
+    def encode_preview_video(self, source, destination, progress=None, start=None, duration=None):
         """
         https://trac.ffmpeg.org/wiki/Encode/AAC#HE-AACversion2
+
+        `start` + `duration` (seconds) encode a short excerpt (input seeking - only the excerpt is decoded)
         """
         log.debug('encode_preview_video - %s', os.path.basename(source))
 
@@ -241,34 +781,117 @@ class ProcessMediaFilesWithExternalTools():
 
         return self._run_tool(
             *self.config['ffmpeg_base_args'],
+            *self._progress_args(progress),
+            *(('-ss', str(start)) if start else ()),
             '-i', source,
+            *(('-t', str(duration)) if duration else ()),
             *self.config['encode_preview'],
             destination,
+            progress=progress,
         )
 
 
+    def encode_hls(self, source, destination_folder, renditions, segment_seconds=4, crf=23, progress=None):
+        """
+        Adaptive bitrate HLS from the processed video (subtitles are already burnt in, audio already normalised)
+
+        The source is decoded once and split to each rendition of the ladder (never upscaled).
+        Keyframes are forced at segment boundaries so that players can switch rendition between segments.
+        Each rendition is written as a single media file addressed with byte ranges (`stream_N.ts` + `stream_N.m3u8`)
+        along with a `master.m3u8` (see `hls.hls_output_filenames`)
+        """
+        log.debug('encode_hls - %s', os.path.basename(source))
+        filter_complex = ['[0:v:0]split={count}{labels}'.format(
+            count=len(renditions),
+            labels=''.join(f'[v{index}]' for index in range(len(renditions))),
+        )] + [
+            f"[v{index}]scale=w=-2:h='min({rendition.height},ih)'[v{index}out]"
+            for index, rendition in enumerate(renditions)
+        ]
+
+        def rendition_args():
+            for index, rendition in enumerate(renditions):
+                yield from ('-map', f'[v{index}out]', '-map', '0:a:0')
+                yield from cmd_args(**{
+                    f'maxrate:v:{index}': f'{rendition.max_video_bitrate_kbits}k',
+                    f'bufsize:v:{index}': f'{rendition.max_video_bitrate_kbits * 2}k',
+                    f'b:a:{index}': f'{rendition.audio_bitrate_kbits}k',
+                })
+
+        cmd_success, cmd_result = self._run_tool(
+            *self.config['ffmpeg_base_args'],
+            *self._progress_args(progress),
+            '-i', source,
+            '-filter_complex', '; '.join(filter_complex),
+            *rendition_args(),
+            *cmd_args(
+                vcodec=self.config['h264_codec'],
+                crf=crf,
+                force_key_frames=f'expr:gte(t,n_forced*{segment_seconds})',
+                sc_threshold=0,
+                acodec='aac',
+                threads=self.config['threads'],
+                f='hls',
+                hls_time=segment_seconds,
+                hls_playlist_type='vod',
+                hls_flags='single_file',
+                master_pl_name='master.m3u8',
+                var_stream_map=' '.join(f'v:{index},a:{index}' for index in range(len(renditions))),
+            ),
+            os.path.join(destination_folder, 'stream_%v.m3u8'),
+            progress=progress,
+        )
+        if not cmd_success:
+            return cmd_success, cmd_result
+        if not os.path.exists(os.path.join(destination_folder, 'master.m3u8')):
+            return False, 'expected hls master playlist was not generated {0}'.format(source)
+        return True, None
+
     def extract_image(self, source, destination, time=0.2):
-        log.debug('extract_image - %s', os.path.basename(source))
+        return self.extract_images(source, (destination, ), (time, ))
 
-        cmds = (
-            lambda: self._run_tool(
-                *self.config['ffmpeg_base_args'],
-                '-i', source,
-                *cmd_args(
-                    ss=str(time),
+
+    def extract_images(self, source, destinations, times):
+        """
+        Extract multiple thumbnail images with a single ffmpeg process.
+
+        Each time is a separate input with `-ss` placed before `-i`. This uses
+        fast (keyframe) input seeking rather than decoding the source from the start.
+        All the generated jpegs are then optimised with a single jpegoptim call.
+        """
+        log.debug('extract_images - %s', os.path.basename(source))
+        assert len(destinations) == len(times)
+
+        def inputs():
+            for time in times:
+                yield from ('-ss', str(time), '-i', source)
+
+        def outputs():
+            for index, destination in enumerate(destinations):
+                yield from ('-map', '{}:v:0'.format(index))
+                yield from cmd_args(
                     vframes=1,
                     an=None,
                     vf=self.config['vf_for_preview'],
-                ),
-                destination,
+                )
+                yield destination
+
+        cmds = (
+            lambda: self._run_tool(
+                *self.config['ffmpeg_base_args'],
+                *inputs(),
+                *outputs(),
+            ),
+            lambda: (
+                all(os.path.exists(destination) for destination in destinations),
+                'expected destination image files were not generated (video source may be damaged) {0}'.format(source)
             ),
-            lambda: (os.path.exists(destination), 'expected destination image file was not generated (video source may be damaged) {0}'.format(source)),
             lambda: self._run_tool(
                 *self.config['cmd_jpegoptim'],
                 #'--size={}'.format(CONFIG['jpegoptim']['target_size_k']),
                 '--strip-all',
                 '--overwrite',
-                destination,
+                *destinations,
             ),
         )
 
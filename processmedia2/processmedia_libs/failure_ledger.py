@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+from contextlib import contextmanager
+
+from .atomic_file import atomic_write
+
+import logging
+log = logging.getLogger(__name__)
+
+
+DEFAULT_BACKOFF_SECONDS = 60 * 60
+DEFAULT_MAX_BACKOFF_SECONDS = 60 * 60 * 24 * 7
+DEFAULT_QUARANTINE_FAILURES = 5
+
+
+def retry_after(failures, last_failed, backoff_seconds=DEFAULT_BACKOFF_SECONDS, max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS):
+    """
+    Exponential backoff from the last failure
+
+    >>> tuple(retry_after(failures, 0, backoff_seconds=10, max_backoff_seconds=100) for failures in (1, 2, 3, 4, 5))
+    (10, 20, 40, 80, 100)
+    """
+    return last_failed + min(backoff_seconds * 2 ** (failures - 1), max_backoff_seconds)
+
+
+class FailureLedger(object):
+    """
+    Persistent record of encode failures keyed by source hash.
+
+    A failing source is not retried until its backoff has expired and is quarantined
+    (never retried) after `quarantine_failures` failures. Any change to the source files
+    changes the source hash, so a fixed source is always retried.
+
+    If no path is given all methods are a no-op.
+
+    >>> with tempfile.TemporaryDirectory() as tempdir:
+    ...     ledger = FailureLedger(os.path.join(tempdir, 'failures.json'), backoff_seconds=10, quarantine_failures=2)
+    ...     ledger.blocked('abc', now=0)
+    ...     ledger.record_failure('abc', 'Track A', 'primary_video failed', now=0)
+    ...     ledger.blocked('abc', now=5)
+    ...     ledger.blocked('abc', now=11)
+    ...     ledger.record_failure('abc', 'Track A', 'primary_video failed', now=11)
+    ...     ledger.blocked('abc', now=10000)
+    ...     ledger.record_success('abc')
+    ...     ledger.blocked('abc', now=10000)
+    ...     ledger.record_failure('bcd', 'Track B', 'preflight failed', now=0, quarantine=True)
+    ...     ledger.blocked('bcd', now=10000)
+    'backoff: 1 failures - retry in 5s - primary_video failed'
+    'quarantined: 2 failures - primary_video failed'
+    'quarantined: 1 failures - preflight failed'
+    """
+
+    def __init__(self, path=None, backoff_seconds=DEFAULT_BACKOFF_SECONDS, max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS, quarantine_failures=DEFAULT_QUARANTINE_FAILURES):
+        self.path = path
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.quarantine_failures = quarantine_failures
+
+    @contextmanager
+    def _update(self):
+        with open(f'{self.path}.lock', 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                failures = self.failures
+                yield failures
+                with atomic_write(self.path) as destination:
+                    json.dump(failures, destination)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    @property
+    def failures(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, 'rt') as filehandle:
+                return json.load(filehandle)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def blocked(self, source_hash, now=None):
+        """
+        Returns the reason the source should not be encoded now, or None if it can be attempted
+        """
+        failure = self.failures.get(source_hash)
+        if not source_hash or not failure:
+            return None
+        if failure.get('quarantined') or failure['failures'] >= self.quarantine_failures:
+            return 'quarantined: {failures} failures - {reason}'.format(**failure)
+        now = time.time() if now is None else now
+        _retry_after = retry_after(failure['failures'], failure['last_failed'], self.backoff_seconds, self.max_backoff_seconds)
+        if now < _retry_after:
+            return 'backoff: {failures} failures - retry in {seconds}s - {reason}'.format(seconds=round(_retry_after - now), **failure)
+        return None
+
+    def record_failure(self, source_hash, name, reason, now=None, quarantine=False):
+        """
+        quarantine: the source is known to be broken - do not retry it
+        """
+        if not self.path or not source_hash:
+            return
+        now = time.time() if now is None else now
+        with self._update() as failures:
+            failure = failures.setdefault(source_hash, {'name': name, 'failures': 0, 'first_failed': now})
+            failure.update({
+                'name': name,
+                'failures': failure['failures'] + 1,
+                'last_failed': now,
+                'reason': reason,
+                'quarantined': quarantine or failure['failures'] + 1 >= self.quarantine_failures,
+            })
+            if failure['quarantined']:
+                log.warning('Quarantined %s after %s failures - %s', name, failure['failures'], reason)
+
+    def record_success(self, source_hash):
+        if not self.path or source_hash not in self.failures:
+            return
+        with self._update() as failures:
+            failures.pop(source_hash, None)
+
+    def report(self, now=None):
+        """
+        Rows of failed sources, most failures first
+        """
+        return sorted(
+            (
+                {
+                    'source_hash': source_hash,
+                    **failure,
+                    'status': self.blocked(source_hash, now=now) or 'retry',
+                }
+                for source_hash, failure in self.failures.items()
+            ),
+            key=lambda row: (-row['failures'], row['name']),
+        )
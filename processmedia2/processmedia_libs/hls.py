@@ -0,0 +1,65 @@
+import os
+import re
+from collections import namedtuple
+
+import logging
+log = logging.getLogger(__name__)
+
+
+HLSRendition = namedtuple('HLSRendition', ('name', 'height', 'max_video_bitrate_kbits', 'audio_bitrate_kbits'))
+
+# Small ladder - phones on poor venue wifi start on the lowest rendition; the projector can pull the highest.
+HLS_RENDITIONS = (
+    HLSRendition('240p', 240, 400, 64),
+    HLSRendition('480p', 480, 1000, 96),
+    HLSRendition('720p', 720, 2000, 128),
+)
+HLS_SEGMENT_SECONDS = 4
+HLS_CRF = 23  # Capped (maxrate) constant quality - simple content uses less than the rendition bitrate
+
+
+def hls_output_filenames(renditions):
+    """
+    Files produced by `encode_hls` in the output folder, keyed by processed file dict_key
+
+    >>> hls_output_filenames(HLS_RENDITIONS[:1])
+    {'hls': 'master.m3u8', 'hls_240p_playlist': 'stream_0.m3u8', 'hls_240p_media': 'stream_0.ts'}
+    """
+    filenames = {'hls': 'master.m3u8'}
+    for index, rendition in enumerate(renditions):
+        filenames[f'hls_{rendition.name}_playlist'] = f'stream_{index}.m3u8'
+        filenames[f'hls_{rendition.name}_media'] = f'stream_{index}.ts'
+    return filenames
+
+
+def rewrite_playlist(playlist, uris):
+    """
+    Replace the uris in a m3u8 playlist.
+    Processed files are named by hash (in different folders), so the playlists ffmpeg
+    wrote have to be pointed at the processed file location.
+
+    >>> print(rewrite_playlist(
+    ...     '#EXTM3U\\n#EXT-X-BYTERANGE:1000@0\\nstream_0.ts\\n#EXT-X-MAP:URI="stream_0.ts"\\n',
+    ...     {'stream_0.ts': '../a/abc.ts'},
+    ... ))
+    #EXTM3U
+    #EXT-X-BYTERANGE:1000@0
+    ../a/abc.ts
+    #EXT-X-MAP:URI="../a/abc.ts"
+    <BLANKLINE>
+    """
+    def replace_uri(match):
+        return uris.get(match.group(0), match.group(0))
+    uri_regex = re.compile('|'.join(re.escape(uri) for uri in sorted(uris, key=len, reverse=True)))
+    return '\n'.join(
+        uri_regex.sub(replace_uri, line) if (not line.startswith('#') or 'URI="' in line) else line
+        for line in playlist.split('\n')
+    )
+
+
+def relative_uri(target_absolute, playlist_absolute):
+    """
+    >>> relative_uri('/processed/a/abc.ts', '/processed/b/bcd.m3u8')
+    '../a/abc.ts'
+    """
+    return os.path.relpath(target_absolute, os.path.dirname(playlist_absolute)).replace(os.sep, '/')
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from .atomic_file import atomic_move
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def cache_key(name, source_hash, *parameters):
+    """
+    Stable key from the hash of the source file + the parameters used to create the intermediate.
+    Sources without a hash cannot be cached (None)
+
+    >>> cache_key('ssa', 'abc123', 1280, 720) == cache_key('ssa', 'abc123', 1280, 720)
+    True
+    >>> cache_key('ssa', 'abc123', 1280, 720) == cache_key('ssa', 'abc123', 640, 480)
+    False
+    >>> len(cache_key('ssa', 'abc123'))
+    64
+    >>> cache_key('ssa', None, 1280, 720)
+    """
+    if not source_hash:
+        return None
+    return hashlib.sha256(json.dumps((name, source_hash, parameters), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class IntermediateCache(object):
+    """
+    Content addressed store for intermediate encode files (e.g. the normalised subtitles
+    or the video rendered from a single image).
+
+    Intermediates are normally created in a TemporaryDirectory and lost if the
+    primary encode fails. With a cache path, finished intermediates survive so that
+    retries (and re-encodes after config changes that do not affect the intermediate)
+    reuse them.
+
+    The cache is bounded to `max_size_bytes`. The least recently used files are evicted
+    (the mtime is touched on every cache hit).
+
+    If no path (or key) is given, intermediates are created in the given tempdir each time.
+
+    >>> with tempfile.TemporaryDirectory() as cache_path, tempfile.TemporaryDirectory() as tempdir:
+    ...     cache = IntermediateCache(cache_path, max_size_bytes=10)
+    ...     calls = []
+    ...     def create(destination, content='12345'):
+    ...         calls.append(destination)
+    ...         with open(destination, 'w') as filehandle:
+    ...             _ = filehandle.write(content)
+    ...         return True
+    ...     a = cache.get_or_create(cache_key('test', 'a'), 'a.txt', create, tempdir)
+    ...     a == cache.get_or_create(cache_key('test', 'a'), 'a.txt', create, tempdir)
+    ...     len(calls)
+    ...     os.utime(a, (1, 1))  # a is now the least recently used
+    ...     b = cache.get_or_create(cache_key('test', 'b'), 'b.txt', create, tempdir)
+    ...     c = cache.get_or_create(cache_key('test', 'c'), 'c.txt', create, tempdir)
+    ...     tuple(map(os.path.exists, (a, b, c)))
+    ...     cache.get_or_create(cache_key('test', 'd'), 'd.txt', lambda destination: False, tempdir)
+    True
+    1
+    (False, True, True)
+    """
+
+    def __init__(self, path=None, max_size_bytes=None):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    def _cache_file(self, key, filename):
+        return os.path.join(self.path, key[:2], '{}{}'.format(key, os.path.splitext(filename)[1]))
+
+    def get_or_create(self, key, filename, create_function, tempdir):
+        """
+        create_function(destination) -> truthy on success
+        Returns the absolute path of the intermediate file or None if it could not be created
+        """
+        if not self.path or not key:
+            destination = os.path.join(tempdir, filename)
+            return destination if create_function(destination) and os.path.exists(destination) else None
+
+        cache_file = self._cache_file(key, filename)
+        if os.path.exists(cache_file):
+            log.debug('Intermediate cache hit %s %s', filename, key)
+            os.utime(cache_file)
+            return cache_file
+
+        # Create in the tempdir and atomically move into the cache, so a failed or
+        # interrupted create never leaves a partial file in the cache.
+        destination = os.path.join(tempdir, filename)
+        if not create_function(destination) or not os.path.exists(destination):
+            return None
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        atomic_move(destination, cache_file)  # tempdir may be on a different filesystem
+
+        self.evict(keep=(cache_file, ))
+        return cache_file
+
+    @property
+    def files(self):
+        for root, dirs, files in os.walk(self.path):
+            for filename in files:
+                if filename.startswith('.'):
+                    continue
+                absolute = os.path.join(root, filename)
+                try:
+                    stat = os.stat(absolute)
+                except FileNotFoundError:  # Evicted by another process
+                    continue
+                yield absolute, stat
+
+    def evict(self, keep=()):
+        """
+        Remove the least recently used files until the cache is within budget
+        """
+        if not self.path or not self.max_size_bytes:
+            return
+        files = sorted(self.files, key=lambda file_stat: file_stat[1].st_mtime)
+        size = sum(stat.st_size for _, stat in files)
+        for absolute, stat in files:
+            if size <= self.max_size_bytes:
+                break
+            if absolute in keep:
+                continue
+            log.debug('Intermediate cache evicting %s', absolute)
+            try:
+                os.remove(absolute)
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
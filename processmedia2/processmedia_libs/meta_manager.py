@@ -1,10 +1,10 @@
 import os
-import json
-import time
-import re
+import fcntl
+from contextlib import contextmanager
 
-from calaldees.data import freeze
-from calaldees.files.scan import fast_scan
+from .meta_store import meta_store_factory
+from .meta_summary import summarise_meta, uploaded_mtime
+from .tracked_data import TrackedDict, ChangeCounter
 
 import logging
 log = logging.getLogger(__name__)
@@ -12,79 +12,120 @@ log = logging.getLogger(__name__)
 
 class MetaManager(object):
 
-    def __init__(self, path_meta=None):
+    def __init__(self, path_meta=None, meta_store=None):
         assert path_meta
         self.path = path_meta
         self._release_cache()
         os.makedirs(os.path.abspath(self.path), exist_ok=True)
+        self.store = meta_store_factory(self.path, meta_store)
 
     def _release_cache(self):
         self.meta = {}
-        self._meta_timestamps = {}
+        self._meta_versions = {}
 
     def get(self, name):
         return self.meta.get(name)
 
-    def _filepath(self, name):
-        return os.path.join(self.path, '{0}.json'.format(name))
+    def _lockfilepath(self, name):
+        return os.path.join(self.path, '.locks', '{0}.lock'.format(name))
+
+    @contextmanager
+    def lock(self, name):
+        """
+        Exclusive per-name lock that is shared between processes.
+        Multiple encode workers use this to ensure they never process the same name at once.
+        Yields False (rather than blocking) if another process already holds the lock.
+        """
+        lockfilepath = self._lockfilepath(name)
+        os.makedirs(os.path.dirname(lockfilepath), exist_ok=True)
+        with open(lockfilepath, 'w') as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
 
     def load(self, name):
         assert name
         if self.meta.get(name):
             return
 
-        filepath = self._filepath(name)
-        data = {}
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r') as source:
-                    data = json.load(source)
-                self._meta_timestamps[name] = os.stat(filepath).st_mtime
-            except json.decoder.JSONDecodeError as ex:
-                log.error('Unable to load meta from %s %s', filepath, ex)
+        data, version = self.store.read(name)
+        if version is not None:
+            self._meta_versions[name] = version
         self.meta[name] = MetaFile(name, data)
 
     def save(self, name):
-        filepath = self._filepath(name)
         metafile = self.meta[name]
 
         if not metafile.has_updated():
             return
 
-        # If meta file modified since scan - abort
-        _check_meta_mtime_safety = False
-        if _check_meta_mtime_safety and os.path.exists(filepath):
-            mtime_expected = self._meta_timestamps[name]
-            mtime_current = os.stat(filepath).st_mtime
-            if mtime_current != mtime_expected:
-                log.warning(f'Refusing to save changes. {filepath} has been updated by another application. Expected mtime of {mtime_expected} but got {mtime_current}')
-                return
-
-        #log.info(f'meta saving {name} - before mtime {os.stat(filepath).st_mtime}')
-        with open(self._filepath(name), 'w') as destination:
-            json.dump(metafile.data, destination)
-        self._meta_timestamps[name] = os.stat(filepath).st_mtime
-        log.info(f'meta saved {name} - after mtime {self._meta_timestamps[name]}')
+        # If meta modified by another process since load - abort
+        # (json file mtimes are unreliable on some volume mounts, so only versioned stores are checked)
+        version = self.store.write(
+            name,
+            metafile.data,
+            expected_version=self._meta_versions.get(name),
+            check_version=self.store.RELIABLE_VERSIONS,
+        )
+        if version is None:
+            return
+        self._meta_versions[name] = version
+        metafile.mark_saved()
+        self.store.update_summaries({name: summarise_meta(name, metafile.data, version)})
+        log.info(f'meta saved {name} - version {version}')
 
     def delete(self, name):
         try:
-            os.remove(self._filepath(name))
+            self.store.delete(name)
         except Exception as e:
-            log.error('Unable to delete missing metafile - How did this happen? {}'.format(self._filepath(name)))
+            log.error('Unable to delete missing meta - How did this happen? {}'.format(name))
+        self.store.update_summaries({name: None})
         del self.meta[name]
 
     def load_all(self):
-        for f in self.files:
-            self.load(f.file_no_ext)
+        for name in self.names:
+            self.load(name)
 
     def save_all(self):
-        for name in self.meta.keys():
-            self.save(name)
+        with self.store.batch():
+            for name in self.meta.keys():
+                self.save(name)
 
     @property
-    def files(self):
-        # wha? (mtime == None or f.stat().st_mtime >= mtime)
-        return fast_scan(self.path, search_filter=lambda f: f.endswith('.json'))
+    def names(self):
+        return self.store.names()
+
+    def summaries(self):
+        """
+        {name: summary} of every meta without fully loading them (see `summarise_meta`).
+        Summaries are updated on each save. Any that are missing or stale (the meta
+        was changed by something else) are rebuilt from the meta and persisted.
+        """
+        versions = self.store.versions()
+        summaries = self.store.read_summaries()
+        updates = {name: None for name in summaries.keys() - versions.keys()}
+        for name, version in versions.items():
+            if summaries.get(name, {}).get('version') == version:
+                continue
+            data, version = self.store.read(name)
+            updates[name] = summarise_meta(name, data, version)
+        if updates:
+            log.info('Updating %s meta summaries', len(updates))
+            self.store.update_summaries(updates)
+        return {
+            name: updates.get(name) or summaries[name]
+            for name in versions.keys()
+        }
+
+    @property
+    def uploaded(self):
+        return uploaded_mtime(self.scan_data)
 
     @property
     def source_hashs(self):
@@ -98,12 +139,14 @@ class MetaFile(object):
 
     def __init__(self, name, data):
         self.name = name
-        self.data = data
+        self._changes = ChangeCounter()
+        self.data = TrackedDict(data, self._changes)
 
         self.scan_data = self.data.setdefault('scan', {})
         self.pending_actions = self.data.setdefault('actions', [])
         self.source_details = self.data.setdefault('processed', {})
-        self.data_hash = freeze(data).__hash__()
+        self.probe_cache = self.data.setdefault('probe', {})
+        self._saved_version = self._changes.version
 
         self.file_collection = set()
 
@@ -119,12 +162,24 @@ class MetaFile(object):
             file_data['relative'] = f.relative
             return
 
+        # Touched/copied file with the same content fingerprint - avoid reading the whole file for a full hash
+        fingerprint = getattr(f, 'fingerprint', None)
+        if fingerprint and file_data.get('fingerprint') == fingerprint:
+            file_data['relative'] = f.relative
+            file_data['mtime'] = mtime
+            return
+
         filehash = str(f.hash)
+        if fingerprint:
+            file_data['fingerprint'] = fingerprint
         if file_data.get('hash') == filehash:
             file_data['relative'] = f.relative
             file_data['mtime'] = mtime
             return
 
+        # The previous probe of this file is no longer valid
+        self.probe_cache.pop(file_data.get('hash'), None)
+
         # Remove any existing entries for this filehash in our previous scan collection
         for k in {k for k, v in self.scan_data.items() if v.get('hash') == filehash}:
             log.info('Removing entry for %s as this hash clashs with new entry %s', k, f.file)
@@ -140,7 +195,10 @@ class MetaFile(object):
             del self.source_details[self.SOURCE_HASHS_KEY]
 
     def has_updated(self):
-        return self.data_hash != freeze(self.data).__hash__()
+        return self._changes.version != self._saved_version
+
+    def mark_saved(self):
+        self._saved_version = self._changes.version
 
     @property
     def unassociated_files(self):
@@ -152,6 +210,7 @@ class MetaFile(object):
     def unlink_unassociated_files(self):
         for key, file_data in self.unassociated_files.items():
             log.info('Unlinking {} {}'.format(key, file_data['relative']))
+            self.probe_cache.pop(file_data.get('hash'), None)
             del self.scan_data[key]
 
     @property
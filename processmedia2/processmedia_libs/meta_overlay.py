@@ -2,16 +2,22 @@ from functools import lru_cache
 
 from .meta_manager import MetaManager, MetaFile
 from .source_files_manager import SourceFilesManager
-from .processed_files_manager import ProcessedFilesManager, gen_string_hash
+from .processed_files_manager import ProcessedFilesManager, gen_string_hash, DEFAULT_NUM_IMAGES
+from .hls import HLS_RENDITIONS
 
 
 class MetaManagerExtended(MetaManager):
     """
     """
     def __init__(self, *args, **kwargs):
-        super().__init__(kwargs['path_meta'])
+        super().__init__(kwargs['path_meta'], meta_store=kwargs.get('meta_store'))
         self.source_files_manager = SourceFilesManager(kwargs['path_source'])
-        self.processed_files_manager = ProcessedFilesManager(kwargs['path_processed'])
+        self.processed_files_manager = ProcessedFilesManager(
+            kwargs['path_processed'],
+            num_images=int(kwargs.get('num_images') or DEFAULT_NUM_IMAGES),
+            hls_renditions=HLS_RENDITIONS if kwargs.get('hls') else (),
+            preview_clip_seconds=int(kwargs.get('preview_clip_seconds') or 0) or None,
+        )
 
     def get(self, name):
         super_object = super().get(name)
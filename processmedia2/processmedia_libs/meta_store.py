@@ -0,0 +1,304 @@
+import os
+import json
+import fcntl
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from .atomic_file import atomic_write
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class JSONMetaStore(object):
+    """
+    One `{name}.json` file per track in the meta folder.
+    The version of a document is the mtime of it's file.
+    Summaries are held in a single hidden json file (rewritten once per `batch`).
+
+    >>> with tempfile.TemporaryDirectory() as tempdir:
+    ...     store = JSONMetaStore(tempdir)
+    ...     with store.batch():
+    ...         store.update_summaries({'test1': {'version': 1}, 'test2': {'version': 2}})
+    ...         store.read_summaries()
+    ...     store.update_summaries({'test2': None})
+    ...     store.read_summaries()
+    ...     store.names()
+    {}
+    {'test1': {'version': 1}}
+    ()
+    """
+    RELIABLE_VERSIONS = False  # mtimes take time to propagate on windows docker volume mounts
+    SUMMARY_FILENAME = '.meta_summary'
+
+    def __init__(self, path):
+        self.path = path
+        self._pending_summaries = None
+
+    def _filepath(self, name):
+        return os.path.join(self.path, '{0}.json'.format(name))
+
+    def names(self):
+        with os.scandir(self.path) as dir_entries:
+            return tuple(
+                dir_entry.name[:-len('.json')]
+                for dir_entry in dir_entries
+                if dir_entry.name.endswith('.json') and not dir_entry.name.startswith('.') and dir_entry.is_file()
+            )
+
+    def read(self, name):
+        """
+        Returns (data, version) - ({}, None) if the name does not exist
+        """
+        filepath = self._filepath(name)
+        try:
+            with open(filepath, 'r') as source:
+                data = json.load(source)
+            return data, os.stat(filepath).st_mtime
+        except FileNotFoundError:
+            return {}, None
+        except json.decoder.JSONDecodeError as ex:
+            log.error('Unable to load meta from %s %s', filepath, ex)
+            return {}, None
+
+    def version(self, name):
+        try:
+            return os.stat(self._filepath(name)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def write(self, name, data, expected_version=None, check_version=False):
+        """
+        Returns the new version, or None if `check_version` and the document has been changed by another process
+        """
+        filepath = self._filepath(name)
+        if check_version and expected_version is not None:
+            current_version = self.version(name)
+            if current_version != expected_version:
+                log.warning(f'Refusing to save changes. {filepath} has been updated by another application. Expected mtime of {expected_version} but got {current_version}')
+                return None
+        with atomic_write(filepath) as destination:
+            json.dump(data, destination)
+        return os.stat(filepath).st_mtime
+
+    def delete(self, name):
+        os.remove(self._filepath(name))
+
+    def versions(self):
+        """
+        {name: version} of every document without reading them
+        """
+        versions = {}
+        with os.scandir(self.path) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith('.json') and not dir_entry.name.startswith('.'):
+                    try:
+                        versions[dir_entry.name[:-len('.json')]] = dir_entry.stat().st_mtime
+                    except FileNotFoundError:
+                        pass
+        return versions
+
+    @property
+    def _summary_filepath(self):
+        return os.path.join(self.path, self.SUMMARY_FILENAME)
+
+    def read_summaries(self):
+        try:
+            with open(self._summary_filepath, 'rt') as filehandle:
+                return json.load(filehandle)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def update_summaries(self, summaries):
+        """
+        summaries: {name: summary} (a summary of None removes the name)
+        """
+        if self._pending_summaries is not None:
+            self._pending_summaries.update(summaries)
+            return
+        if not summaries:
+            return
+        with open(f'{self._summary_filepath}.lock', 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                existing = self.read_summaries()
+                for name, summary in summaries.items():
+                    if summary is None:
+                        existing.pop(name, None)
+                    else:
+                        existing[name] = summary
+                with atomic_write(self._summary_filepath) as destination:
+                    json.dump(existing, destination)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    @contextmanager
+    def batch(self):
+        """
+        Each write is already atomic per file - only the summary updates are batched
+        """
+        if self._pending_summaries is not None:
+            yield
+            return
+        self._pending_summaries = {}
+        try:
+            yield
+        finally:
+            pending_summaries, self._pending_summaries = self._pending_summaries, None
+            self.update_summaries(pending_summaries)
+
+
+class SQLiteMetaStore(object):
+    """
+    All meta documents in a single sqlite database in the meta folder.
+
+    Each row has an integer version that is incremented on every write. A write with
+    `check_version` only succeeds if the row is still at the version that was read,
+    so concurrent processes never silently overwrite each other's changes.
+
+    Writes inside `batch()` share one transaction (one fsync for `save_all`).
+
+    >>> with tempfile.TemporaryDirectory() as tempdir:
+    ...     store = SQLiteMetaStore(tempdir)
+    ...     store.read('test1')
+    ...     version = store.write('test1', {'scan': {}})
+    ...     store.read('test1')
+    ...     other_version = store.write('test1', {'scan': {'other': 1}}, expected_version=version, check_version=True)
+    ...     store.write('test1', {'scan': {'stale': 1}}, expected_version=version, check_version=True)
+    ...     with store.batch():
+    ...         _ = store.write('test2', {})
+    ...         _ = store.write('test3', {})
+    ...     store.delete('test3')
+    ...     store.names()
+    ({}, None)
+    ({'scan': {}}, 1)
+    ('test1', 'test2')
+    """
+    FILENAME = 'meta.sqlite'
+    RELIABLE_VERSIONS = True
+
+    def __init__(self, path, filename=FILENAME):
+        self.path = path
+        self.filepath = os.path.join(path, filename)
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS summary (name TEXT PRIMARY KEY, data TEXT NOT NULL)')
+
+    @property
+    def connection(self):
+        # sqlite connections cannot be shared between threads
+        if not getattr(self._local, 'connection', None):
+            self._local.connection = sqlite3.connect(self.filepath, timeout=60, isolation_level=None)
+            self._local.connection.execute('PRAGMA journal_mode=WAL')
+            self._local.batch = False
+        return self._local.connection
+
+    @contextmanager
+    def _connection(self):
+        connection = self.connection
+        if self._local.batch:
+            yield connection
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    @contextmanager
+    def batch(self):
+        self.connection  # Ensure this thread's connection is open
+        if self._local.batch:
+            yield
+            return
+        with self._connection():
+            self._local.batch = True
+            try:
+                yield
+            finally:
+                self._local.batch = False
+
+    def names(self):
+        return tuple(row[0] for row in self.connection.execute('SELECT name FROM meta ORDER BY name'))
+
+    def read(self, name):
+        row = self.connection.execute('SELECT data, version FROM meta WHERE name = ?', (name, )).fetchone()
+        if not row:
+            return {}, None
+        try:
+            return json.loads(row[0]), row[1]
+        except json.decoder.JSONDecodeError as ex:
+            log.error('Unable to load meta %s %s', name, ex)
+            return {}, None
+
+    def version(self, name):
+        row = self.connection.execute('SELECT version FROM meta WHERE name = ?', (name, )).fetchone()
+        return row[0] if row else None
+
+    def write(self, name, data, expected_version=None, check_version=False):
+        with self._connection() as connection:
+            current_version = self.version(name)
+            if check_version and expected_version is not None and current_version != expected_version:
+                log.warning(f'Refusing to save changes. {name} has been updated by another application. Expected version {expected_version} but got {current_version}')
+                return None
+            version = (current_version or 0) + 1
+            connection.execute('INSERT OR REPLACE INTO meta (name, data, version) VALUES (?, ?, ?)', (name, json.dumps(data), version))
+        return version
+
+    def delete(self, name):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM meta WHERE name = ?', (name, ))
+
+    def versions(self):
+        return dict(self.connection.execute('SELECT name, version FROM meta'))
+
+    def read_summaries(self):
+        return {name: json.loads(data) for name, data in self.connection.execute('SELECT name, data FROM summary')}
+
+    def update_summaries(self, summaries):
+        with self._connection() as connection:
+            for name, summary in summaries.items():
+                if summary is None:
+                    connection.execute('DELETE FROM summary WHERE name = ?', (name, ))
+                else:
+                    connection.execute('INSERT OR REPLACE INTO summary (name, data) VALUES (?, ?)', (name, json.dumps(summary)))
+
+
+META_STORES = {
+    'json': JSONMetaStore,
+    'sqlite': SQLiteMetaStore,
+}
+DEFAULT_META_STORE = 'json'
+
+
+def meta_store_factory(path, meta_store=None):
+    return META_STORES[meta_store or DEFAULT_META_STORE](path)
+
+
+def copy_meta(source_store, destination_store):
+    """
+    Copy every document between stores (migrate json -> sqlite / export sqlite -> json)
+
+    >>> with tempfile.TemporaryDirectory() as json_path, tempfile.TemporaryDirectory() as sqlite_path, tempfile.TemporaryDirectory() as export_path:
+    ...     _ = JSONMetaStore(json_path).write('test1', {'scan': {'test1.mp4': {}}})
+    ...     copy_meta(JSONMetaStore(json_path), SQLiteMetaStore(sqlite_path))
+    ...     copy_meta(SQLiteMetaStore(sqlite_path), JSONMetaStore(export_path))
+    ...     JSONMetaStore(export_path).read('test1')[0]
+    1
+    1
+    {'scan': {'test1.mp4': {}}}
+    """
+    count = 0
+    with destination_store.batch():
+        for name in source_store.names():
+            data, version = source_store.read(name)
+            if version is None:
+                continue
+            destination_store.write(name, data)
+            count += 1
+    return count
@@ -0,0 +1,70 @@
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+
+SOURCE_DETAILS_KEYS = ('duration', 'width', 'height', 'encode_seconds')
+
+
+def uploaded_mtime(scan_data):
+    """
+    The most recent mtime of any file in the source set
+
+    >>> uploaded_mtime({'a.mp4': {'mtime': 5}, 'a.srt': {'mtime': 7}, 'a.txt': {}})
+    7
+    """
+    return max((file_data.get('mtime') or 0 for file_data in scan_data.values()), default=0)
+
+
+def summarise_meta(name, data, version):
+    """
+    The small subset of a meta document needed to decide what to load/process
+
+    >>> summary = summarise_meta('test1', {
+    ...     'scan': {'test1.mp4': {'mtime': 5}, 'test1.srt': {'mtime': 7}},
+    ...     'actions': ['encode'],
+    ...     'processed': {'hashs': {'full': 'abc', 'media': 'bcd'}, 'duration': 10, 'width': 1280, 'height': 720, 'other': 'ignored'},
+    ...     'probe': {'bcd': {'big': 'data'}},
+    ... }, version=3)
+    >>> sorted((key, value) for key, value in summary.items() if key != 'mtime')
+    [('name', 'test1'), ('pending_actions', ['encode']), ('source_details', {'duration': 10, 'width': 1280, 'height': 720}), ('source_hashs', {'full': 'abc', 'media': 'bcd'}), ('uploaded', 7), ('version', 3)]
+    """
+    source_details = data.get('processed', {})
+    return {
+        'name': name,
+        'version': version,
+        'mtime': time.time(),
+        'pending_actions': list(data.get('actions', [])),
+        'source_hashs': dict(source_details.get('hashs', {})),
+        'source_details': {key: source_details[key] for key in SOURCE_DETAILS_KEYS if key in source_details},
+        'uploaded': uploaded_mtime(data.get('scan', {})),
+    }
+
+
+class SummaryMeta(object):
+    """
+    Read only stand-in for a MetaFile built from a summary.
+    Has the attributes used to filter/schedule tracks (see encode_scheduler), so
+    only the meta that is actually going to be processed needs to be fully loaded.
+
+    >>> m = SummaryMeta(summarise_meta('test1', {'scan': {'test1.mp4': {'mtime': 5}}, 'processed': {'hashs': {'full': 'abc'}}}, 1))
+    >>> (m.name, m.source_hash, m.pending_actions, m.uploaded)
+    ('test1', 'abc', [], 5)
+    """
+    SOURCE_HASH_FULL_KEY = 'full'  # MetaFile.SOURCE_HASH_FULL_KEY
+
+    def __init__(self, summary):
+        self.summary = summary
+        self.name = summary['name']
+        self.pending_actions = summary['pending_actions']
+        self.source_hashs = summary['source_hashs']
+        self.source_details = summary['source_details']
+        self.uploaded = summary['uploaded']
+
+    @property
+    def source_hash(self):
+        return self.source_hashs.get(self.SOURCE_HASH_FULL_KEY)
+
+    def __repr__(self):
+        return f'SummaryMeta({self.name})'
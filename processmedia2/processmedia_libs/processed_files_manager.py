@@ -7,24 +7,71 @@ from calaldees.files.scan import fast_scan
 ProcessedFileType = namedtuple('ProcessedFileType', ('source_hash_group', 'dict_key', 'attachment_type', 'ext', 'salt'))
 
 
+DEFAULT_NUM_IMAGES = 4
+
+
+def image_file_types(num_images=DEFAULT_NUM_IMAGES):
+    """
+    >>> [file_type.dict_key for file_type in image_file_types(2)]
+    ['image1', 'image2']
+    """
+    return tuple(
+        ProcessedFileType('media', 'image{}'.format(index+1), 'image', 'jpg', '')
+        for index in range(num_images)
+    )
+
+
+def hls_file_types(renditions):
+    """
+    A master playlist + a playlist and single media file for each rendition.
+    The rendition parameters are the salt - changing the ladder creates new files
+
+    >>> from .hls import HLSRendition
+    >>> [(file_type.dict_key, file_type.attachment_type, file_type.ext) for file_type in hls_file_types((HLSRendition('240p', 240, 400, 64), ))]
+    [('hls', 'hls', 'm3u8'), ('hls_240p_playlist', 'hls_rendition', 'm3u8'), ('hls_240p_media', 'hls_rendition', 'ts')]
+    >>> hls_file_types(())
+    ()
+    """
+    if not renditions:
+        return ()
+    return (
+        ProcessedFileType('media', 'hls', 'hls', 'm3u8', ','.join(map(str, renditions))),
+    ) + tuple(
+        file_type
+        for rendition in renditions
+        for file_type in (
+            ProcessedFileType('media', 'hls_{}_playlist'.format(rendition.name), 'hls_rendition', 'm3u8', str(rendition)),
+            ProcessedFileType('media', 'hls_{}_media'.format(rendition.name), 'hls_rendition', 'ts', str(rendition)),
+        )
+    )
+
+
 class ProcessedFilesManager(object):
     FILE_TYPES = (
-        ProcessedFileType('media', 'image1', 'image', 'jpg', ''),
-        ProcessedFileType('media', 'image2', 'image', 'jpg', ''),
-        ProcessedFileType('media', 'image3', 'image', 'jpg', ''),
-        ProcessedFileType('media', 'image4', 'image', 'jpg', ''),
         ProcessedFileType('media', 'video', 'video', 'mp4', ''),
         ProcessedFileType('media', 'preview', 'preview', 'mp4', ''),
         ProcessedFileType('data', 'srt', 'srt', 'srt', ''),
         ProcessedFileType('data', 'tags', 'tags', 'txt', ''),
     )
-    FILE_TYPE_LOOKUP = {
-        processed_file_type.attachment_type: processed_file_type
-        for processed_file_type in FILE_TYPES
-    }
 
-    def __init__(self, path):
+    def __init__(self, path, num_images=DEFAULT_NUM_IMAGES, hls_renditions=(), preview_clip_seconds=None):
+        """
+        preview_clip_seconds: previews are a short excerpt rather than the full track.
+            The length is the salt of the preview file, so changing it creates new previews
+        """
         self.path = path
+        self.num_images = num_images
+        self.hls_renditions = tuple(hls_renditions)
+        self.preview_clip_seconds = preview_clip_seconds
+        file_types = tuple(
+            file_type._replace(salt='clip{}'.format(preview_clip_seconds)) if file_type.dict_key == 'preview' and preview_clip_seconds else file_type
+            for file_type in self.FILE_TYPES
+        )
+        self.file_types = image_file_types(num_images) + file_types + hls_file_types(self.hls_renditions)
+        self.file_type_lookup = {
+            processed_file_type.attachment_type: processed_file_type
+            for processed_file_type in self.file_types
+        }
 
     def get_processed_files(self, hash_dict):
         if not hash_dict:
@@ -35,7 +82,7 @@ class ProcessedFilesManager(object):
                 (hash_dict[file_type.source_hash_group], file_type.dict_key, file_type.salt),
                 file_type
             )
-            for file_type in self.FILE_TYPES
+            for file_type in self.file_types
         }
 
     @property
@@ -1,9 +1,11 @@
 import re
 import os.path
+from collections import defaultdict
+from itertools import islice
 
 import yaml
 
-from calaldees.data import duplicates
+from calaldees.data import duplicates, first
 from calaldees.files.exts import file_extension_regex
 
 from . import EXTS
@@ -40,9 +42,11 @@ def locate_primary_files(folder_structure, file_regex):
     return file_dict.values()
 
 
-def get_file_collection(folder_structure, primary_file):
+def get_file_collection(folder_structure, primary_file, folder_files_by_name=None):
     """
     Collect realated files
+
+    folder_files_by_name: optional {file_no_ext: {f, ...}} of the primary file's folder (see `iter_file_collections`)
     """
     folder = folder_structure.get(primary_file.folder)
 
@@ -50,7 +54,10 @@ def get_file_collection(folder_structure, primary_file):
     file_collection = set()  # {primary_file, }  # This could be uneeded as the file is added below as well
 
     # Collect files the same name
-    file_collection |= {f for f in folder.files if f.file_no_ext == primary_file.file_no_ext}
+    if folder_files_by_name is not None:
+        file_collection |= folder_files_by_name.get(primary_file.file_no_ext, set())
+    else:
+        file_collection |= {f for f in folder.files if f.file_no_ext == primary_file.file_no_ext}
 
     # Data files contain pointers to additional files that may not be named the same
     # We need to lookup the FileScan item from the in memory file list
@@ -67,6 +74,84 @@ def get_file_collection(folder_structure, primary_file):
     return file_collection
 
 
+def iter_file_collections(folder_structure, primary_files):
+    """
+    Stream (name, file_collection) one folder at a time.
+    Each folder's files are grouped by name once (rather than once per primary file)
+    and only one folder's grouping is held in memory at a time.
+    """
+    primary_files_by_folder = defaultdict(list)
+    for f in primary_files:
+        primary_files_by_folder[f.folder].append(f)
+    for folder, folder_primary_files in primary_files_by_folder.items():
+        folder_files_by_name = defaultdict(set)
+        for f in folder_structure.get(folder).files:
+            folder_files_by_name[f.file_no_ext].add(f)
+        for primary_file in folder_primary_files:
+            yield primary_file.file_no_ext, get_file_collection(folder_structure, primary_file, folder_files_by_name=folder_files_by_name)
+
+
+def chunks(iterable, size):
+    """
+    >>> tuple(chunks(range(5), 2))
+    ((0, 1), (2, 3), (4,))
+    """
+    iterator = iter(iterable)
+    return iter(lambda: tuple(islice(iterator, size)), ())
+
+
+class FileHashLookup(object):
+    """
+    Lookup of files in the folder_structure by hash (or another content key e.g. 'fingerprint').
+
+    Built once, on first use, and shared for the whole scan, so re-associating
+    moved/renamed files is a dict lookup per orphan rather than a search of the
+    whole tree.
+
+    >>> from collections import namedtuple
+    >>> File = namedtuple('File', ('file', 'hash', 'stats'))
+    >>> Stats = namedtuple('Stats', ('st_mtime', ))
+    >>> class MockFolderStructure(object):
+    ...     def scan(self, file_filter):
+    ...         return filter(file_filter, (
+    ...             File('a.srt', 'hash_a', Stats(1)),
+    ...             File('b.srt', 'hash_a', Stats(2)),
+    ...             File('c.txt', 'hash_c', Stats(1)),
+    ...         ))
+    >>> lookup = FileHashLookup(MockFolderStructure(), file_filter=lambda f: not f.file.endswith('.txt'))
+    >>> lookup.find('hash_a', filename='b.srt').file
+    'b.srt'
+    >>> lookup.find('hash_a', mtime=1).file
+    'a.srt'
+    >>> lookup.find('hash_c')
+    >>> FileHashLookup(MockFolderStructure(), key='fingerprint').find('hash_a')
+    """
+    def __init__(self, folder_structure, file_filter=lambda f: True, key='hash'):
+        self.folder_structure = folder_structure
+        self.file_filter = file_filter
+        self.key = key
+        self._files_by_hash = None
+
+    @property
+    def files_by_hash(self):
+        if self._files_by_hash is None:
+            self._files_by_hash = defaultdict(list)
+            for f in self.folder_structure.scan(self.file_filter):
+                filehash = getattr(f, self.key, None)
+                if filehash:
+                    self._files_by_hash[str(filehash)].append(f)
+        return self._files_by_hash
+
+    def find(self, filehash, filename=None, mtime=None):
+        """
+        The file with the matching hash. Where a hash is duplicated, files with the same name or mtime are preferred
+        """
+        return first(sorted(
+            self.files_by_hash.get(filehash, ()),
+            key=lambda f: (f.file != filename, f.stats.st_mtime != mtime),
+        ))
+
+
 # Utils ------------------------------------------------------------------------
 
 def _load_yaml(filename):
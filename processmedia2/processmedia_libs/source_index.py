@@ -0,0 +1,459 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from stat import S_ISDIR, S_ISREG
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from calaldees.files.exts import file_ext
+
+from .atomic_file import atomic_write
+
+import logging
+log = logging.getLogger(__name__)
+
+
+IndexEntry = namedtuple('IndexEntry', ('relative', 'inode', 'size', 'mtime', 'hash', 'fingerprint'), defaults=(None, ))
+ChangeSet = namedtuple('ChangeSet', ('added', 'removed', 'modified', 'moved'))  # sets of relative paths + moved {old_relative: new_relative}
+FileStats = namedtuple('FileStats', ('st_ino', 'st_size', 'st_mtime'))
+
+
+def hash_file(absolute, blocksize=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(absolute, 'rb') as filehandle:
+        for block in iter(lambda: filehandle.read(blocksize), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def fingerprint_file(absolute, blocksize=64 * 1024):
+    """
+    Cheap content fingerprint: the size + a block from the head, middle and tail of the file.
+    Small files are hashed completely.
+    Used to detect that a touched/copied file has not changed without reading all of it.
+
+    >>> with tempfile.TemporaryDirectory() as tempdir:
+    ...     def fingerprint(content):
+    ...         filename = os.path.join(tempdir, 'test.bin')
+    ...         with open(filename, 'wb') as filehandle:
+    ...             _ = filehandle.write(content)
+    ...         return fingerprint_file(filename, blocksize=2)
+    ...     fingerprint(b'0123456789') == fingerprint(b'0123456789')
+    ...     fingerprint(b'0123456789') == fingerprint(b'01234X6789')
+    ...     fingerprint(b'0123456789') == fingerprint(b'012X456789')  # Unsampled bytes are not detected
+    True
+    False
+    True
+    """
+    hasher = hashlib.sha256()
+    size = os.path.getsize(absolute)
+    hasher.update(str(size).encode('utf-8'))
+    with open(absolute, 'rb') as filehandle:
+        if size <= blocksize * 3:
+            hasher.update(filehandle.read())
+        else:
+            for offset in (0, (size - blocksize) // 2, size - blocksize):
+                filehandle.seek(offset)
+                hasher.update(filehandle.read(blocksize))
+    return hasher.hexdigest()
+
+
+def regex_file_filter(file_regex=None, ignore_regex=None):
+    """
+    >>> import re
+    >>> file_filter = regex_file_filter(re.compile(r'\\.mp4$'), re.compile(r'^\\.'))
+    >>> tuple(map(file_filter, ('a.mp4', 'a.txt', '.a.mp4')))
+    (True, False, False)
+    """
+    def _filter(filename):
+        return bool(
+            (not file_regex or file_regex.search(filename)) and
+            (not ignore_regex or not ignore_regex.search(filename))
+        )
+    return _filter
+
+
+def diff_entries(previous, current):
+    """
+    Precise change set between two index snapshots ({relative: IndexEntry})
+
+    A file that has disappeared and reappeared at another path with the same inode/size/mtime
+    (a rename) or the same content hash/fingerprint (a copy+delete across devices) is `moved`
+
+    >>> previous = {
+    ...     'a.mp4': IndexEntry('a.mp4', 1, 10, 1.0, 'hash_a'),
+    ...     'b.srt': IndexEntry('b.srt', 2, 10, 1.0, 'hash_b'),
+    ...     'c.txt': IndexEntry('c.txt', 3, 10, 1.0, 'hash_c'),
+    ...     'd.txt': IndexEntry('d.txt', 4, 10, 1.0, 'hash_d'),
+    ... }
+    >>> current = {
+    ...     'a.mp4': IndexEntry('a.mp4', 1, 10, 1.0, 'hash_a'),
+    ...     'x/b.srt': IndexEntry('x/b.srt', 2, 10, 1.0, None),
+    ...     'c.txt': IndexEntry('c.txt', 3, 11, 2.0, None),
+    ...     'e.txt': IndexEntry('e.txt', 5, 10, 1.0, 'hash_d'),
+    ...     'f.txt': IndexEntry('f.txt', 6, 10, 1.0, 'hash_f'),
+    ... }
+    >>> diff_entries(previous, current)
+    ChangeSet(added={'f.txt'}, removed=set(), modified={'c.txt'}, moved={'b.srt': 'x/b.srt', 'd.txt': 'e.txt'})
+    """
+    removed = previous.keys() - current.keys()
+    added = current.keys() - previous.keys()
+    modified = {
+        relative
+        for relative in current.keys() & previous.keys()
+        if current[relative][1:4] != previous[relative][1:4]
+    }
+
+    moved = {}
+    removed_by_stats = {previous[relative][1:4]: relative for relative in removed}
+    for relative in sorted(added):
+        old_relative = removed_by_stats.pop(current[relative][1:4], None)
+        if old_relative:
+            moved[old_relative] = relative
+    for field in ('hash', 'fingerprint'):
+        removed_by_content = {getattr(previous[relative], field): relative for relative in removed - moved.keys() if getattr(previous[relative], field)}
+        for relative in sorted(added - set(moved.values())):
+            old_relative = removed_by_content.pop(getattr(current[relative], field), None) if getattr(current[relative], field) else None
+            if old_relative:
+                moved[old_relative] = relative
+
+    return ChangeSet(
+        added=set(added - set(moved.values())),
+        removed=set(removed - moved.keys()),
+        modified=modified,
+        moved=moved,
+    )
+
+
+class SourceIndex(object):
+    """
+    Persistent index of the source files (path, inode, size, mtime, hash).
+
+    Each `update` walks the tree, but only files whose inode/size/mtime have changed need
+    to be re-hashed (on demand, in parallel - see `hash_files`). The index is only persisted
+    with `save` (after the scan has successfully processed the change set), so an interrupted
+    scan is repeated in full next time.
+
+    If no index_path is given the index is held in memory only (hashs are seeded from the meta, see `seed_hashs`).
+
+    The hash must be the same as calaldees FolderStructure's hash (sha256 hexdigest of the content),
+    so hashs already recorded in the meta remain valid (see tests/test_scan.py).
+
+    fingerprint: new/modified files are only fingerprinted (`fingerprint_file`) during `update`.
+      A file with the same fingerprint as before (touched, copied, moved) keeps its hash.
+      Full hashes of genuinely new content are deferred as above.
+
+    walk_workers: list/stat this many directories concurrently (network mounts, where every stat is a round trip)
+    """
+
+    def __init__(self, path, index_path=None, file_filter=None, fingerprint=False, hash_workers=None, walk_workers=None):
+        self.path = path
+        self.walk_workers = walk_workers
+        self.index_path = index_path
+        self.file_filter = file_filter or (lambda filename: True)
+        self.fingerprint = fingerprint
+        self.hash_workers = hash_workers
+        self.entries = self._load()
+
+    def _load(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'rt') as filehandle:
+                return {relative: IndexEntry(relative, *values) for relative, values in json.load(filehandle).items()}
+        except (json.decoder.JSONDecodeError, TypeError) as ex:
+            log.error('Unable to load source index %s - rebuilding %s', self.index_path, ex)
+            return {}
+
+    def save(self):
+        if not self.index_path:
+            return
+        with atomic_write(self.index_path) as destination:
+            json.dump({relative: entry[1:] for relative, entry in self.entries.items()}, destination)
+
+    def _scan_folder(self, folder):
+        """
+        One directory listing + the stat of each of it's files (in one worker, so a
+        network mount round trip per file is not serialised with the rest of the walk)
+        Returns ([(relative, stat), ...], [sub_folder_relative, ...])
+        """
+        files = []
+        folders = []
+        try:
+            with os.scandir(os.path.join(self.path, folder)) as dir_entries:
+                for dir_entry in dir_entries:
+                    relative = os.path.join(folder, dir_entry.name)
+                    if dir_entry.is_dir():
+                        if not dir_entry.name.startswith('.'):
+                            folders.append(relative)
+                    elif dir_entry.is_file() and self.file_filter(dir_entry.name):
+                        files.append((relative, dir_entry.stat()))
+        except OSError as ex:
+            log.warning('Unable to scan %s %s', folder, ex)
+        return files, folders
+
+    def _walk(self, folder=''):
+        """
+        >>> with tempfile.TemporaryDirectory() as tempdir:
+        ...     for folder in ('a/b', 'a/c', 'd', '.e'):
+        ...         os.makedirs(os.path.join(tempdir, folder))
+        ...     for filename in ('1.txt', 'a/2.txt', 'a/b/3.txt', 'a/c/4.txt', 'd/5.txt', '.e/6.txt'):
+        ...         Path(tempdir, filename).touch()
+        ...     serial = sorted(relative for relative, stat in SourceIndex(tempdir)._walk())
+        ...     parallel = sorted(relative for relative, stat in SourceIndex(tempdir, walk_workers=4)._walk())
+        >>> serial
+        ['1.txt', 'a/2.txt', 'a/b/3.txt', 'a/c/4.txt', 'd/5.txt']
+        >>> serial == parallel
+        True
+        """
+        if not self.walk_workers or self.walk_workers <= 1:
+            files, folders = self._scan_folder(folder)
+            yield from files
+            for sub_folder in folders:
+                yield from self._walk(sub_folder)
+            return
+
+        # Breadth first - every folder discovered is listed concurrently with the others (bounded by walk_workers)
+        with ThreadPoolExecutor(max_workers=self.walk_workers) as executor:
+            pending = {executor.submit(self._scan_folder, folder)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, folders = future.result()
+                    yield from files
+                    pending |= {executor.submit(self._scan_folder, sub_folder) for sub_folder in folders}
+
+    def _walk_relatives(self, relatives):
+        for relative in relatives:
+            if any(name.startswith('.') for name in relative.split(os.sep)[:-1]):
+                continue
+            absolute = os.path.join(self.path, relative)
+            try:
+                stat = os.stat(absolute)
+            except OSError:  # Deleted
+                continue
+            if S_ISDIR(stat.st_mode):
+                if not os.path.basename(relative).startswith('.'):
+                    yield from self._walk(relative)
+            elif S_ISREG(stat.st_mode) and self.file_filter(os.path.basename(relative)):
+                yield relative, stat
+
+    def update(self, relatives=None):
+        """
+        Refresh the index from the filesystem and return the ChangeSet since the last `save`
+
+        relatives: only re-stat these files/folders (e.g. from filesystem events) - the rest of the index is assumed unchanged
+        """
+        previous = self.entries
+        current = {}
+        if relatives is None:
+            walk = self._walk()
+        else:
+            relatives = set(relatives)
+            prefixes = tuple(os.path.join(relative, '') for relative in relatives)
+            current = {
+                relative: entry
+                for relative, entry in previous.items()
+                if relative not in relatives and not relative.startswith(prefixes)
+            }
+            walk = self._walk_relatives(relatives)
+        for relative, stat in walk:
+            entry = IndexEntry(relative, stat.st_ino, stat.st_size, stat.st_mtime, None)
+            previous_entry = previous.get(relative)
+            if previous_entry and previous_entry[1:4] == entry[1:4]:
+                entry = previous_entry
+            current[relative] = entry
+
+        # Renamed files keep their inode/size/mtime - carry the hash over without reading the file
+        previous_by_stats = {entry[1:4]: entry for entry in previous.values() if entry.hash}
+        for relative, entry in current.items():
+            if not entry.hash and entry[1:4] in previous_by_stats:
+                previous_entry = previous_by_stats[entry[1:4]]
+                current[relative] = entry._replace(hash=previous_entry.hash, fingerprint=previous_entry.fingerprint)
+
+        # Full hashs are never computed here - they are deferred until requested with `hash`/`hash_files`
+        # (only files that belong to a track, in parallel). Fingerprinting reads a few blocks of new/modified files.
+        if self.fingerprint:
+            previous_by_fingerprint = {entry.fingerprint: entry for entry in previous.values() if entry.hash and entry.fingerprint}
+            for relative, entry in current.items():
+                if entry.hash:
+                    continue
+                try:
+                    fingerprint = fingerprint_file(os.path.join(self.path, relative))
+                except OSError as ex:
+                    log.warning('Unable to fingerprint %s %s', relative, ex)
+                    continue
+                previous_entry = previous_by_fingerprint.get(fingerprint)
+                current[relative] = entry._replace(fingerprint=fingerprint, hash=previous_entry.hash if previous_entry else None)
+
+        change_set = diff_entries(previous, current)
+        self.entries = current
+        log.info(
+            'Source index: %s files - %s added, %s removed, %s modified, %s moved',
+            len(current), *map(len, change_set),
+        )
+        return change_set
+
+    def seed_hashs(self, known_files):
+        """
+        Reuse hashs already recorded elsewhere (the meta `scan` data) for files that have not changed since.
+        Without a persisted index (first run) this avoids reading the whole library.
+
+        known_files: iterable of (relative, mtime, hash)
+
+        >>> source_index = SourceIndex('/source')
+        >>> source_index.entries['a.mp4'] = IndexEntry('a.mp4', 1, 2, 3.0, None)
+        >>> source_index.entries['b.mp4'] = IndexEntry('b.mp4', 2, 2, 4.0, None)
+        >>> source_index.seed_hashs((('a.mp4', 3.0, 'hash_a'), ('b.mp4', 1.0, 'stale_hash_b'), ('c.mp4', 1.0, 'hash_c')))
+        >>> source_index.entries['a.mp4'].hash, source_index.entries['b.mp4'].hash
+        ('hash_a', None)
+        """
+        for relative, mtime, filehash in known_files:
+            entry = self.entries.get(relative)
+            if entry and not entry.hash and filehash and entry.mtime == mtime:
+                self.entries[relative] = entry._replace(hash=filehash)
+
+    def _hash(self, relative):
+        try:
+            return relative, hash_file(os.path.join(self.path, relative))
+        except OSError as ex:
+            log.warning('Unable to hash %s %s', relative, ex)
+            return relative, None
+
+    def hash_files(self, relatives):
+        """
+        Compute the deferred full hashs of these files in parallel
+        """
+        relatives = {relative for relative in relatives if relative in self.entries and not self.entries[relative].hash}
+        if not relatives:
+            return
+        log.info('Hashing %s new source files', len(relatives))
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            for relative, filehash in executor.map(self._hash, relatives):
+                self.entries[relative] = self.entries[relative]._replace(hash=filehash)
+
+    def hash(self, relative):
+        if relative in self.entries and not self.entries[relative].hash:
+            self.hash_files((relative, ))
+        return self.entries[relative].hash
+
+    @property
+    def folder_structure(self):
+        return IndexedFolder.from_entries(self, self.entries.values())
+
+
+# Folder structure -------------------------------------------------------------
+# A FolderStructure compatible in memory tree built from the index (file hashs are already known)
+# Large libraries have tens of thousands of files, so the records are kept small:
+# `__slots__`, interned folder paths, and everything else derived from the index entry on demand.
+
+class IndexedFile(object):
+    """
+    >>> source_index = SourceIndex('/source')
+    >>> source_index.entries['folder/track.mp4'] = IndexEntry('folder/track.mp4', 1, 2, 3.0, 'abc')
+    >>> f = source_index.folder_structure.get('folder/track.mp4')
+    >>> (f.folder, f.file, f.file_no_ext, f.ext, f.relative, f.absolute, f.stats.st_mtime, f.hash)
+    ('folder', 'track.mp4', 'track', 'mp4', 'folder/track.mp4', '/source/folder/track.mp4', 3.0, 'abc')
+    """
+    __slots__ = ('source_index', 'folder', 'file')
+
+    def __init__(self, source_index, folder, file):
+        self.source_index = source_index
+        self.folder = folder
+        self.file = file
+
+    @property
+    def relative(self):
+        return os.path.join(self.folder, self.file)
+
+    @property
+    def absolute(self):
+        return os.path.join(self.source_index.path, self.folder, self.file)
+
+    @property
+    def file_no_ext(self):
+        return file_ext(self.file)[0]
+
+    @property
+    def ext(self):
+        return file_ext(self.file)[1]
+
+    @property
+    def entry(self):
+        return self.source_index.entries[self.relative]
+
+    @property
+    def stats(self):
+        entry = self.entry
+        return FileStats(entry.inode, entry.size, entry.mtime)
+
+    @property
+    def fingerprint(self):
+        return self.entry.fingerprint
+
+    @property
+    def hash(self):
+        return self.source_index.hash(self.relative)
+
+    @property
+    def known_hash(self):
+        """
+        The hash if already computed (never reads the file)
+        """
+        return self.entry.hash
+
+    def __repr__(self):
+        return f'IndexedFile({self.relative})'
+
+
+class IndexedFolder(object):
+    __slots__ = ('name', 'parent', 'folders', '_files')
+
+    def __init__(self, name='', parent=None):
+        self.name = name
+        self.parent = parent
+        self.folders = {}
+        self._files = {}
+
+    @classmethod
+    def from_entries(cls, source_index, entries):
+        root = cls()
+        for entry in entries:
+            folder, filename = os.path.split(entry.relative)
+            folder = sys.intern(folder)
+            root._folder(folder, create=True)._files[filename] = IndexedFile(source_index, folder, filename)
+        return root
+
+    def _folder(self, relative, create=False):
+        folder = self
+        for name in filter(None, relative.split(os.sep)):
+            if name not in folder.folders:
+                if not create:
+                    return None
+                folder.folders[name] = IndexedFolder(name, folder)
+            folder = folder.folders[name]
+        return folder
+
+    @property
+    def files(self):
+        return self._files.values()
+
+    def get(self, relative):
+        """
+        The folder or file at the relative path (or None)
+        """
+        folder_relative, name = os.path.split(relative)
+        folder = self._folder(folder_relative)
+        if not folder:
+            return None
+        return folder._files.get(name) or folder.folders.get(name) or (folder if not name else None)
+
+    def scan(self, file_filter=lambda f: True):
+        for f in self.files:
+            if file_filter(f):
+                yield f
+        for folder in self.folders.values():
+            yield from folder.scan(file_filter)
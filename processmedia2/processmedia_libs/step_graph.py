@@ -0,0 +1,89 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import logging
+log = logging.getLogger(__name__)
+
+
+Step = namedtuple('Step', ('name', 'function', 'depends_on'))
+
+
+class StepFailure(namedtuple('StepFailure', ('reason', 'quarantine'), defaults=(False, ))):
+    """
+    A failed step result that carries the reason for the failure
+    quarantine: the failure is permanent (retrying the same sources will not help)
+
+    >>> bool(StepFailure('source damaged'))
+    False
+    """
+    def __bool__(self):
+        return False
+
+
+def run_step_graph(steps, max_workers=4):
+    """
+    Run each step as soon as all the steps it depends on have succeeded.
+
+    Steps that do not depend on each other are run concurrently in threads
+    (the heavy lifting is done by external processes, so the GIL is not an issue).
+    A step that fails (returns a falsy value) prevents all the steps that depend on it from running.
+    If a step raises an exception, no further steps are started and the exception
+    is re-raised once the currently running steps have completed.
+
+    Returns a dict of {step_name: result}. Steps that were never run are absent.
+
+    >>> order = []
+    >>> def step(name, result=True):
+    ...     def _step():
+    ...         order.append(name)
+    ...         return result
+    ...     return _step
+    >>> results = run_step_graph((
+    ...     Step('a', step('a'), ()),
+    ...     Step('b', step('b'), ('a', )),
+    ...     Step('c', step('c', False), ('a', )),
+    ...     Step('d', step('d'), ('b', 'c')),
+    ... ))
+    >>> sorted(results.items())
+    [('a', True), ('b', True), ('c', False)]
+    >>> order[0]
+    'a'
+
+    >>> def fail():
+    ...     raise Exception('step failed')
+    >>> run_step_graph((Step('a', fail, ()), Step('b', step('b'), ('a', ))))
+    Traceback (most recent call last):
+    ...
+    Exception: step failed
+    """
+    steps = {step.name: step for step in steps}
+    for step in steps.values():
+        assert set(step.depends_on) <= steps.keys(), f'{step.name} depends on unknown steps {set(step.depends_on) - steps.keys()}'
+
+    results = {}
+    pending = dict(steps)
+    running = {}
+    exception = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            if not exception:
+                for name, step in tuple(pending.items()):
+                    if all(results.get(dependency) for dependency in step.depends_on):
+                        del pending[name]
+                        running[executor.submit(step.function)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as ex:
+                    results[name] = False
+                    exception = exception or ex
+
+    if exception:
+        raise exception
+    if pending:
+        log.debug('Steps not run as their dependencies failed: %s', tuple(pending.keys()))
+    return results
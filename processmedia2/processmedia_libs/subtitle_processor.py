@@ -379,3 +379,31 @@ def create_srt(subtitles):
         for index, subtitle in enumerate(subtitles)
         if subtitle.text
     )
+
+
+def _time_seconds(t):
+    """
+    >>> _time_seconds(time(1, 2, 3, 500000))
+    3723.5
+    """
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1000000
+
+
+def preview_clip_window(subtitles, duration, clip_seconds, lead_in_seconds=1):
+    """
+    (start, length) in seconds of a short preview excerpt starting just before the first lyric line
+
+    >>> preview_clip_window((Subtitle(time(0, 0, 20), time(0, 0, 25), 'first'), ), duration=180, clip_seconds=30)
+    (19.0, 30)
+    >>> preview_clip_window((), duration=180, clip_seconds=30)
+    (0, 30)
+    >>> preview_clip_window((Subtitle(time(0, 2, 55), time(0, 2, 58), 'last'), ), duration=180, clip_seconds=30)
+    (150, 30)
+    >>> preview_clip_window((Subtitle(time(0, 0, 5), time(0, 0, 8), 'first'), ), duration=20, clip_seconds=30)
+    (0, 20)
+    """
+    if not duration or duration <= clip_seconds:
+        return 0, duration
+    start = min((_time_seconds(subtitle.start) for subtitle in subtitles if subtitle.text.strip()), default=0)
+    start = max(start - lead_in_seconds, 0) if start else 0
+    return min(start, duration - clip_seconds), clip_seconds
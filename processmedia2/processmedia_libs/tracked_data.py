@@ -0,0 +1,164 @@
+"""
+dict/list that count their mutations, so a document can tell if it has changed in O(1)
+(rather than freezing and hashing the whole document before and after).
+
+Nested dicts/lists are converted on insert and share the document's counter.
+Note: inserting a plain dict/list stores a tracked copy - later changes to the
+original object are not seen by the document.
+
+>>> counter = ChangeCounter()
+>>> data = TrackedDict({'scan': {'a.mp4': {'mtime': 1}}, 'actions': []}, counter)
+>>> counter.version
+0
+>>> data['scan']['a.mp4']['mtime'] = 2
+>>> data['actions'].append('encode')
+>>> data.setdefault('processed', {})['hashs'] = {}
+>>> data['processed']['hashs'].update(full='abc')
+>>> counter.version
+5
+>>> data['processed'].get('hashs'), data.get('missing'), 'scan' in data
+({'full': 'abc'}, None, True)
+>>> counter.version
+5
+>>> import json
+>>> json.dumps(data, sort_keys=True)
+'{"actions": ["encode"], "processed": {"hashs": {"full": "abc"}}, "scan": {"a.mp4": {"mtime": 2}}}'
+
+The classes subclass dict/list (so the data can still be passed to json.dump) -
+every in place method must be overridden, or it would silently bypass the counter.
+
+>>> d, l = TrackedDict({'a': 1, 'b': 2}, counter), TrackedList([3, 1, 2], counter)
+>>> for target, method, args in (
+...     (d, '__setitem__', ('c', 3)), (d, '__delitem__', ('c', )), (d, 'setdefault', ('c', 3)),
+...     (d, 'update', ({'d': 4}, )), (d, '__ior__', ({'e': 5}, )), (d, 'pop', ('e', )), (d, 'popitem', ()), (d, 'clear', ()),
+...     (l, '__setitem__', (0, 4)), (l, '__setitem__', (slice(0, 1), [5])), (l, 'append', (6, )), (l, 'insert', (0, 7)),
+...     (l, 'extend', ([8], )), (l, '__iadd__', ([9], )), (l, '__imul__', (2, )), (l, '__delitem__', (0, )),
+...     (l, 'remove', (9, )), (l, 'pop', ()), (l, 'sort', ()), (l, 'reverse', ()), (l, 'clear', ()),
+... ):
+...     version = counter.version
+...     _ = getattr(target, method)(*args)
+...     assert counter.version > version, method
+>>> d['f'] = [{'g': 1}]
+>>> version = counter.version
+>>> d['f'][0] |= {'h': 2}
+>>> counter.version > version
+True
+"""
+
+
+class ChangeCounter(object):
+    __slots__ = ('version', )
+
+    def __init__(self):
+        self.version = 0
+
+    def changed(self):
+        self.version += 1
+
+
+def _track(value, counter):
+    if isinstance(value, (TrackedDict, TrackedList)) and value._counter is counter:
+        return value
+    if isinstance(value, dict):
+        return TrackedDict(value, counter)
+    if isinstance(value, list):
+        return TrackedList(value, counter)
+    return value
+
+
+class TrackedDict(dict):
+    __slots__ = ('_counter', )
+
+    def __init__(self, data=(), counter=None):
+        self._counter = counter or ChangeCounter()
+        super().__init__((key, _track(value, self._counter)) for key, value in dict(data).items())
+
+    def __reduce__(self):
+        return (dict, (dict(self), ))  # copies/pickles are plain (untracked) data
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, _track(value, self._counter))
+        self._counter.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._counter.changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, key, *default):
+        if key in self:
+            self._counter.changed()
+        return super().pop(key, *default)
+
+    def popitem(self):
+        item = super().popitem()
+        self._counter.changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._counter.changed()
+
+
+class TrackedList(list):
+    __slots__ = ('_counter', )
+
+    def __init__(self, data=(), counter=None):
+        self._counter = counter or ChangeCounter()
+        super().__init__(_track(value, self._counter) for value in data)
+
+    def __reduce__(self):
+        return (list, (list(self), ))
+
+    def _changed(method):
+        def _method(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._counter.changed()
+            return result
+        _method.__name__ = method.__name__
+        return _method
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_track(v, self._counter) for v in value]
+        else:
+            value = _track(value, self._counter)
+        super().__setitem__(index, value)
+        self._counter.changed()
+
+    def append(self, value):
+        super().append(_track(value, self._counter))
+        self._counter.changed()
+
+    def insert(self, index, value):
+        super().insert(index, _track(value, self._counter))
+        self._counter.changed()
+
+    def extend(self, values):
+        super().extend(_track(value, self._counter) for value in values)
+        self._counter.changed()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    __delitem__ = _changed(list.__delitem__)
+    __imul__ = _changed(list.__imul__)
+    remove = _changed(list.remove)
+    pop = _changed(list.pop)
+    clear = _changed(list.clear)
+    sort = _changed(list.sort)
+    reverse = _changed(list.reverse)
+    del _changed
@@ -0,0 +1,172 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+
+import logging
+log = logging.getLogger(__name__)
+
+
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', 'sshfs', '9p', 'fuse.rclone', 'davfs', 'afs'}
+
+
+def mount_filesystem(path, mounts='/proc/mounts'):
+    """
+    The filesystem type of the mount containing path (None if unknown)
+    """
+    path = os.path.realpath(path)
+    try:
+        with open(mounts, 'rt') as filehandle:
+            mount_points = tuple(line.split()[1:3] for line in filehandle if len(line.split()) > 2)
+    except OSError:
+        return None
+    matching = tuple((mount_point, fstype) for mount_point, fstype in mount_points if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'))
+    return max(matching, key=lambda mount: len(mount[0]))[1] if matching else None
+
+
+# Watchers ---------------------------------------------------------------------
+# `changes(timeout)` blocks for up to `timeout` seconds and returns
+#   a set of changed relative paths
+#   or None when the changes are unknown (a full scan is required)
+
+class InotifyWatcher(object):
+    """
+    Recursive inotify watch using libc directly (linux only)
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT_STRUCT = struct.Struct('iIII')
+
+    @classmethod
+    def available(cls):
+        return bool(ctypes.util.find_library('c')) and hasattr(ctypes.CDLL(ctypes.util.find_library('c')), 'inotify_init1')
+
+    def __init__(self, path):
+        self.path = path
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self._watch_tree('')
+
+    def close(self):
+        os.close(self.fd)
+
+    def _watch(self, relative):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(os.path.join(self.path, relative)), self.WATCH_MASK)
+        if wd < 0:
+            log.warning('Unable to watch %s (errno %s) - increase fs.inotify.max_user_watches?', relative, ctypes.get_errno())
+            return
+        self.watches[wd] = relative
+
+    def _watch_tree(self, relative):
+        self._watch(relative)
+        for root, dirs, files in os.walk(os.path.join(self.path, relative)):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for d in dirs:
+                self._watch(os.path.relpath(os.path.join(root, d), self.path))
+
+    def _read(self):
+        try:
+            return os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return b''
+
+    def changes(self, timeout):
+        if not select.select((self.fd, ), (), (), timeout)[0]:
+            return set()
+        changed = set()
+        data = self._read()
+        while data:
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.EVENT_STRUCT.unpack_from(data, offset)
+                offset += self.EVENT_STRUCT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    log.warning('inotify queue overflow - full scan required')
+                    return None
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                folder = self.watches.get(wd)
+                if folder is None:
+                    continue
+                relative = os.path.join(folder, name) if name else folder
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO) and not name.startswith('.'):
+                    self._watch_tree(relative)
+                if relative:
+                    changed.add(relative)
+            data = self._read()
+        return changed
+
+
+class PollingWatcher(object):
+    """
+    Network mounts do not deliver inotify events for changes made by other machines.
+    Every `poll_seconds` report an unknown change (the source index then finds the actual changes).
+    """
+    def __init__(self, path, poll_seconds=60):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.next_poll = time.time() + poll_seconds
+
+    def close(self):
+        pass
+
+    def changes(self, timeout):
+        wait = self.next_poll - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        self.next_poll = time.time() + self.poll_seconds
+        return None
+
+
+def watcher_factory(path, poll=False, poll_seconds=60):
+    filesystem = mount_filesystem(path)
+    if poll or filesystem in NETWORK_FILESYSTEMS or not InotifyWatcher.available():
+        log.info('Watching %s (%s) by polling every %ss', path, filesystem, poll_seconds)
+        return PollingWatcher(path, poll_seconds=poll_seconds)
+    log.info('Watching %s (%s) with inotify', path, filesystem)
+    return InotifyWatcher(path)
+
+
+def debounced_changes(watcher, debounce_seconds=2, max_wait_seconds=30, idle_timeout=60):
+    """
+    Block until there are changes, then keep collecting until no events have arrived
+    for `debounce_seconds` (or `max_wait_seconds` have passed), so a group of files
+    saved together is processed as one change.
+
+    Returns the set of changed relative paths, None if a full scan is required,
+    or an empty set if nothing happened within `idle_timeout` (so the caller can heartbeat).
+    """
+    changed = watcher.changes(idle_timeout)
+    if not changed:
+        return changed
+    started = time.time()
+    while time.time() - started < max_wait_seconds:
+        more = watcher.changes(debounce_seconds)
+        if more is None:
+            return None
+        if not more:
+            break
+        changed |= more
+    log.debug('Changes: %s', sorted(changed))
+    return changed
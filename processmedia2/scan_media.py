@@ -1,17 +1,19 @@
+import os
 import sys
 import re
+import subprocess
+from pathlib import Path
 import operator
 
 from calaldees.debug import postmortem
 from calaldees.files.exts import file_extension_regex
-from calaldees.files.scan import fast_scan_regex_filter
-from calaldees.files.folder_structure import FolderStructure
 from clint.textui.progress import bar as progress_bar
 
 from processmedia_libs import ALL_EXTS
-from processmedia_libs.scan import locate_primary_files, get_file_collection, PRIMARY_FILE_RANKED_EXTS
+from processmedia_libs.scan import locate_primary_files, iter_file_collections, chunks, FileHashLookup, PRIMARY_FILE_RANKED_EXTS
 from processmedia_libs.meta_manager import MetaManager
-from processmedia_libs.fileset_change_monitor import FilesetChangeMonitor
+from processmedia_libs.source_index import SourceIndex, regex_file_filter
+from processmedia_libs.watch import watcher_factory, debounced_changes
 
 import logging
 log = logging.getLogger(__name__)
@@ -28,20 +30,44 @@ IGNORE_SEARCH_EXTS_REGEX = file_extension_regex(('txt', ))
 
 # Main -------------------------------------------------------------------------
 
-def scan_media(**kwargs):
+def _source_index(**kwargs):
+    return SourceIndex(
+        path=kwargs['path_source'],
+        index_path=kwargs.get('source_index_path'),
+        file_filter=regex_file_filter(
+            file_regex=file_extension_regex(ALL_EXTS),
+            ignore_regex=DEFAULT_IGNORE_FILE_REGEX,
+        ),
+        fingerprint=kwargs.get('source_fingerprint'),
+        hash_workers=kwargs.get('source_hash_workers'),
+        walk_workers=kwargs.get('source_walk_workers'),
+    )
+
+
+def scan_media(source_index=None, changed_paths=None, **kwargs):
     """
+    source_index: reuse an already loaded index (watch mode)
+    changed_paths: only these source paths have changed (from filesystem events) -
+      only the file collections/meta that involve them are re-scanned
     """
 
-    meta = MetaManager(kwargs['path_meta'])
-    meta.load_all()
-
     log.info('1.) Read file structure into memory')
-    folder_structure = FolderStructure.factory(
-        path=kwargs['path_source'],
-        search_filter=fast_scan_regex_filter(
-            file_regex=file_extension_regex(ALL_EXTS),
-            ignore_regex=DEFAULT_IGNORE_FILE_REGEX,
-        )
+    # Only new/modified files are hashed - unchanged files are carried over from the persisted index
+    source_index = source_index or _source_index(**kwargs)
+    change_set = source_index.update(changed_paths)
+    if not any(change_set) and not kwargs.get('force'):
+        log.info('Source files have not changed since last successful scan. use `--force` to bypass this check')
+        return
+    folder_structure = source_index.folder_structure
+
+    meta = MetaManager(kwargs['path_meta'], meta_store=kwargs.get('meta_store'))
+    meta.load_all()
+    # Files unchanged since they were recorded in the meta keep their hash (first run without a persisted index)
+    source_index.seed_hashs(
+        (scan_data['relative'], scan_data.get('mtime'), scan_data.get('hash'))
+        for m in meta.meta.values()
+        for scan_data in m.scan_data.values()
+        if scan_data.get('relative')
     )
 
     log.info('2.) Locate primary files')
@@ -49,77 +75,173 @@ def scan_media(**kwargs):
     primary_files = locate_primary_files(folder_structure, file_regex=file_extension_regex(PRIMARY_FILE_RANKED_EXTS))
 
     log.info("3.) Find associated files as a 'file collection' (based on the name of the primary file)")
-    file_collections = {
-        f.file_no_ext: get_file_collection(folder_structure, f)
-        for f in primary_files
-    }
-
-    log.info('4.) Associate file_collections with existing metadata objects')
-    for name, file_collection in progress_bar(file_collections.items()):
-        meta.load(name)
-        m = meta.get(name)
-        for f in file_collection:
-            m.associate_file(f)
-        meta.save(name)
-
-    log.info('5.) Attempt to find associate unassociated files but finding them on the folder_structure in memory')
-    # TODO: The step in 5b (mtime and hash check) is not sufficent
-    #   We need to identify all unmatched files and generate a hash lookup and match them that way.
-    #   It may take longer but it's the only true way of matching a file.
-    #   It might in some cases be quicker because we don't need to craw the entire file structure in memory.
-
-    # These are meta items that have a filecollection matched,
-    # but that file collection is incomplete, so we have some child files missing
-    has_unassociated_files = operator.attrgetter('unassociated_files')
-    for m in filter(has_unassociated_files, meta.meta.values()):
-        for filename, scan_data in m.unassociated_files.items():
-
-            # 5a.) The unassociated file may not have been found in the inital collection scan,
-            # check it's original location and associate if it exists
-            f = folder_structure.get(scan_data.get('relative')) if scan_data.get('relative') else None
-            if f:
-                m.associate_file(f)
-                log.warning('Associating found missing file %s to %s - this should not be a regular occurance, move/rename this so it is grouped effectivly', f.relative, m.name)
-                continue
-
-            # 5b.) Search the whole folder_structure in memory for a matching hash
-            mtime = scan_data['mtime']
-            for f in folder_structure.scan(
-                lambda f:
-                    not IGNORE_SEARCH_EXTS_REGEX.search(f.file)
-                    and
-                    (f.file == filename or f.stats.st_mtime == mtime)  # TODO: Depricate this!
-                    and
-                    str(f.hash) == scan_data['hash']
-            ):
-                log.warning('Associating found missing file %s to %s - this should not be a regular occurance, move/rename this so it is grouped effectivly', f.relative, m.name)
-                m.associate_file(f)
-                break
-
-        # 5c.)
-        # We have done our best at locating missing files
-        # Remove them from the tracked list of files.
-        m.unlink_unassociated_files()
-
-    log.info('6.) Remove unmatched meta entrys')
-    for m in [m for m in meta.meta.values() if not m.file_collection]:
-        log.info('Removing meta %s', m.name)
-        meta.delete(m.name)
-
-    # (If processed data already exisits, it will be relinked at the encode level)
-
-    meta.save_all()
+    # Streamed folder by folder - the collections are never all held in memory at once
+    file_collections = progress_bar(iter_file_collections(folder_structure, primary_files), expected_size=len(primary_files))
+    if changed_paths is not None:
+        affected_relatives = set(changed_paths) | change_set.added | change_set.removed | change_set.modified | change_set.moved.keys() | set(change_set.moved.values())
+        affected_names = {os.path.splitext(os.path.basename(relative))[0] for relative in affected_relatives}
+        file_collections = (
+            (name, file_collection)
+            for name, file_collection in file_collections
+            if name in affected_names or any(f.relative in affected_relatives for f in file_collection if f)
+        )
+
+    # Meta writes (and their summary updates) are batched for the whole scan
+    with meta.store.batch():
+        log.info('4.) Associate file_collections with existing metadata objects')
+        collection_names = set()
+        for file_collections_chunk in chunks(file_collections, 256):
+            # Full hashs are only needed for files that belong to a track (deferred when fingerprinting)
+            source_index.hash_files(f.relative for name, file_collection in file_collections_chunk for f in file_collection if f)
+            for name, file_collection in file_collections_chunk:
+                meta.load(name)
+                m = meta.get(name)
+                for f in file_collection:
+                    m.associate_file(f)
+                meta.save(name)
+                collection_names.add(name)
+
+        log.info('5.) Attempt to find associate unassociated files but finding them on the folder_structure in memory')
+        # Only hashs already in the index are searched - an orphan that has been deleted must not trigger hashing the whole library
+        file_hash_lookup = FileHashLookup(folder_structure, file_filter=lambda f: not IGNORE_SEARCH_EXTS_REGEX.search(f.file), key='known_hash')
+        file_fingerprint_lookup = FileHashLookup(folder_structure, file_filter=lambda f: not IGNORE_SEARCH_EXTS_REGEX.search(f.file), key='fingerprint')
+
+        # These are meta items that have a filecollection matched,
+        # but that file collection is incomplete, so we have some child files missing
+        if changed_paths is None:
+            metas = tuple(meta.meta.values())
+        else:
+            metas = tuple(
+                m for m in meta.meta.values()
+                if m.name in collection_names or any(scan_data.get('relative') in affected_relatives for scan_data in m.scan_data.values())
+            )
+        has_unassociated_files = operator.attrgetter('unassociated_files')
+        for m in filter(has_unassociated_files, metas):
+            for filename, scan_data in m.unassociated_files.items():
+
+                # 5a.) The source index has seen this file moved/renamed since the last scan
+                f = folder_structure.get(change_set.moved[scan_data['relative']]) if scan_data.get('relative') in change_set.moved else None
+                if f:
+                    m.associate_file(f)
+                    log.info('Associating moved file %s to %s', f.relative, m.name)
+                    continue
+
+                # 5b.) The unassociated file may not have been found in the inital collection scan,
+                # check it's original location and associate if it exists
+                f = folder_structure.get(scan_data.get('relative')) if scan_data.get('relative') else None
+                if f:
+                    m.associate_file(f)
+                    log.warning('Associating found missing file %s to %s - this should not be a regular occurance, move/rename this so it is grouped effectivly', f.relative, m.name)
+                    continue
+
+                # 5c.) Lookup a matching hash anywhere in the folder_structure
+                f = (
+                    (scan_data.get('fingerprint') and file_fingerprint_lookup.find(scan_data['fingerprint'], filename=filename, mtime=scan_data['mtime']))
+                    or
+                    file_hash_lookup.find(scan_data['hash'], filename=filename, mtime=scan_data['mtime'])
+                )
+                if f:
+                    log.warning('Associating found missing file %s to %s - this should not be a regular occurance, move/rename this so it is grouped effectivly', f.relative, m.name)
+                    m.associate_file(f)
+
+            # 5d.)
+            # We have done our best at locating missing files
+            # Remove them from the tracked list of files.
+            m.unlink_unassociated_files()
+
+        log.info('6.) Remove unmatched meta entrys')
+        for m in [m for m in metas if not m.file_collection]:
+            log.info('Removing meta %s', m.name)
+            meta.delete(m.name)
+
+        # (If processed data already exisits, it will be relinked at the encode level)
+
+        meta.save_all()
+    source_index.save()
+    return change_set
+
+
+def watch_media(**kwargs):
+    """
+    Daemon: scan once, then re-scan only the files reported changed by filesystem events.
+
+    The exclusive processmedia lock is only held while scanning. `watch_then` (e.g. encode+import)
+    is started in the background after a scan that found changes, so filesystem events are still
+    consumed (and collected) while it runs. Scans are deferred while `watch_then` or another
+    processmedia task holds the lock, and `watch_then` is never started while it is still running.
+    """
+    from _main import acquire_lock
+
+    source_index = _source_index(**kwargs)
+    watcher = watcher_factory(kwargs['path_source'], poll=kwargs.get('watch_poll'), poll_seconds=kwargs.get('watch_poll_seconds') or 60)
+    debounce_seconds = kwargs.get('watch_debounce_seconds') or 2
+    changed_paths = None  # Full scan on startup
+    scan_pending = True
+    then_process = None
+    then_pending = False
+    try:
+        while True:
+            then_running = then_process and then_process.poll() is None
+            lockfile = acquire_lock(kwargs['lockfile']) if scan_pending and not then_running else None
+            if lockfile:
+                try:
+                    change_set = scan_media(source_index=source_index, changed_paths=changed_paths, **kwargs)
+                    changed_paths = set()
+                except Exception:
+                    log.exception('Scan failed - rescanning everything on next change')
+                    source_index = _source_index(**kwargs)
+                    change_set = None
+                    changed_paths = None
+                finally:
+                    lockfile.close()
+                scan_pending = False
+                if change_set and any(change_set) and kwargs.get('watch_then'):
+                    then_pending = True
+            if then_pending and not then_running:
+                log.info('Running %s', kwargs['watch_then'])
+                then_process = subprocess.Popen(kwargs['watch_then'], shell=True)
+                then_pending = False
+            if kwargs.get('heartbeat_file'):
+                Path(kwargs['heartbeat_file']).touch()
+            changes = debounced_changes(watcher, debounce_seconds=debounce_seconds, idle_timeout=debounce_seconds if scan_pending or then_pending else 60)
+            if changes is None:
+                changed_paths = None
+            elif changed_paths is not None:
+                changed_paths |= changes
+            scan_pending = scan_pending or changes is None or bool(changes)
+    finally:
+        watcher.close()
+
+
+def _scan_or_watch_media(**kwargs):
+    if kwargs.get('watch'):
+        return watch_media(**kwargs)
+    change_set = scan_media(**kwargs)
+    if change_set is None:
+        # Non zero exit - processmedia2.sh only runs encode/import after a scan that found changes
+        sys.exit('Source files have not changed since last successful scan. Aborting. use `--force` to bypass this check')
+    return change_set
 
 
 # Main -------------------------------------------------------------------------
 
 def additional_arguments(parser):
     parser.add_argument('--disable_meta_write_safety', action='store_true', help="To prevent multiple process's conflicting. We keep track of meta/*.json file mtimes. If these files are modified by another process, we defensively don't overwrite these changes. This option is require by windows docker volumes mounts as the files take time to propergate to the windows filesystem and this upsets defensive mtime protection", default=False)
+    parser.add_argument('--watch', action='store_true', help='run as a daemon - re-scan files as soon as they change (inotify, or polling for network mounts)')
+    parser.add_argument('--watch_poll', action='store_true', default=None, help='always poll for changes instead of using inotify')
+    parser.add_argument('--watch_poll_seconds', action='store', type=int, help='seconds between polls (default: 60)')
+    parser.add_argument('--watch_debounce_seconds', action='store', type=float, help='wait for this many seconds without changes before scanning, so files saved together are grouped (default: 2)')
+    parser.add_argument('--watch_then', action='store', help='shell command started in the background after each scan that found changes (e.g. encode and import). Scans wait for it to finish')
+    parser.add_argument('--source_fingerprint', action='store_true', default=None, help='detect changed/moved source files by a sampled fingerprint (size + head/middle/tail blocks). Full hashs are only computed for new content')
+    parser.add_argument('--source_hash_workers', action='store', type=int, help='number of threads hashing new source files')
+    parser.add_argument('--source_walk_workers', action='store', type=int, help='number of threads listing source directories concurrently (network mounts benefit from more)')
+    parser.add_argument('--source_index_path', action='store', help='persisted index of source file path/inode/size/mtime/hash - only new or modified source files are re-hashed on each scan')
 
 
 if __name__ == "__main__":
     from _main import main
     main(
-        'scan_media', scan_media, folder_type_to_derive_mtime='source', version=VERSION,
+        'scan_media', _scan_or_watch_media, version=VERSION,
+        lock=lambda kwargs: not kwargs.get('watch'),  # The watch daemon takes the lock for each scan
         additional_arguments_function=additional_arguments,
     )
@@ -65,17 +65,17 @@ class ProcessMediaTestManagerBase(object):
         # TODO: Do we need to set `cmd_ffmpeg`, etc here? or are we happy with the defaults?
         return dict(path_meta=self.path_meta, path_source=self.path_source, path_processed=self.path_processed, force=True)  # , postmortem=True
 
-    def scan_media(self):
+    def scan_media(self, **kwargs):
         self.meta_manager._release_cache()
-        scan_media(**self.commandline_kwargs)
+        scan_media(**self.commandline_kwargs, **kwargs)
 
-    def encode_media(self, mock=None):
+    def encode_media(self, mock=None, **kwargs):
         self.meta_manager._release_cache()
         if mock:
             with MockEncodeExternalCalls():
-                encode_media(**self.commandline_kwargs)
+                encode_media(**self.commandline_kwargs, **kwargs)
         else:
-            encode_media(**self.commandline_kwargs)
+            encode_media(**self.commandline_kwargs, **kwargs)
 
     def cleanup_media(self):
         self.meta_manager._release_cache()
@@ -87,14 +87,14 @@ class ProcessMediaTestManagerBase(object):
         Dump of all the generated raw meta json files into python data structure
         """
         meta = {}
-        for filename in os.listdir(self.path_meta):
+        for filename in filter(lambda filename: filename.endswith('.json'), os.listdir(self.path_meta)):
             with open(os.path.join(self.path_meta, filename), 'r') as meta_filehandle:
                 meta[filename] = json.load(meta_filehandle)
         return meta
     @meta.setter
     def meta(self, data):
         self.meta_manager._release_cache()
-        for f in os.listdir(self.path_meta):
+        for f in filter(lambda filename: filename.endswith('.json'), os.listdir(self.path_meta)):
             os.remove(os.path.join(self.path_meta, f))
         for filename, meta_data in data.items():
             with open(os.path.join(self.path_meta, filename), 'w') as meta_filehandle:
@@ -127,14 +127,16 @@ class MockEncodeExternalCalls(object):
 
     def __init__(self, **kwargs):
         """
-        MockEncodeExternalCalls(encode_video=True, extract_image=False)
+        MockEncodeExternalCalls(encode_video=True, extract_images=False)
         """
         self.method_returns = dict(
             probe_media=self._mock_command_return_probe,
             encode_video=self._mock_command_return_success,
-            encode_audio=self._mock_command_return_success,
+            remux_video=self._mock_command_return_success,
+            probe_audio_peak=self._mock_command_return_audio_peak,
+            decode_test=self._mock_command_return_success,
             encode_preview_video=self._mock_command_return_success,
-            extract_image=self._mock_command_return_success,
+            extract_images=self._mock_command_return_success,
         )
         self.method_returns.update({
             method_name: self._mock_command_return_success if return_ok_or_fail else self._mock_command_return_fail
@@ -171,10 +173,17 @@ class MockEncodeExternalCalls(object):
     def _mock_command_return_probe(*args, **kwargs):
         return {'width': 1, 'height': 1, 'duration': 1}
 
+    @staticmethod
+    def _mock_command_return_audio_peak(*args, **kwargs):
+        return (True, -1.0)
+
     @staticmethod
     def _mock_command_return_success(*args, **kwargs):
-        if ('destination' in kwargs):
-            Path(kwargs['destination']).touch()
+        for key, destination in kwargs.items():
+            if key.endswith('destination') and destination:
+                Path(destination).touch()
+        for destination in kwargs.get('destinations', ()):
+            Path(destination).touch()
         return (True, 'Mock Success')
 
     @staticmethod
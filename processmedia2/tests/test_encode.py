@@ -1,6 +1,9 @@
 import pytest
 import os
 import subprocess
+import tempfile
+from unittest.mock import patch
+from pathlib import Path
 from io import BytesIO
 
 import pytesseract
@@ -9,7 +12,10 @@ from PIL import Image
 from calaldees.data import flatten
 from calaldees.color import color_distance, color_close
 
+from processmedia_libs import PENDING_ACTION
+from processmedia_libs.failure_ledger import FailureLedger
 import processmedia_libs.subtitle_processor as subtitle_processor
+import processmedia_libs.subtitle_processor_with_codecs as subtitle_processor_with_codecs
 from ._base import MockEncodeExternalCalls
 
 COLOR_SUBTITLE_CURRENT = (255, 255, 0)
@@ -135,17 +141,17 @@ def test_source_with_nosubs_will_still_create_empty_processed_srt_file(ProcessMe
         with MockEncodeExternalCalls() as patches:
             manager.encode_media()
             assert patches['encode_video'].call_count == 0
-            assert patches['encode_audio'].call_count == 0
+            assert patches['probe_audio_peak'].call_count == 0
             assert patches['encode_preview_video'].call_count == 0
-            assert patches['extract_image'].call_count == 0
+            assert patches['extract_images'].call_count == 0
 
         manager.scan_media()  # this should update the source collection and remove the meta reference to the srt file
         with MockEncodeExternalCalls() as patches:
             manager.encode_media()
             assert patches['encode_video'].call_count == 1
-            assert patches['encode_audio'].call_count == 1
-            assert patches['encode_preview_video'].call_count == 1
-            assert patches['extract_image'].call_count == 4
+            assert patches['probe_audio_peak'].call_count == 1
+            assert patches['encode_preview_video'].call_count == 0, 'The preview should be rendered by encode_video from the same decode'
+            assert patches['extract_images'].call_count == 1
 
         # A subtile file should still be derived
         os.path.exists(manager.get('test1').processed_files['srt'].absolute)
@@ -158,17 +164,124 @@ def test_skip_encoding_step_if_processed_file_present(ProcessMediaTestManager, T
         with MockEncodeExternalCalls() as patches:
             manager.encode_media()
             assert patches['encode_video'].call_count == 1
-            assert patches['encode_audio'].call_count == 1
-            assert patches['encode_preview_video'].call_count == 1
-            assert patches['extract_image'].call_count == 4
+            assert patches['probe_audio_peak'].call_count == 1
+            assert patches['encode_preview_video'].call_count == 0, 'The preview should be rendered by encode_video from the same decode'
+            assert patches['extract_images'].call_count == 1
 
         manager.scan_media()
         with MockEncodeExternalCalls() as patches:
             manager.encode_media()
             assert patches['encode_video'].call_count == 0
-            assert patches['encode_audio'].call_count == 0
+            assert patches['probe_audio_peak'].call_count == 0
             assert patches['encode_preview_video'].call_count == 0
-            assert patches['extract_image'].call_count == 0
+            assert patches['extract_images'].call_count == 0
+
+
+def test_encode_preview_from_primary_video_when_only_preview_is_missing(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
+        manager.scan_media()
+        manager.encode_media(mock=True)
+
+        m = manager.get('test1')
+        os.remove(m.processed_files['preview'].absolute)
+        m.pending_actions.append(PENDING_ACTION['encode'])
+        manager.meta_manager.save('test1')
+
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media()
+            assert patches['encode_video'].call_count == 0
+            assert patches['encode_preview_video'].call_count == 1
+
+
+def test_encode_remuxes_clean_source_without_subtitles(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES - {'test1.srt'}) as manager:
+        manager.scan_media()
+        mock = MockEncodeExternalCalls()
+        mock.method_returns['probe_media'] = lambda *args, **kwargs: {
+            'width': 1280, 'height': 720, 'duration': 1,
+            'video': {'format': 'h264', 'pix_fmt': 'yuv420p', 'bitrate': '1000'},
+        }
+        with mock as patches:
+            manager.encode_media()
+            assert patches['remux_video'].call_count == 1
+            assert patches['encode_video'].call_count == 0
+            assert patches['encode_preview_video'].call_count == 1, 'The video stream was not decoded, so the preview is rendered separately'
+        assert PENDING_ACTION['encode'] not in manager.get('test1').pending_actions
+        assert 'encode_seconds' not in manager.get('test1').source_details
+
+
+def test_encode_does_not_remux_when_subtitles_are_burnt_in(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
+        manager.scan_media()
+        mock = MockEncodeExternalCalls()
+        mock.method_returns['probe_media'] = lambda *args, **kwargs: {
+            'width': 1280, 'height': 720, 'duration': 1,
+            'video': {'format': 'h264', 'pix_fmt': 'yuv420p', 'bitrate': '1000'},
+        }
+        with mock as patches:
+            manager.encode_media()
+            assert patches['remux_video'].call_count == 0
+            assert patches['encode_video'].call_count == 1
+
+
+def test_encode_hls_renditions_reference_processed_files(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    from processmedia_libs.hls import HLS_RENDITIONS, hls_output_filenames
+    from processmedia_libs.processed_files_manager import ProcessedFilesManager
+
+    def mock_encode_hls(*args, destination_folder=None, renditions=(), **kwargs):
+        for index, _ in enumerate(renditions):
+            with open(os.path.join(destination_folder, f'stream_{index}.m3u8'), 'w') as filehandle:
+                filehandle.write(f'#EXTM3U\n#EXT-X-BYTERANGE:100@0\nstream_{index}.ts\n#EXT-X-ENDLIST\n')
+            Path(os.path.join(destination_folder, f'stream_{index}.ts')).touch()
+        with open(os.path.join(destination_folder, 'master.m3u8'), 'w') as filehandle:
+            filehandle.write('#EXTM3U\n' + ''.join(f'#EXT-X-STREAM-INF:BANDWIDTH=1\nstream_{index}.m3u8\n' for index, _ in enumerate(renditions)))
+        return (True, 'Mock Success')
+
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
+        manager.scan_media()
+        mock = MockEncodeExternalCalls()
+        mock.method_returns['encode_hls'] = mock_encode_hls
+        with mock as patches:
+            manager.encode_media(hls=True)
+            assert patches['encode_hls'].call_count == 1
+
+        processed_files = ProcessedFilesManager(manager.path_processed, hls_renditions=HLS_RENDITIONS).get_processed_files(manager.get('test1').source_hashs)
+        assert set(hls_output_filenames(HLS_RENDITIONS).keys()) <= set(processed_files.keys())
+        with open(processed_files['hls'].absolute, 'rt') as filehandle:
+            master = filehandle.read()
+        for rendition in HLS_RENDITIONS:
+            playlist = processed_files[f'hls_{rendition.name}_playlist']
+            assert os.path.relpath(playlist.absolute, os.path.dirname(processed_files['hls'].absolute)) in master
+            with open(playlist.absolute, 'rt') as filehandle:
+                assert os.path.relpath(processed_files[f'hls_{rendition.name}_media'].absolute, os.path.dirname(playlist.absolute)) in filehandle.read()
+        assert 'stream_' not in master
+
+
+def test_encode_preview_clip_is_encoded_separately_from_primary_video(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
+        manager.scan_media()
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media(preview_clip_seconds=30)
+            assert patches['encode_video'].call_count == 1
+            assert patches['encode_video'].call_args[1]['preview_destination'] is None
+            assert patches['encode_preview_video'].call_count == 1
+            assert patches['encode_preview_video'].call_args[1]['duration'] == 1, 'The source is shorter than the clip length'
+        assert PENDING_ACTION['encode'] not in manager.get('test1').pending_actions
+
+
+def test_encode_skips_name_locked_by_another_worker(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
+        manager.scan_media()
+
+        with manager.meta_manager.lock('test1') as locked:
+            assert locked
+            with MockEncodeExternalCalls() as patches:
+                manager.encode_media()
+                assert patches['encode_video'].call_count == 0, 'Another worker holds the lock for this name - it should not be encoded'
+
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media()
+            assert patches['encode_video'].call_count == 1
 
 
 def test_encode_video_not_multiple_of_2():
@@ -202,6 +315,101 @@ def test_encode_with_already_existing_files_still_extracts_duration(ProcessMedia
         assert manager.meta['test1.json']['processed']['duration'] == 1, 'The relinked meta should have probed a duration'
 
 
+def test_probe_results_are_cached_against_source_hash(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
+        manager.scan_media()
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media()
+            assert patches['probe_media'].call_count == 1
+
+        video_hash = manager.meta['test1.json']['scan']['test1.mp4']['hash']
+        assert manager.meta['test1.json']['probe'][video_hash]['duration'] == 1
+
+        # Force a re-encode of the primary video - the unchanged source should not be re-probed
+        m = manager.get('test1')
+        os.remove(m.processed_files['video'].absolute)
+        m.pending_actions.append(PENDING_ACTION['encode'])
+        manager.meta_manager.save('test1')
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media()
+            assert patches['encode_video'].call_count == 1
+            assert patches['probe_media'].call_count == 0
+
+
+def test_intermediate_files_are_reused_when_retrying_a_failed_encode(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager, tempfile.TemporaryDirectory() as intermediate_cache_path:
+        manager.scan_media()
+        with MockEncodeExternalCalls(encode_video=False), \
+             patch.object(subtitle_processor_with_codecs, 'parse_subtitles', wraps=subtitle_processor_with_codecs.parse_subtitles) as parse_subtitles:
+            manager.encode_media(intermediate_cache_path=intermediate_cache_path)
+            assert parse_subtitles.call_count == 3, 'srt + preflight + ssa intermediate'
+        assert PENDING_ACTION['encode'] in manager.get('test1').pending_actions
+
+        with MockEncodeExternalCalls() as patches, \
+             patch.object(subtitle_processor_with_codecs, 'parse_subtitles', wraps=subtitle_processor_with_codecs.parse_subtitles) as parse_subtitles:
+            manager.encode_media(intermediate_cache_path=intermediate_cache_path)
+            assert patches['encode_video'].call_count == 1
+            assert parse_subtitles.call_count == 1, 'preflight only - srt already processed + ssa intermediate from cache'
+        assert PENDING_ACTION['encode'] not in manager.get('test1').pending_actions
+
+
+def test_failed_source_is_not_retried_until_backoff_expires(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager, tempfile.TemporaryDirectory() as tempdir:
+        failure_ledger_path = os.path.join(tempdir, 'failures.json')
+        manager.scan_media()
+        with MockEncodeExternalCalls(encode_video=False) as patches:
+            manager.encode_media(failure_ledger_path=failure_ledger_path)
+            assert patches['encode_video'].call_count == 1
+        (failure, ) = FailureLedger(failure_ledger_path).failures.values()
+        assert failure['name'] == 'test1'
+        assert failure['failures'] == 1
+        assert 'primary_video' in failure['reason']
+
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media(failure_ledger_path=failure_ledger_path)
+            assert patches['encode_video'].call_count == 0, 'In backoff'
+
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media(failure_ledger_path=failure_ledger_path, retry_failed=True)
+            assert patches['encode_video'].call_count == 1
+        assert not FailureLedger(failure_ledger_path).failures
+        assert PENDING_ACTION['encode'] not in manager.get('test1').pending_actions
+
+
+def test_source_failing_decode_test_is_retried_with_backoff(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager, tempfile.TemporaryDirectory() as tempdir:
+        failure_ledger_path = os.path.join(tempdir, 'failures.json')
+        manager.scan_media()
+        with MockEncodeExternalCalls(decode_test=False) as patches:
+            manager.encode_media(failure_ledger_path=failure_ledger_path)
+            assert patches['decode_test'].call_count == 1
+            assert patches['probe_audio_peak'].call_count == 0
+            assert patches['encode_video'].call_count == 0
+            assert patches['extract_images'].call_count == 0
+        (failure, ) = FailureLedger(failure_ledger_path).failures.values()
+        assert not failure['quarantined'], 'A decode test failure may be transient'
+        assert 'preflight' in failure['reason']
+        assert 'Mock Failure' in failure['reason']
+
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media(failure_ledger_path=failure_ledger_path)
+            assert patches['decode_test'].call_count == 0, 'Backoff'
+
+
+def test_source_with_unparsable_subtitles_is_quarantined_without_encoding(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager, tempfile.TemporaryDirectory() as tempdir:
+        failure_ledger_path = os.path.join(tempdir, 'failures.json')
+        with open(os.path.join(manager.path_source, 'test1.srt'), 'w') as subtitle_filehandle:
+            subtitle_filehandle.write('not subtitles')
+        manager.scan_media()
+        with MockEncodeExternalCalls() as patches:
+            manager.encode_media(failure_ledger_path=failure_ledger_path)
+            assert patches['encode_video'].call_count == 0
+        (failure, ) = FailureLedger(failure_ledger_path).failures.values()
+        assert failure['quarantined']
+        assert 'unable to parse any subtitles' in failure['reason']
+
+
 def test_update_to_tag_file_does_not_reencode_video(ProcessMediaTestManager, TEST1_VIDEO_FILES):
     with ProcessMediaTestManager(TEST1_VIDEO_FILES) as manager:
 
@@ -220,9 +428,9 @@ def test_update_to_tag_file_does_not_reencode_video(ProcessMediaTestManager, TES
         with MockEncodeExternalCalls() as patches:
             manager.encode_media()
             assert patches['encode_video'].call_count == 0
-            assert patches['encode_audio'].call_count == 0
+            assert patches['probe_audio_peak'].call_count == 0
             assert patches['encode_preview_video'].call_count == 0
-            assert patches['extract_image'].call_count == 0
+            assert patches['extract_images'].call_count == 0
 
         hash_dict_tag_changed = manager.get('test1').source_hashs
         assert hash_dict_before['media'] == hash_dict_tag_changed['media']
@@ -243,9 +451,9 @@ def test_update_to_tag_file_does_not_reencode_video(ProcessMediaTestManager, TES
         with MockEncodeExternalCalls() as patches:
             manager.encode_media()
             assert patches['encode_video'].call_count == 1
-            assert patches['encode_audio'].call_count == 1
-            assert patches['encode_preview_video'].call_count == 1
-            assert patches['extract_image'].call_count == 4
+            assert patches['probe_audio_peak'].call_count == 1
+            assert patches['encode_preview_video'].call_count == 0, 'The preview should be rendered by encode_video from the same decode'
+            assert patches['extract_images'].call_count == 1
 
         hash_dict_subs_changed = manager.get('test1').source_hashs
         assert hash_dict_tag_changed['media'] != hash_dict_subs_changed['media']
@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+from processmedia_libs.encode_scheduler import (
+    _pixel_seconds, seconds_per_pixel_second, estimate_costs, DEFAULT_SECONDS_PER_PIXEL_SECOND,
+    shortest_job_first, newest_upload_first, deadline,
+)
+
+
+class FakeMeta(object):
+    def __init__(self, name, source_details, uploaded=0):
+        self.name = name
+        self.source_details = source_details
+        self.uploaded = uploaded
+
+
+@pytest.fixture
+def metas():
+    return (
+        FakeMeta('long_old', {'duration': 20, 'width': 1, 'height': 1}, uploaded=1),
+        FakeMeta('long_new', {'duration': 20, 'width': 1, 'height': 1}, uploaded=4),
+        FakeMeta('short_old', {'duration': 5, 'width': 1, 'height': 1}, uploaded=2),
+        FakeMeta('short_new', {'duration': 5, 'width': 1, 'height': 1}, uploaded=3),
+    )
+
+
+def names(metas):
+    return [m.name for m in metas]
+
+
+def test_pixel_seconds():
+    assert _pixel_seconds(FakeMeta('a', {'duration': 10, 'width': 4, 'height': 2})) == 80
+    assert _pixel_seconds(FakeMeta('a', {'duration': 10})) is None
+
+
+def test_seconds_per_pixel_second():
+    assert seconds_per_pixel_second((
+        FakeMeta('a', {'duration': 10, 'width': 1, 'height': 1, 'encode_seconds': 5}),
+        FakeMeta('b', {'duration': 10, 'width': 1, 'height': 1, 'encode_seconds': 2}),
+        FakeMeta('c', {'duration': 10, 'width': 1, 'height': 1, 'encode_seconds': 100}),
+        FakeMeta('d', {'duration': 10, 'width': 1, 'height': 1}),
+    )) == 0.5
+    assert seconds_per_pixel_second(()) == DEFAULT_SECONDS_PER_PIXEL_SECOND
+
+
+def test_estimate_costs():
+    assert estimate_costs((
+        FakeMeta('a', {'duration': 10, 'width': 2, 'height': 1}),
+        FakeMeta('b', {'duration': 30, 'width': 2, 'height': 1}),
+        FakeMeta('c', {}),
+    ), rate=0.5) == {'a': 10.0, 'b': 30.0, 'c': 20.0}
+
+
+def test_shortest_job_first(metas):
+    assert names(shortest_job_first(metas)) == ['short_new', 'short_old', 'long_new', 'long_old']
+
+
+def test_newest_upload_first(metas):
+    assert names(newest_upload_first(metas)) == ['long_new', 'short_new', 'short_old', 'long_old']
+
+
+def test_deadline(metas):
+    now = datetime.datetime(2000, 1, 1, 12, 0, 0)
+    assert names(deadline(metas, deadline='2000-01-01T12:00:25', now=now, encode_rate=1)) == ['short_new', 'short_old', 'long_new', 'long_old']
+    assert names(deadline(metas, deadline='2000-01-01T12:00:25', now=now, encode_rate=1, workers=4)) == ['long_new', 'short_new', 'short_old', 'long_old']
@@ -1,11 +1,16 @@
 import json
 import os.path
+import sys
+
+import pytest
 
 
 
 def test_probe_media(path_source_reference, external_tools):
     filename_video = os.path.join(path_source_reference, 'test1.mp4')
-    assert json.dumps(external_tools.probe_media(filename_video), sort_keys=True) == '{"audio": {"bitrate": "2", "format": "aac", "sample_rate": "44100"}, "duration": 30.02, "height": 480, "width": 640}'
+    probe = external_tools.probe_media(filename_video)
+    assert json.dumps({k: v for k, v in probe.items() if k != 'video'}, sort_keys=True) == '{"audio": {"bitrate": "2", "format": "aac", "sample_rate": "44100"}, "duration": 30.02, "height": 480, "width": 640}'
+    assert probe['video']['format'] == 'h264'
 
 
 def test_get_image_from_video(path_source_reference):
@@ -15,3 +20,53 @@ def test_get_image_from_video(path_source_reference):
     assert color_close((255, 0, 0), get_frame_from_video(filename_video, 0).getpixel((0,0)))
     assert color_close((0, 255, 0), get_frame_from_video(filename_video, '10').getpixel((0,0)))
     assert color_close((0, 0, 255), get_frame_from_video(filename_video, '00:00:20').getpixel((0,0)))
+
+
+def test_encode_video_chunked(path_source_reference, external_tools, tmpdir):
+    from .test_encode import get_frame_from_video
+    from calaldees.color import color_close
+    filename_video = os.path.join(path_source_reference, 'test1.mp4')
+    destination = os.path.join(tmpdir, 'video.mp4')
+    preview_destination = os.path.join(tmpdir, 'preview.mp4')
+
+    encode_success, cmd_result = external_tools.encode_video(
+        video_source=filename_video,
+        audio_source=filename_video,
+        subtitle_source=None,
+        destination=destination,
+        preview_destination=preview_destination,
+        audio_duration=30.02,
+        chunk_seconds=10,
+    )
+    assert encode_success, cmd_result
+
+    for filename in (destination, preview_destination):
+        probe = external_tools.probe_media(filename)
+        assert abs(probe['duration'] - 30.02) < 0.5
+        assert probe['audio']['format'] == 'aac'
+    assert color_close((255, 0, 0), get_frame_from_video(destination, 5).getpixel((0,0)))
+    assert color_close((0, 255, 0), get_frame_from_video(destination, 15).getpixel((0,0)))
+    assert color_close((0, 0, 255), get_frame_from_video(destination, 25).getpixel((0,0)))
+
+
+def test_run_process_returns_exit_code_and_usage(external_tools):
+    external_tools.reset_usage()
+    result = external_tools._run_process((sys.executable, '-c', 'import sys; sum(range(3000000)); print("done"); sys.exit(3)'))
+    assert result.returncode == 3
+    assert result.stdout.strip() == b'done'
+    assert external_tools.usage['runs'] == 1
+    assert external_tools.usage['cpu_seconds'] > 0
+
+
+def test_run_process_is_reaped_when_interrupted(external_tools):
+    pids = []
+    def progress(block):
+        pids.append(block['frame'])
+        raise KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        external_tools._run_process(
+            (sys.executable, '-c', 'import os, time; print(f"frame={os.getpid()}"); print("progress=continue", flush=True); time.sleep(60)'),
+            progress=progress,
+        )
+    with pytest.raises(ProcessLookupError):
+        os.kill(pids[0], 0)
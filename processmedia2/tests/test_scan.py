@@ -1,4 +1,10 @@
 import os
+import json
+import tempfile
+from unittest.mock import patch
+
+from processmedia_libs import source_index
+from processmedia_libs.meta_manager import MetaManager
 
 
 def test_scan_grouping(ProcessMediaTestManager, TEST1_VIDEO_FILES, TEST2_AUDIO_FILES):
@@ -41,6 +47,139 @@ def test_scan_grouping(ProcessMediaTestManager, TEST1_VIDEO_FILES, TEST2_AUDIO_F
             'test2.txt should have been grouped with test2'
 
 
+def test_scan_source_index(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as scan, tempfile.TemporaryDirectory() as tempdir:
+        source_index_path = os.path.join(tempdir, 'source_index.json')
+        with patch.object(source_index, 'hash_file', wraps=source_index.hash_file) as hash_file:
+            scan.scan_media(source_index_path=source_index_path)
+            assert hash_file.call_count == len(TEST1_VIDEO_FILES)
+            subtitle_hash = scan.meta['test1.json']['scan']['test1.srt']['hash']
+
+            # Nothing has changed - no files are read and meta is untouched
+            hash_file.reset_mock()
+            scan.scan_media(source_index_path=source_index_path)
+            assert hash_file.call_count == 0
+
+            # A renamed file is a `move` in the index - re-associated without being re-hashed
+            os.rename(os.path.join(scan.path_source, 'test1.srt'), os.path.join(scan.path_source, 'testX.srt'))
+            scan.scan_media(source_index_path=source_index_path)
+            assert hash_file.call_count == 0
+            assert scan.meta['test1.json']['scan']['testX.srt']['hash'] == subtitle_hash
+
+
+def test_scan_source_index_hash_matches_folder_structure(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    """
+    Meta created before the source index (by FolderStructure) must not see every source hash change
+    """
+    from calaldees.files.folder_structure import FolderStructure
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as scan:
+        folder_structure = FolderStructure.factory(path=scan.path_source)
+        scan.scan_media()
+        for scan_data in scan.meta['test1.json']['scan'].values():
+            assert scan_data['hash'] == folder_structure.get(scan_data['relative']).hash
+
+
+def test_scan_source_index_seeded_from_meta(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    """
+    Without a persisted index (first run), files unchanged since the meta was written are not read
+    """
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as scan, tempfile.TemporaryDirectory() as tempdir:
+        scan.scan_media()
+        source_index_path = os.path.join(tempdir, 'source_index.json')
+        with patch.object(source_index, 'hash_file', wraps=source_index.hash_file) as hash_file:
+            scan.scan_media(source_index_path=source_index_path)
+            assert hash_file.call_count == 0
+        with open(source_index_path, 'rt') as filehandle:
+            assert {values[3] for values in json.load(filehandle).values()} == {scan_data['hash'] for scan_data in scan.meta['test1.json']['scan'].values()}
+
+
+def test_scan_source_fingerprint(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as scan, tempfile.TemporaryDirectory() as tempdir:
+        source_index_path = os.path.join(tempdir, 'source_index.json')
+        with patch.object(source_index, 'hash_file', wraps=source_index.hash_file) as hash_file:
+            scan.scan_media(source_index_path=source_index_path, source_fingerprint=True)
+            assert hash_file.call_count == len(TEST1_VIDEO_FILES)
+            video_data = scan.meta['test1.json']['scan']['test1.mp4']
+            assert video_data['fingerprint']
+
+            # A touched file is detected by it's fingerprint - the full hash is not recomputed
+            hash_file.reset_mock()
+            os.utime(os.path.join(scan.path_source, 'test1.mp4'), (1, 1))
+            scan.scan_media(source_index_path=source_index_path, source_fingerprint=True)
+            assert hash_file.call_count == 0
+            assert scan.meta['test1.json']['scan']['test1.mp4']['hash'] == video_data['hash']
+            assert scan.meta['test1.json']['scan']['test1.mp4']['mtime'] == 1
+
+
+def test_scan_changed_paths(ProcessMediaTestManager, TEST1_VIDEO_FILES, TEST2_AUDIO_FILES):
+    """
+    Watch mode only re-scans the file collections involving the changed paths
+    """
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES | TEST2_AUDIO_FILES - {'test2.txt'}) as scan, tempfile.TemporaryDirectory() as tempdir:
+        source_index_path = os.path.join(tempdir, 'source_index.json')
+        scan.scan_media(source_index_path=source_index_path)
+
+        with open(os.path.join(scan.path_source, 'test2.txt'), 'w') as tags_filehandle:
+            tags_filehandle.write('title:test2\n')
+        os.remove(os.path.join(scan.path_source, 'test1.srt'))
+        with patch.object(source_index, 'hash_file', wraps=source_index.hash_file) as hash_file:
+            scan.scan_media(source_index_path=source_index_path, changed_paths={'test2.txt'})
+            assert hash_file.call_count == 1
+        meta = scan.meta
+        assert set(meta['test2.json']['scan'].keys()) == {'test2.ogg', 'test2.txt', 'test2.ssa', 'test2.png'}
+        assert set(meta['test1.json']['scan'].keys()) == {'test1.mp4', 'test1.srt', 'test1.txt'}, \
+            'test1 was not reported as changed, so should not have been re-scanned'
+
+        scan.scan_media(source_index_path=source_index_path, changed_paths={'test1.srt'})
+        assert set(scan.meta['test1.json']['scan'].keys()) == {'test1.mp4', 'test1.txt'}
+
+
+def test_scan_sqlite_meta_store(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as scan:
+        scan.scan_media(meta_store='sqlite')
+        assert not scan.meta, 'No json meta files should be written'
+        meta_manager = MetaManager(scan.path_meta, meta_store='sqlite')
+        meta_manager.load_all()
+        assert set(meta_manager.get('test1').scan_data.keys()) == {'test1.mp4', 'test1.srt', 'test1.txt'}
+
+
+def test_scan_meta_summaries(ProcessMediaTestManager, TEST1_VIDEO_FILES, TEST2_AUDIO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES | TEST2_AUDIO_FILES) as scan:
+        scan.scan_media()
+        summaries = scan.meta_manager.summaries()
+        assert summaries.keys() == {'test1', 'test2'}
+        assert summaries['test1']['pending_actions'] == scan.meta['test1.json']['actions']
+
+        # Meta modified outside of the MetaManager is detected by it's version and re-summarised
+        meta = scan.meta
+        meta['test1.json']['actions'] = ['test_action']
+        del meta['test2.json']
+        scan.meta = meta
+        summaries = scan.meta_manager.summaries()
+        assert summaries.keys() == {'test1'}
+        assert summaries['test1']['pending_actions'] == ['test_action']
+
+
+def test_scan_meta_dirty_tracking(ProcessMediaTestManager, TEST1_VIDEO_FILES):
+    with ProcessMediaTestManager(TEST1_VIDEO_FILES) as scan:
+        scan.scan_media()
+        scan.meta_manager.load('test1')
+        m = scan.meta_manager.get('test1')
+        assert not m.has_updated()
+
+        # Nested changes are tracked
+        m.source_details.setdefault('hashs', {})['full'] = 'test_hash'
+        assert m.has_updated()
+        scan.meta_manager.save('test1')
+        assert not m.has_updated()
+        assert scan.meta['test1.json']['processed']['hashs']['full'] == 'test_hash'
+
+        # Unchanged meta is not rewritten
+        version = scan.meta_manager.store.version('test1')
+        scan.meta_manager.save_all()
+        assert scan.meta_manager.store.version('test1') == version
+
+
 def test_scan_yaml_overrides():
     """
     TODO
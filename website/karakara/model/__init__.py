@@ -1,5 +1,5 @@
 __all__ = [
-    "DBSession", "Base", "init_DBSession", "init_DBSession_tables", "clear_DBSession_tables", "commit"
+    "DBSession", "Base", "init_DBSession", "init_DBSession_tables", "upgrade_DBSession_enums", "clear_DBSession_tables", "commit"
     "JSONEncodedDict",
 ]
 
@@ -72,6 +72,29 @@ def init_DBSession_tables():
     """
     log.info("Create all tables (if needed) that are bound to DeclarativeBase")
     Base.metadata.create_all(bind=DBSession.bind, checkfirst=True)
+    upgrade_DBSession_enums()
+
+def upgrade_DBSession_enums():
+    """
+    create_all(checkfirst=True) never alters a type that already exists.
+    Add any enum values that are new in the model (e.g. attachment_types 'hls') to an existing postgres database.
+    (sqlite databases are only used for development/tests and are recreated)
+    """
+    if DBSession.bind.dialect.name != 'postgresql':
+        return
+    from sqlalchemy import Enum, text
+    enums = {
+        column.type.name: column.type
+        for table in Base.metadata.tables.values()
+        for column in table.columns
+        if isinstance(column.type, Enum) and column.type.name
+    }
+    # ALTER TYPE ... ADD VALUE cannot be run inside a transaction block (before postgres 12)
+    with DBSession.bind.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        for name, enum in enums.items():
+            for value in enum.enums:
+                connection.execute(text("ALTER TYPE {} ADD VALUE IF NOT EXISTS '{}'".format(name, value.replace("'", "''"))))
 
 def clear_DBSession_tables():
     log.info("Drop all tables that are bound to DeclarativeBase")
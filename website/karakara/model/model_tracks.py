@@ -15,7 +15,7 @@ __all__ = [
     "Track", "Tag", "Attachment", "_attachment_types",
 ]
 
-_attachment_types = Enum('video', 'preview', 'srt', 'image', 'tags', name="attachment_types")
+_attachment_types = Enum('video', 'preview', 'srt', 'image', 'tags', 'hls', 'hls_rendition', name="attachment_types")
 
 
 class TrackTagMapping(Base):